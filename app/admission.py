@@ -0,0 +1,186 @@
+import asyncio
+import heapq
+import itertools
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from config import settings
+from app.metrics import metrics, stage_seconds
+
+# Sessions whose token buckets are kept; the least recently seen are dropped
+MAX_TRACKED_SESSIONS = 10000
+
+# Priority classes, served lowest first
+PRIORITY_USER = 0
+RETURNING_SESSION = 1
+NEW_SESSION = 2
+
+ADMITTED = "admitted"
+DEGRADED = "degraded"
+
+admission_decisions = metrics.counter(
+    "chatbot_admission_decisions_total",
+    "Chat requests by admission decision (admitted, queued, degraded or rejected) and reason",
+    ["decision", "reason"]
+)
+
+
+class AdmissionRejected(Exception):
+    """A chat request is turned away; `retry_after` is a hint in seconds for the client."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Allows bursts of `capacity` requests, refilled at `rate` tokens per second."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """Take a token; returns 0 on success, else the seconds until one is available."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class AdmissionController:
+    """Decides which chat requests reach the LLM, and when.
+
+    At most `admission_max_concurrency` requests are answered at once; the
+    rest wait in a priority queue where priority users come first, then
+    returning sessions, then new ones, each in arrival order. A full queue
+    makes room for a request of a higher class by dropping its last waiter
+    of a lower one. A request that finds the queue full, is dropped from it
+    or waits longer than the queue timeout is answered from the knowledge
+    base alone (or rejected, depending on `admission_overflow`), so latency
+    under a spike stays bounded. Each session also has a token bucket
+    limiting its request rate.
+
+    Waiting happens on the event loop, so queued requests hold no threads.
+    Limits apply per worker process.
+    """
+
+    def __init__(self):
+        self.active = 0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._sequence = itertools.count()
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def priority(self, returning: bool, user_id: Optional[str] = None) -> int:
+        if user_id and user_id in settings.admission_priority_users:
+            return PRIORITY_USER
+        return RETURNING_SESSION if returning else NEW_SESSION
+
+    def _check_rate(self, session_id: str):
+        rate = settings.admission_session_rate_per_minute / 60
+        if not rate:
+            return
+        bucket = self._buckets.pop(session_id, None) or TokenBucket(rate, settings.admission_session_burst)
+        self._buckets[session_id] = bucket
+        if len(self._buckets) > MAX_TRACKED_SESSIONS:
+            self._buckets.popitem(last=False)
+        wait = bucket.take()
+        if wait:
+            admission_decisions.inc(decision="rejected", reason="rate_limit")
+            raise AdmissionRejected("Too many messages, please slow down", wait)
+
+    def _overflow(self, reason: str) -> str:
+        if settings.admission_overflow == "reject":
+            admission_decisions.inc(decision="rejected", reason=reason)
+            raise AdmissionRejected("The assistant is busy, please try again shortly",
+                                    settings.admission_queue_timeout_seconds)
+        admission_decisions.inc(decision="degraded", reason=reason)
+        return DEGRADED
+
+    async def acquire(self, session_id: Optional[str], returning: bool, user_id: Optional[str] = None) -> str:
+        """Wait for a slot for a chat request.
+
+        Returns ADMITTED, and the caller must `release` the slot when done, or
+        DEGRADED when the request should be answered without the LLM. Raises
+        AdmissionRejected when the request is turned away. Requests that start
+        a new session have no token bucket yet.
+        """
+        if session_id:
+            self._check_rate(session_id)
+
+        limit = settings.admission_max_concurrency
+        if not limit or (self.active < limit and not self._waiters):
+            self.active += 1
+            admission_decisions.inc(decision="admitted", reason="free_slot")
+            return ADMITTED
+
+        priority = self.priority(returning, user_id)
+        if len(self._waiters) >= settings.admission_max_queue:
+            if not self._waiters or not self._displace(priority):
+                return self._overflow("queue_full")
+
+        future = asyncio.get_running_loop().create_future()
+        entry = (priority, next(self._sequence), future)
+        heapq.heappush(self._waiters, entry)
+        start = time.perf_counter()
+        try:
+            await asyncio.wait({future}, timeout=settings.admission_queue_timeout_seconds or None)
+        except BaseException:
+            if future.done() and future.result() == ADMITTED:
+                # The slot was handed over just before the request was cancelled
+                self.release(ADMITTED)
+            raise
+        finally:
+            if not future.done():
+                # Timed out, or the request itself was cancelled while waiting
+                future.cancel()
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+            stage_seconds.observe(time.perf_counter() - start, stage="admission_queue")
+
+        if future.cancelled():
+            return self._overflow("queue_timeout")
+        if future.result() != ADMITTED:
+            return self._overflow("displaced")
+        admission_decisions.inc(decision="queued", reason="slot_released")
+        return ADMITTED
+
+    def _displace(self, priority: int) -> bool:
+        """Make room in a full queue by dropping its last waiter of a lower priority class."""
+        last = max(self._waiters)
+        if last[0] <= priority:
+            return False
+        self._waiters.remove(last)
+        heapq.heapify(self._waiters)
+        last[2].set_result(DEGRADED)
+        return True
+
+    def release(self, decision: str):
+        """Give back the slot of an admitted request, to the first waiter if there is one."""
+        if decision != ADMITTED:
+            return
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(ADMITTED)  # The slot passes on; active stays the same
+                return
+        self.active -= 1
+
+
+# Global admission controller instance
+admission_controller = AdmissionController()
+
+metrics.register_collector(lambda: [
+    ("chatbot_admission_active", "Chat requests currently holding an admission slot", admission_controller.active),
+    ("chatbot_admission_queued", "Chat requests waiting for an admission slot", admission_controller.queued)
+])
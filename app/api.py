@@ -1,23 +1,47 @@
+import asyncio
+import math
+import secrets
 import uuid
+from datetime import datetime
 from typing import List, Optional
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, Header, HTTPException, Query, Request, WebSocket, WebSocketDisconnect, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, PlainTextResponse, Response, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+import orjson
 from sqlalchemy.orm import Session
 
 from app.models import (
     ChatRequest, ChatResponse, ConversationHistory, 
-    KnowledgeBaseItem, HealthCheck
+    KnowledgeBaseItem, HealthCheck, BatchChatRequest, BatchChatResponse
 )
-from app.database import get_db, DatabaseManager, init_db
+from app.database import get_db, DatabaseManager, SessionLocal
 from app.chatbot import chatbot
-from app.knowledge_base import initialize_knowledge_base
+from app.admission import DEGRADED, AdmissionRejected, admission_controller
+from app.cancellation import CancellationToken, RequestCancelled, run_until_disconnected
+from app.export import stream_export
+from app.knowledge_sync import knowledge_sync
+from app.retention import retention_manager
+from app.suggest import suggestion_service
+from app.tenants import InvalidTenant, validate_tenant
+from app.realtime import AnswerStreamHandler, connection_manager
+from app.metrics import metrics
+from app.profiling import ProfilingMiddleware, profile_in_thread, profiling_controller
+from app.warmup import start_application, warmup_state
+from app.serialization import (
+    json_response, knowledge_item_dict, knowledge_rows_response
+)
 from config import settings
 
+# Non-standard status logged for requests whose client went away (as in nginx)
+CLIENT_CLOSED_REQUEST = 499
+
 # Create FastAPI app
 app = FastAPI(
     title="Customer Support Chatbot API",
     description="A LangChain-powered customer support chatbot with RAG capabilities",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # Add CORS middleware
@@ -29,14 +53,49 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Add profiling middleware (idle until a sample rate or slow threshold is set)
+app.add_middleware(ProfilingMiddleware)
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Check the admin token; admin endpoints stay closed until one is configured."""
+    if not settings.admin_token:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Admin endpoints are disabled until ADMIN_TOKEN is set"
+        )
+    if x_admin_token is None or not secrets.compare_digest(
+        x_admin_token.encode(), settings.admin_token.encode()
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Invalid admin token"
+        )
+
+
+def get_tenant(x_tenant_id: Optional[str] = Header(None)) -> str:
+    """The tenant whose knowledge base a request uses, from the X-Tenant-ID header."""
+    try:
+        return validate_tenant(x_tenant_id)
+    except InvalidTenant as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+
+
+def too_many_requests(error: AdmissionRejected) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail=str(error),
+        headers={"Retry-After": str(max(1, math.ceil(error.retry_after)))}
+    )
+
 
 @app.on_event("startup")
 async def startup_event():
-    """Initialize database and knowledge base on startup."""
-    print("Initializing application...")
-    init_db()
-    initialize_knowledge_base()
-    print("Application initialized successfully!")
+    """Initialize database and start warming up caches."""
+    await start_application()
 
 
 @app.get("/", response_model=HealthCheck)
@@ -51,12 +110,84 @@ async def health_check():
     return HealthCheck()
 
 
+@app.get("/health/live", response_model=HealthCheck)
+async def liveness():
+    """Liveness probe: the process is up and serving requests."""
+    return HealthCheck()
+
+
+@app.get("/health/ready")
+async def readiness():
+    """Readiness probe: 200 once warm-up has finished, 503 until then."""
+    return json_response(warmup_state.snapshot(), status_code=200 if warmup_state.ready else 503)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Expose pipeline metrics in the Prometheus text format."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get("/admin/profiles", dependencies=[Depends(require_admin)])
+async def list_profiles():
+    """List captured request profiles, newest first."""
+    return json_response({
+        "profiling": profiling_controller.status(),
+        "profiles": profiling_controller.store.list()
+    })
+
+
+@app.get("/admin/profiles/{profile_id}", response_class=PlainTextResponse, dependencies=[Depends(require_admin)])
+async def get_profile(profile_id: int):
+    """Get a captured profile as pstats text or collapsed stacks."""
+    profile = profiling_controller.store.get(profile_id)
+    if not profile:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Profile not found"
+        )
+    return PlainTextResponse(profile.get("pstats") or profile.get("collapsed") or "")
+
+
+@app.put("/admin/profiling", dependencies=[Depends(require_admin)])
+async def configure_profiling(
+    sample_rate: Optional[float] = None,
+    slow_threshold_ms: Optional[float] = None
+):
+    """Change the profiling sample rate and slow request threshold at runtime."""
+    profiling_controller.configure(sample_rate, slow_threshold_ms)
+    return json_response(profiling_controller.status())
+
+
+@app.delete("/admin/profiles", dependencies=[Depends(require_admin)])
+async def clear_profiles():
+    """Drop all captured profiles."""
+    profiling_controller.store.clear()
+    return json_response({"message": "Profiles cleared successfully"})
+
+
 @app.post("/chat", response_model=ChatResponse)
 async def chat(
     request: ChatRequest,
-    db: Session = Depends(get_db)
+    http_request: Request,
+    db: Session = Depends(get_db),
+    tenant: str = Depends(get_tenant)
 ):
-    """Main chat endpoint."""
+    """Main chat endpoint.
+    
+    If the client disconnects before the answer is ready, generation stops
+    at the next step and nothing is saved. Under load the request may wait
+    for admission, get a knowledge base answer or a 429.
+    """
+    try:
+        decision = await admission_controller.acquire(
+            request.session_id,
+            returning=request.session_id is not None,
+            user_id=request.user_id
+        )
+    except AdmissionRejected as e:
+        raise too_many_requests(e)
+    
     try:
         # Generate session ID if not provided
         session_id = request.session_id or str(uuid.uuid4())
@@ -65,25 +196,253 @@ async def chat(
         db_manager = DatabaseManager(db)
         
         # Get response from chatbot
-        result = chatbot.get_response(
+        token = CancellationToken("http")
+        result = await run_until_disconnected(
+            http_request,
+            token,
+            chatbot.get_response,
             user_message=request.message,
             session_id=session_id,
-            db_manager=db_manager
-        )
-        
-        return ChatResponse(
-            response=result["response"],
-            session_id=result["session_id"],
-            conversation_id=result["conversation_id"],
-            sources=result["sources"],
-            confidence=result["confidence"]
+            db_manager=db_manager,
+            category=request.category,
+            cancellation=token,
+            kb_only=decision == DEGRADED,
+            tenant_id=tenant
         )
         
+        # The chatbot result already has the ChatResponse shape
+        return json_response(result)
+    
+    except RequestCancelled:
+        # Nobody is listening any more
+        return Response(status_code=CLIENT_CLOSED_REQUEST)
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error processing chat request: {str(e)}"
         )
+    finally:
+        admission_controller.release(decision)
+
+
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest, tenant: str = Depends(get_tenant)):
+    """Chat with the answer streamed as server-sent events.
+    
+    Each event's data is a JSON object like the WebSocket events: `chunk`
+    events carry answer tokens (when LLM streaming is on) and a final
+    `response` event the full ChatResponse. Closing the stream cancels
+    generation and nothing is saved. Admission control applies as for /chat.
+    """
+    try:
+        decision = await admission_controller.acquire(
+            request.session_id,
+            returning=request.session_id is not None,
+            user_id=request.user_id
+        )
+    except AdmissionRejected as e:
+        raise too_many_requests(e)
+    
+    session_id = request.session_id or str(uuid.uuid4())
+    token = CancellationToken("sse")
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    
+    def respond():
+        # Uses its own session, as the stream may be abandoned while this runs
+        db = SessionLocal()
+        try:
+            return chatbot.get_response(
+                user_message=request.message,
+                session_id=session_id,
+                db_manager=DatabaseManager(db),
+                category=request.category,
+                callbacks=[AnswerStreamHandler(loop, queue)],
+                cancellation=token,
+                kb_only=decision == DEGRADED,
+                tenant_id=tenant
+            )
+        finally:
+            db.close()
+    
+    def event(data: dict) -> bytes:
+        return b"data: " + orjson.dumps(data) + b"\n\n"
+    
+    async def events():
+        task = asyncio.ensure_future(run_in_threadpool(profile_in_thread(respond)))
+        # The slot is held until the worker thread is done, even if the client left
+        task.add_done_callback(lambda finished: admission_controller.release(decision))
+        getter = None
+        try:
+            while not task.done() or not queue.empty():
+                getter = asyncio.ensure_future(queue.get())
+                await asyncio.wait({getter, task}, return_when=asyncio.FIRST_COMPLETED)
+                if getter.done():
+                    yield event(getter.result())
+                else:
+                    getter.cancel()
+            yield event({"type": "response", **task.result()})
+        finally:
+            if getter is not None and not getter.done():
+                getter.cancel()
+            if not task.done():
+                # The client went away mid-answer
+                token.cancel()
+                task.add_done_callback(lambda finished: finished.exception())
+    
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+@app.post("/chat/batch", response_model=BatchChatResponse)
+async def chat_batch(
+    request: BatchChatRequest,
+    http_request: Request,
+    db: Session = Depends(get_db),
+    tenant: str = Depends(get_tenant)
+):
+    """Answer many chat messages in one request."""
+    if len(request.items) > settings.batch_max_items:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Batch exceeds the limit of {settings.batch_max_items} messages"
+        )
+    
+    try:
+        db_manager = DatabaseManager(db)
+        token = CancellationToken("http")
+        results = await run_until_disconnected(
+            http_request,
+            token,
+            chatbot.get_batch_responses,
+            items=[item.model_dump() for item in request.items],
+            db_manager=db_manager,
+            cancellation=token,
+            tenant_id=tenant
+        )
+        return json_response({"results": results})
+    
+    except RequestCancelled:
+        return Response(status_code=CLIENT_CLOSED_REQUEST)
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error processing batch chat request: {str(e)}"
+        )
+
+
+@app.websocket("/ws/chat")
+async def chat_websocket(websocket: WebSocket, session_id: Optional[str] = None, tenant: Optional[str] = None):
+    """Chat over a WebSocket that keeps session state for the life of the connection.
+    
+    Client messages are `{"message": ..., "category": ...}`. The server sends
+    `typing`, `chunk` (streamed answer tokens), `response`, `handoff` and
+    `error` events. A message sent while an answer is still being generated
+    cancels that answer (a `cancelled` event) and is answered instead; a
+    disconnect cancels it too. The `tenant` query parameter selects the
+    knowledge base, as the X-Tenant-ID header does for HTTP requests.
+    """
+    try:
+        tenant = validate_tenant(tenant)
+    except InvalidTenant:
+        await websocket.close(code=1008)
+        return
+    await websocket.accept()
+    session_id = session_id or str(uuid.uuid4())
+    connection_manager.connect(session_id, websocket)
+    await websocket.send_json({"type": "session", "session_id": session_id})
+    
+    # Resolved once per connection instead of once per message
+    db = SessionLocal()
+    db_manager = DatabaseManager(db)
+    conversation = await run_in_threadpool(db_manager.get_conversation, session_id)
+    loop = asyncio.get_running_loop()
+    
+    try:
+        next_data = None
+        while True:
+            data = next_data or await websocket.receive_json()
+            next_data = None
+            message = (data.get("message") or "").strip()
+            if not message:
+                await websocket.send_json({"type": "error", "detail": "Message must not be empty"})
+                continue
+            
+            await connection_manager.push(session_id, {"type": "typing", "active": True})
+            
+            try:
+                decision = await admission_controller.acquire(
+                    session_id, returning=conversation is not None, user_id=data.get("user_id")
+                )
+            except AdmissionRejected as e:
+                await connection_manager.push(session_id, {"type": "typing", "active": False})
+                await websocket.send_json({"type": "error", "detail": str(e), "retry_after": e.retry_after})
+                continue
+            
+            queue: asyncio.Queue = asyncio.Queue()
+            handler = AnswerStreamHandler(loop, queue)
+            token = CancellationToken("websocket")
+            task = asyncio.ensure_future(run_in_threadpool(
+                chatbot.get_response,
+                user_message=message,
+                session_id=session_id,
+                db_manager=db_manager,
+                category=data.get("category"),
+                conversation=conversation,
+                callbacks=[handler],
+                cancellation=token,
+                kb_only=decision == DEGRADED,
+                tenant_id=tenant
+            ))
+            task.add_done_callback(lambda finished, decision=decision: admission_controller.release(decision))
+            # Keep reading while answering, to notice a disconnect or a newer message
+            receiver = asyncio.ensure_future(websocket.receive_json())
+            
+            # Forward streamed tokens until the answer is complete
+            while not task.done() or not queue.empty():
+                getter = asyncio.ensure_future(queue.get())
+                waiting = {getter, task} if receiver.done() else {getter, task, receiver}
+                await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+                if getter.done():
+                    if not token.cancelled:
+                        await websocket.send_json(getter.result())
+                else:
+                    getter.cancel()
+                if receiver.done() and not token.cancelled:
+                    token.cancel()
+            
+            if receiver.done():
+                if receiver.exception():
+                    # Disconnected; the worker thread has stopped, so the session can be closed
+                    task.exception()
+                    raise receiver.exception()
+                next_data = receiver.result()
+            else:
+                receiver.cancel()
+            
+            try:
+                result = task.result()
+            except RequestCancelled:
+                # Superseded by a newer message, which is answered next
+                await websocket.send_json({"type": "cancelled"})
+                continue
+            
+            if conversation is None and result["conversation_id"]:
+                conversation = await run_in_threadpool(db_manager.get_conversation, session_id)
+            
+            await connection_manager.push(session_id, {"type": "typing", "active": False})
+            await websocket.send_json({"type": "response", **result})
+            
+            if result["confidence"] < settings.handoff_confidence_threshold:
+                await connection_manager.push(session_id, {
+                    "type": "handoff",
+                    "message": "I may not have the full answer. You can ask to be connected with our support team."
+                })
+    
+    except WebSocketDisconnect:
+        pass
+    finally:
+        connection_manager.disconnect(session_id, websocket)
+        db.close()
 
 
 @app.get("/conversation/{session_id}", response_model=ConversationHistory)
@@ -91,36 +450,23 @@ async def get_conversation_history(
     session_id: str,
     db: Session = Depends(get_db)
 ):
-    """Get conversation history for a session."""
+    """Get conversation history for a session, including its archived conversations."""
     try:
-        db_manager = DatabaseManager(db)
-        conversation = db_manager.get_conversation(session_id)
-        
-        if not conversation:
+        history = await run_in_threadpool(retention_manager.get_session_history, session_id, DatabaseManager(db))
+        if not history:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Conversation not found"
             )
         
-        messages = db_manager.get_conversation_messages(conversation.id)
-        
-        # Convert to ChatMessage format
-        chat_messages = []
-        for message in messages:
-            chat_messages.append({
-                "role": message.role,
-                "content": message.content,
-                "timestamp": message.timestamp
-            })
-        
-        return ConversationHistory(
-            conversation_id=conversation.id,
-            session_id=conversation.session_id,
-            user_id=conversation.user_id,
-            messages=chat_messages,
-            created_at=conversation.created_at,
-            updated_at=conversation.updated_at
-        )
+        return json_response({
+            "conversation_id": history["id"],
+            "session_id": history["session_id"],
+            "user_id": history["user_id"],
+            "messages": history["messages"],
+            "created_at": history["created_at"],
+            "updated_at": history["updated_at"]
+        })
         
     except HTTPException:
         raise
@@ -131,11 +477,31 @@ async def get_conversation_history(
         )
 
 
+@app.get("/export/conversations", dependencies=[Depends(require_admin)])
+async def export_conversations(
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    gzip: bool = False
+):
+    """Stream all conversations and messages as NDJSON."""
+    # Pin the upper bound so the export is consistent and usable as the next `since`
+    until = until or datetime.utcnow()
+    headers = {"X-Export-Until": until.isoformat()}
+    if gzip:
+        headers["Content-Encoding"] = "gzip"
+
+    return StreamingResponse(
+        stream_export(since=since, until=until, compress=gzip),
+        media_type="application/x-ndjson",
+        headers=headers
+    )
+
+
 @app.delete("/conversation/{session_id}")
-async def clear_conversation(session_id: str):
+async def clear_conversation(session_id: str, db: Session = Depends(get_db)):
     """Clear conversation memory for a session."""
     try:
-        chatbot.clear_conversation(session_id)
+        chatbot.clear_conversation(session_id, DatabaseManager(db))
         return {"message": "Conversation cleared successfully"}
     except Exception as e:
         raise HTTPException(
@@ -150,26 +516,19 @@ async def add_knowledge_item(
     content: str,
     category: str,
     tags: Optional[List[str]] = None,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    tenant: str = Depends(get_tenant)
 ):
-    """Add a new item to the knowledge base."""
+    """Add a new item to the tenant's knowledge base."""
     try:
-        # Add to vector database
-        doc_id = chatbot.add_knowledge_item(title, content, category, tags or [])
-        
-        # Add to SQL database
+        # Add to SQL database, which logs the change for every worker
         db_manager = DatabaseManager(db)
-        kb_item = db_manager.add_knowledge_item(title, content, category, tags or [])
+        kb_item = db_manager.add_knowledge_item(title, content, category, tags or [], tenant_id=tenant)
         
-        return KnowledgeBaseItem(
-            id=kb_item.id,
-            title=kb_item.title,
-            content=kb_item.content,
-            category=kb_item.category,
-            tags=kb_item.tags.split(",") if kb_item.tags else [],
-            created_at=kb_item.created_at,
-            updated_at=kb_item.updated_at
-        )
+        # Index it here right away; other workers apply it on their next poll
+        await run_in_threadpool(knowledge_sync.poll, db_manager)
+        
+        return json_response(knowledge_item_dict(kb_item))
         
     except Exception as e:
         raise HTTPException(
@@ -181,26 +540,15 @@ async def add_knowledge_item(
 @app.get("/knowledge", response_model=List[KnowledgeBaseItem])
 async def get_knowledge_items(
     category: Optional[str] = None,
-    db: Session = Depends(get_db)
+    tags: Optional[List[str]] = Query(None),
+    db: Session = Depends(get_db),
+    tenant: str = Depends(get_tenant)
 ):
-    """Get knowledge base items."""
+    """Get the tenant's knowledge base items, optionally filtered by category and tags."""
     try:
         db_manager = DatabaseManager(db)
-        items = db_manager.get_knowledge_items(category)
-        
-        result = []
-        for item in items:
-            result.append(KnowledgeBaseItem(
-                id=item.id,
-                title=item.title,
-                content=item.content,
-                category=item.category,
-                tags=item.tags.split(",") if item.tags else [],
-                created_at=item.created_at,
-                updated_at=item.updated_at
-            ))
-        
-        return result
+        # Encode column tuples directly instead of building a model per row
+        return knowledge_rows_response(db_manager.get_knowledge_rows(category, tags, tenant))
         
     except Exception as e:
         raise HTTPException(
@@ -209,20 +557,77 @@ async def get_knowledge_items(
         )
 
 
+@app.get("/knowledge/tags")
+async def get_knowledge_tags(
+    category: Optional[str] = None,
+    db: Session = Depends(get_db),
+    tenant: str = Depends(get_tenant)
+):
+    """Get tag facets for the tenant's knowledge base."""
+    try:
+        db_manager = DatabaseManager(db)
+        return json_response({"tags": db_manager.get_tag_counts(category, tenant)})
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error retrieving knowledge tags: {str(e)}"
+        )
+
+
+@app.get("/knowledge/duplicates")
+async def get_knowledge_duplicates(tenant: str = Depends(get_tenant)):
+    """Get the near-duplicate items collapsed into others in the tenant's knowledge base."""
+    try:
+        items = chatbot.tenants.get(tenant).duplicate_report()
+        return json_response({
+            "items": items,
+            "collapsed": sum(len(item["duplicates"]) for item in items)
+        })
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error retrieving knowledge duplicates: {str(e)}"
+        )
+
+
+@app.get("/suggest")
+async def suggest(q: str = "", k: int = 5, tenant: str = Depends(get_tenant)):
+    """Typeahead suggestions for a partly typed message.
+    
+    Frequent questions and article titles with a word starting with `q`;
+    cheap enough to call on every debounced keystroke.
+    """
+    try:
+        if not suggestion_service.has_index(tenant):
+            # Only the first request of a tenant builds its index
+            await run_in_threadpool(suggestion_service.build, tenant)
+        return json_response({
+            "query": q,
+            "suggestions": suggestion_service.suggest(q, k, tenant)
+        })
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error getting suggestions: {str(e)}"
+        )
+
+
 @app.get("/search")
 async def search_knowledge_base(
     query: str,
     k: int = 5,
-    category: Optional[str] = None
+    category: Optional[str] = None,
+    tags: Optional[List[str]] = Query(None),
+    tenant: str = Depends(get_tenant)
 ):
-    """Search the knowledge base."""
+    """Search the tenant's knowledge base."""
     try:
-        results = chatbot.search_knowledge_base(query, k, category)
-        return {
+        results = chatbot.search_knowledge_base(query, k, category, tags, tenant)
+        return json_response({
             "query": query,
             "results": results,
             "count": len(results)
-        }
+        })
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -0,0 +1,83 @@
+import asyncio
+import threading
+from typing import Any, Callable, Dict, List, Optional, TypeVar
+from uuid import UUID
+
+from fastapi import Request
+from fastapi.concurrency import run_in_threadpool
+from langchain_core.callbacks import BaseCallbackHandler
+
+from app.profiling import profile_in_thread
+
+T = TypeVar("T")
+
+# Seconds between checks whether an HTTP client is still connected
+DISCONNECT_POLL_INTERVAL = 0.1
+
+
+class RequestCancelled(Exception):
+    """Raised inside the chain when the client of a chat request has gone away."""
+
+
+class CancellationToken:
+    """Thread-safe flag shared between a request handler and the worker thread answering it."""
+
+    def __init__(self, channel: str):
+        self.channel = channel
+        self.stage: Optional[str] = None  # Step that noticed the cancellation
+        self._event = threading.Event()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self):
+        self._event.set()
+
+    def check(self, stage: str):
+        """Raise RequestCancelled if the request was cancelled before `stage`."""
+        if self._event.is_set():
+            if self.stage is None:
+                self.stage = stage
+            raise RequestCancelled(f"Client went away before {stage}")
+
+
+class CancellationHandler(BaseCallbackHandler):
+    """Stops a chain run at its next step once the token is cancelled.
+
+    Retrieval and each LLM call are checkpoints, so a cancelled turn skips
+    the answer call after the condense step; with streaming on, a running
+    answer stops at the next token, which closes the provider stream.
+    """
+
+    raise_error = True
+
+    def __init__(self, token: CancellationToken):
+        self.token = token
+
+    def on_retriever_start(self, serialized: Dict[str, Any], query: str, *, run_id: UUID, **kwargs: Any):
+        self.token.check("retrieval")
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: List, *, run_id: UUID, **kwargs: Any):
+        self.token.check("llm")
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], *, run_id: UUID, **kwargs: Any):
+        self.token.check("llm")
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any):
+        self.token.check("streaming")
+
+
+async def run_until_disconnected(request: Request, token: CancellationToken, func: Callable[..., T],
+                                 **kwargs: Any) -> T:
+    """Run a blocking chatbot call in the threadpool, cancelling it if the HTTP client disconnects.
+
+    Waits for the call to finish even after cancelling, so it never outlives
+    the request's database session; raises RequestCancelled if it stopped early.
+    """
+    task = asyncio.ensure_future(run_in_threadpool(profile_in_thread(func), **kwargs))
+    while not task.done():
+        await asyncio.wait({task}, timeout=DISCONNECT_POLL_INTERVAL)
+        if not task.done() and not token.cancelled and await request.is_disconnected():
+            token.cancel()
+    return task.result()
@@ -1,16 +1,30 @@
 import uuid
-from typing import List, Dict, Any, Optional
-from langchain_openai import ChatOpenAI
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple
 from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain.schema import HumanMessage, AIMessage, SystemMessage
-from langchain.memory import ConversationBufferWindowMemory
+from langchain.schema import BaseMessage, HumanMessage, AIMessage, SystemMessage
 from langchain.chains import ConversationalRetrievalChain
-from langchain.retrievers import ContextualCompressionRetriever
-from langchain.retrievers.document_compressors import LLMChainExtractor
 
 from config import settings
-from app.knowledge_base import KnowledgeBaseManager
-from app.database import DatabaseManager
+from app.knowledge_base import KnowledgeBaseManager, retrieval_category, retrieval_knowledge_base
+from app.database import DEFAULT_TENANT, Conversation, DatabaseManager
+from app.llm import create_llm
+from app.retention import retention_manager
+from app.cancellation import CancellationHandler, CancellationToken, RequestCancelled
+from app.metrics import cancelled_requests, chain_metrics_handler, chat_requests, stage_timer
+from app.profiling import profile_in_thread
+from app.resilience import LLMUnavailable
+from app.session_state import SessionStoreError, Turn, session_state_operations, session_store
+from app.summarizer import ConversationSummarizer
+from app.tenants import TenantRegistry
+
+# Confidence of knowledge base answers given while the LLM is unavailable;
+# below the default handoff threshold, so WebSocket users are offered a human
+FALLBACK_CONFIDENCE = 0.4
+
+# Attempts to append a turn to the session state when other workers keep writing it
+SESSION_STATE_SAVE_ATTEMPTS = 3
 
 
 class CustomerSupportChatbot:
@@ -18,22 +32,21 @@ class CustomerSupportChatbot:
     
     def __init__(self):
         # Initialize LLM
-        self.llm = ChatOpenAI(
-            openai_api_key=settings.openai_api_key,
-            model_name=settings.model_name,
-            temperature=settings.temperature,
-            max_tokens=settings.max_tokens
-        )
+        self.llm = create_llm()
         
-        # Initialize knowledge base
+        # Initialize knowledge base; it serves the default tenant, other
+        # tenants get their own indexes from the registry
         self.kb_manager = KnowledgeBaseManager()
+        self.tenants = TenantRegistry(self.kb_manager)
         
-        # Initialize conversation memory
-        self.memory = ConversationBufferWindowMemory(
-            k=10,  # Keep last 10 exchanges
-            return_messages=True,
-            memory_key="chat_history"
-        )
+        # Initialize conversation memory: recent turns per session in the
+        # session state store, or in summary mode read from the database
+        memory_mode = settings.memory_mode.lower()
+        if memory_mode not in ("window", "summary"):
+            raise ValueError(f"Unknown memory mode: {settings.memory_mode}")
+        self.summary_memory = memory_mode == "summary"
+        self.session_store = session_store
+        self.summarizer = ConversationSummarizer(self.llm)
         
         # Create system prompt
         self.system_prompt = """You are a helpful customer support assistant for an e-commerce company. 
@@ -63,60 +76,375 @@ class CustomerSupportChatbot:
                 search_type="similarity",
                 search_kwargs={"k": 3}
             ),
-            memory=self.memory,
+            memory=None,  # The history of each session is passed in with the question
             return_source_documents=True,
             verbose=settings.debug
         )
     
-    def get_response(self, user_message: str, session_id: str, db_manager: DatabaseManager) -> Dict[str, Any]:
-        """Get response from the chatbot."""
+    def get_response(
+        self,
+        user_message: str,
+        session_id: str,
+        db_manager: DatabaseManager,
+        category: Optional[str] = None,
+        conversation: Optional[Conversation] = None,
+        callbacks: Optional[List] = None,
+        cancellation: Optional[CancellationToken] = None,
+        kb_only: bool = False,
+        tenant_id: str = DEFAULT_TENANT
+    ) -> Dict[str, Any]:
+        """Get response from the chatbot.
+        
+        Retrieval uses the knowledge base of `tenant_id` and is scoped to
+        `category` when given, or to the category inferred
+        from the message when inference is enabled. Callers that keep state for
+        a session, like the WebSocket channel, can pass the already resolved
+        `conversation` and LangChain `callbacks` to receive streamed tokens.
+        
+        The turn is only written once the answer is complete. When the
+        `cancellation` token is cancelled before that, the chain stops at its
+        next step, nothing is persisted and RequestCancelled is raised.
+        
+        If the LLM times out, fails or its circuit is open, the answer is the
+        best knowledge base match instead, flagged with `degraded`. With
+        `kb_only`, as when admission control sheds load, the LLM is not called.
+        """
+        kb_manager = self.tenants.get(tenant_id)
+        category = self._resolve_category(user_message, category, kb_manager)
+        category_token = retrieval_category.set(category)
+        knowledge_base_token = retrieval_knowledge_base.set(kb_manager.simple_kb)
+        asked_at = datetime.utcnow()
+        callbacks = [chain_metrics_handler] + (callbacks or [])
+        if cancellation:
+            callbacks.append(CancellationHandler(cancellation))
+        
         try:
-            # Get or create conversation
-            conversation = db_manager.get_conversation(session_id)
-            if not conversation:
-                conversation = db_manager.create_conversation(session_id)
-            
-            # Add user message to database
-            db_manager.add_message(conversation.id, "user", user_message)
-            
-            # Get response from LLM
-            result = self.retrieval_chain({"question": user_message})
-            
-            response_text = result["answer"]
-            source_documents = result.get("source_documents", [])
-            
-            # Add assistant response to database
-            db_manager.add_message(conversation.id, "assistant", response_text)
-            
-            # Format sources
-            sources = []
-            for doc in source_documents:
-                sources.append({
-                    "title": doc.metadata.get("title", "Unknown"),
-                    "category": doc.metadata.get("category", "Unknown"),
-                    "content": doc.page_content[:200] + "..." if len(doc.page_content) > 200 else doc.page_content
-                })
-            
-            # Calculate confidence based on source relevance
-            confidence = self._calculate_confidence(source_documents, user_message)
+            with stage_timer("total"):
+                # Get existing conversation; a new one is created with the first answer
+                with stage_timer("session_lookup"):
+                    if not conversation:
+                        conversation = db_manager.get_conversation(session_id)
+                    inputs = {"question": user_message}
+                    if self.summary_memory:
+                        inputs["chat_history"], unsummarized = self._load_history(conversation, db_manager)
+                    else:
+                        state_version, turns = self._load_window(session_id, conversation, db_manager)
+                        inputs["chat_history"] = [
+                            HumanMessage(content=content) if role == "h" else AIMessage(content=content)
+                            for role, content in turns
+                        ]
+                
+                # Get response from LLM; condense and answer steps are timed by the handler
+                degraded = False
+                try:
+                    if kb_only:
+                        raise LLMUnavailable("Chat requests are being shed")
+                    result = self.retrieval_chain(inputs, callbacks=callbacks)
+                    response_text = result["answer"]
+                    source_documents = result.get("source_documents", [])
+                except LLMUnavailable as e:
+                    print(f"LLM unavailable, answering from the knowledge base: {e}")
+                    degraded = True
+                    with stage_timer("fallback"):
+                        source_documents = self.retrieval_chain.retriever.get_relevant_documents(user_message)
+                        response_text = self._fallback_answer(source_documents)
+                
+                # Add the user message and assistant response to database
+                with stage_timer("message_write"):
+                    if not conversation:
+                        conversation = db_manager.create_conversation(session_id)
+                    db_manager.add_message(conversation.id, "user", user_message, timestamp=asked_at)
+                    db_manager.add_message(conversation.id, "assistant", response_text)
+                
+                # Fold older turns into the summary once a batch of them has left the window
+                if self.summary_memory and unsummarized + 2 >= self._history_limit():
+                    self.summarizer.schedule(conversation.id)
+                elif not self.summary_memory:
+                    with stage_timer("session_state"):
+                        self._save_window(session_id, state_version, turns, [("h", user_message), ("a", response_text)],
+                                          conversation, db_manager)
+                
+                # Calculate confidence based on source relevance
+                with stage_timer("confidence"):
+                    confidence = self._calculate_confidence(source_documents, user_message)
+                    if degraded:
+                        confidence = min(confidence, FALLBACK_CONFIDENCE)
             
+            chat_requests.inc(outcome="fallback" if degraded else "ok")
             return {
                 "response": response_text,
                 "session_id": session_id,
                 "conversation_id": conversation.id,
-                "sources": sources,
-                "confidence": confidence
+                "sources": self._format_sources(source_documents),
+                "confidence": confidence,
+                "degraded": degraded
             }
             
+        except RequestCancelled:
+            chat_requests.inc(outcome="cancelled")
+            cancelled_requests.inc(channel=cancellation.channel, stage=cancellation.stage)
+            raise
         except Exception as e:
             print(f"Error in chatbot response: {e}")
+            chat_requests.inc(outcome="error")
             return {
                 "response": "I apologize, but I'm experiencing technical difficulties. Please try again or contact our support team.",
                 "session_id": session_id,
                 "conversation_id": "",
                 "sources": [],
-                "confidence": 0.0
+                "confidence": 0.0,
+                "degraded": True
             }
+        finally:
+            retrieval_category.reset(category_token)
+            retrieval_knowledge_base.reset(knowledge_base_token)
+    
+    def get_batch_responses(
+        self,
+        items: List[Dict[str, Any]],
+        db_manager: DatabaseManager,
+        max_concurrency: Optional[int] = None,
+        cancellation: Optional[CancellationToken] = None,
+        tenant_id: str = DEFAULT_TENANT
+    ) -> List[Dict[str, Any]]:
+        """Answer many messages at once.
+        
+        Each item is a dict with `message` and optional `session_id`, `user_id`
+        and `category`. Retrieval runs once per distinct (message, category),
+        LLM calls run with bounded concurrency, and all turns are persisted in
+        one transaction. Batch messages are answered as standalone questions,
+        without the session's history, but in window mode their turns are added
+        to the session state so later chat turns see them. Results keep the
+        order of the items; failed items carry an `error` instead of aborting
+        the batch, and items the LLM could not answer get a `degraded`
+        knowledge base answer from their retrieved documents. A cancelled `cancellation` token aborts the whole batch
+        with RequestCancelled before anything is persisted.
+        """
+        max_concurrency = max_concurrency or settings.batch_max_concurrency
+        retriever = self.retrieval_chain.retriever
+        callbacks = [chain_metrics_handler]
+        if cancellation:
+            callbacks.append(CancellationHandler(cancellation))
+        
+        def answer(index: int) -> Dict[str, Any]:
+            documents = documents_by_key[retrieval_keys[index]]
+            message = items[index]["message"]
+            try:
+                with stage_timer("answer"):
+                    response_text = self.retrieval_chain.combine_docs_chain.run(
+                        input_documents=documents,
+                        question=message,
+                        callbacks=callbacks
+                    )
+                return {
+                    "response": response_text,
+                    "sources": self._format_sources(documents),
+                    "confidence": self._calculate_confidence(documents, message),
+                    "degraded": False,
+                    "error": None
+                }
+            except RequestCancelled:
+                raise
+            except LLMUnavailable:
+                return {
+                    "response": self._fallback_answer(documents),
+                    "sources": self._format_sources(documents),
+                    "confidence": min(self._calculate_confidence(documents, message), FALLBACK_CONFIDENCE),
+                    "degraded": True,
+                    "error": None
+                }
+            except Exception as e:
+                return {"response": None, "sources": [], "confidence": 0.0, "degraded": False, "error": str(e)}
+        
+        kb_manager = self.tenants.get(tenant_id)
+        knowledge_base_token = retrieval_knowledge_base.set(kb_manager.simple_kb)
+        try:
+            # Retrieve once per distinct question from the tenant's knowledge base
+            retrieval_keys = []
+            documents_by_key: Dict[Tuple[str, Optional[str]], List] = {}
+            for item in items:
+                category = self._resolve_category(item["message"], item.get("category"), kb_manager)
+                key = (item["message"].strip().lower(), category)
+                retrieval_keys.append(key)
+                if key not in documents_by_key:
+                    category_token = retrieval_category.set(category)
+                    try:
+                        documents_by_key[key] = retriever.get_relevant_documents(item["message"], callbacks=callbacks)
+                    finally:
+                        retrieval_category.reset(category_token)
+        
+            with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+                answers = list(executor.map(profile_in_thread(answer), range(len(items))))
+        except RequestCancelled:
+            cancelled_requests.inc(channel=cancellation.channel, stage=cancellation.stage)
+            raise
+        finally:
+            retrieval_knowledge_base.reset(knowledge_base_token)
+        
+        session_ids = [item.get("session_id") or str(uuid.uuid4()) for item in items]
+        conversation_ids = db_manager.save_exchanges([
+            (session_id, item.get("user_id"), item["message"], result["response"])
+            for session_id, item, result in zip(session_ids, items, answers)
+        ])
+        
+        if not self.summary_memory:
+            new_turns: Dict[str, List[Turn]] = {}
+            for item, result in zip(items, answers):
+                if item.get("session_id"):
+                    turns = new_turns.setdefault(item["session_id"], [])
+                    turns.append(("h", item["message"]))
+                    if result["response"] is not None:
+                        turns.append(("a", result["response"]))
+            with stage_timer("session_state"):
+                for session_id, turns in new_turns.items():
+                    self._append_window(session_id, turns, db_manager)
+        
+        results = []
+        for index, (session_id, result) in enumerate(zip(session_ids, answers)):
+            results.append({
+                "index": index,
+                "session_id": session_id,
+                "conversation_id": conversation_ids[session_id],
+                **result
+            })
+        return results
+    
+    def prime_retrieval(self, queries: List[str]) -> int:
+        """Run queries through retrieval the way a chat turn would, to warm its caches."""
+        retriever = self.retrieval_chain.retriever
+        for query in queries:
+            category_token = retrieval_category.set(self._resolve_category(query, None, self.kb_manager))
+            try:
+                retriever.get_relevant_documents(query)
+            finally:
+                retrieval_category.reset(category_token)
+        return len(queries)
+    
+    def _history_limit(self) -> int:
+        """Most unsummarized messages sent as history in summary mode."""
+        return (settings.memory_window_turns + settings.memory_summary_batch_turns) * 2
+    
+    def _load_history(self, conversation: Optional[Conversation], db_manager: DatabaseManager) -> Tuple[List[BaseMessage], int]:
+        """Chat history for summary mode: the running summary, then the messages it does not cover yet.
+        
+        Returns the history and the number of unsummarized messages in it.
+        Those are the recent window plus at most a batch waiting to be folded
+        in, so the history stays the same size however long the conversation is.
+        """
+        if not conversation:
+            return [], 0
+        row = db_manager.get_conversation_summary(conversation.id)
+        messages = db_manager.get_messages_since(
+            conversation.id, row.summarized_until if row else None, limit=self._history_limit()
+        )
+        history: List[BaseMessage] = []
+        if row and row.summary:
+            history.append(SystemMessage(content=f"Summary of the earlier conversation: {row.summary}"))
+        for message in messages:
+            history.append(HumanMessage(content=message.content) if message.role == "user" else AIMessage(content=message.content))
+        return history, len(messages)
+    
+    def _load_window(self, session_id: str, conversation: Optional[Conversation],
+                     db_manager: DatabaseManager) -> Tuple[Optional[int], List[Turn]]:
+        """Recent turns of a session for window mode, with the version of the stored state.
+        
+        Sessions the store has no state for, such as ones last served by a
+        worker with its own in-memory store, are rebuilt from the database.
+        The version is None when the store could not be read.
+        """
+        try:
+            version, turns = self.session_store.load(session_id)
+        except SessionStoreError as e:
+            print(f"Session state unavailable, reading history from the database: {e}")
+            session_state_operations.inc(operation="load", result="error")
+            return None, self._rebuild_window(conversation, db_manager)
+        
+        session_state_operations.inc(operation="load", result="hit" if turns is not None else "miss")
+        if turns is None:
+            turns = self._rebuild_window(conversation, db_manager)
+        return version, turns
+    
+    def _rebuild_window(self, conversation: Optional[Conversation], db_manager: DatabaseManager) -> List[Turn]:
+        if not conversation:
+            return []
+        # A cleared memory starts after the watermark of the conversation summary
+        row = db_manager.get_conversation_summary(conversation.id)
+        messages = db_manager.get_messages_since(
+            conversation.id, row.summarized_until if row else None, limit=settings.memory_window_turns * 2
+        )
+        return [("h" if message.role == "user" else "a", message.content) for message in messages]
+    
+    def _save_window(self, session_id: str, version: Optional[int], turns: List[Turn], new_turns: List[Turn],
+                     conversation: Conversation, db_manager: DatabaseManager):
+        """Append a turn to the session state, keeping the last `memory_window_turns` exchanges.
+        
+        When another worker saved the session in the meantime, the turn is
+        appended to the newer state instead.
+        """
+        if version is None:
+            return
+        keep = settings.memory_window_turns * 2
+        try:
+            for _ in range(SESSION_STATE_SAVE_ATTEMPTS):
+                updated = (turns + new_turns)[-keep:] if keep else []
+                if self.session_store.save(session_id, version, updated):
+                    session_state_operations.inc(operation="save", result="ok")
+                    return
+                session_state_operations.inc(operation="save", result="conflict")
+                version, turns = self.session_store.load(session_id)
+                if turns is None:
+                    # The database already has this turn
+                    turns, new_turns = self._rebuild_window(conversation, db_manager), []
+        except SessionStoreError as e:
+            print(f"Could not save session state: {e}")
+            session_state_operations.inc(operation="save", result="error")
+    
+    def _append_window(self, session_id: str, new_turns: List[Turn], db_manager: DatabaseManager):
+        """Add turns already written to the database, like batch ones, to a session's state.
+        
+        A session without live state is left alone: it is rebuilt from the
+        database, which has these turns, when it is next used.
+        """
+        try:
+            version, turns = self.session_store.load(session_id)
+        except SessionStoreError as e:
+            print(f"Could not update session state: {e}")
+            session_state_operations.inc(operation="load", result="error")
+            return
+        
+        session_state_operations.inc(operation="load", result="hit" if turns is not None else "miss")
+        if turns is not None:
+            self._save_window(session_id, version, turns, new_turns, db_manager.get_conversation(session_id), db_manager)
+    
+    def _resolve_category(self, user_message: str, category: Optional[str],
+                          kb_manager: KnowledgeBaseManager) -> Optional[str]:
+        """Use the requested category, or infer one from the message when enabled."""
+        if not category and settings.retrieval_infer_category:
+            category = kb_manager.infer_category(user_message)
+        return category
+    
+    def _fallback_answer(self, source_documents: List) -> str:
+        """Answer with the best knowledge base match when the LLM cannot be used."""
+        if not source_documents:
+            return ("I'm sorry, I can't look into that right now. "
+                    "Please try again in a few minutes or contact our support team.")
+        document = source_documents[0]
+        content = " ".join(document.page_content.split())
+        if len(content) > 500:
+            content = content[:500] + "..."
+        title = document.metadata.get("title", "our help center")
+        return f"I can't give you a full answer right now, but this from \"{title}\" may help:\n\n{content}"
+    
+    def _format_sources(self, source_documents: List) -> List[Dict[str, Any]]:
+        """Format source documents for a chat response."""
+        sources = []
+        for doc in source_documents:
+            sources.append({
+                "title": doc.metadata.get("title", "Unknown"),
+                "category": doc.metadata.get("category", "Unknown"),
+                "content": doc.page_content[:200] + "..." if len(doc.page_content) > 200 else doc.page_content
+            })
+        return sources
     
     def _calculate_confidence(self, source_documents: List, user_message: str) -> float:
         """Calculate confidence score based on source relevance."""
@@ -144,34 +472,30 @@ class CustomerSupportChatbot:
         return min(base_confidence + source_bonus + relevance_bonus, 1.0)
     
     def get_conversation_history(self, session_id: str, db_manager: DatabaseManager) -> List[Dict[str, Any]]:
-        """Get conversation history for a session."""
-        conversation = db_manager.get_conversation(session_id)
-        if not conversation:
-            return []
-        
-        messages = db_manager.get_conversation_messages(conversation.id)
-        
-        history = []
-        for message in messages:
-            history.append({
-                "role": message.role,
-                "content": message.content,
-                "timestamp": message.timestamp.isoformat()
-            })
-        
-        return history
+        """Get conversation history for a session, including its archived conversations."""
+        history = retention_manager.get_session_history(session_id, db_manager)
+        return history["messages"] if history else []
     
-    def clear_conversation(self, session_id: str):
+    def clear_conversation(self, session_id: str, db_manager: Optional[DatabaseManager] = None):
         """Clear conversation memory for a session."""
-        self.memory.clear()
+        try:
+            self.session_store.delete(session_id)
+        except SessionStoreError as e:
+            print(f"Could not clear session state: {e}")
+        if db_manager:
+            conversation = db_manager.get_conversation(session_id)
+            if conversation:
+                # Nothing said until now is summarized or sent as history any more
+                db_manager.save_conversation_summary(conversation.id, "", datetime.utcnow())
     
     def add_knowledge_item(self, title: str, content: str, category: str, tags: List[str] = None) -> str:
         """Add a new item to the knowledge base."""
         return self.kb_manager.add_document(title, content, category, tags)
     
-    def search_knowledge_base(self, query: str, k: int = 5, category: Optional[str] = None) -> List[Dict[str, Any]]:
-        """Search the knowledge base."""
-        return self.kb_manager.search(query, k, category)
+    def search_knowledge_base(self, query: str, k: int = 5, category: Optional[str] = None, tags: Optional[List[str]] = None,
+                              tenant_id: str = DEFAULT_TENANT) -> List[Dict[str, Any]]:
+        """Search a tenant's knowledge base."""
+        return self.tenants.get(tenant_id).search(query, k, category, tags)
 
 
 # Global chatbot instance
@@ -1,9 +1,9 @@
-from sqlalchemy import create_engine, Column, String, DateTime, Text, Integer
+from sqlalchemy import create_engine, inspect, text, Column, String, DateTime, Text, Integer, ForeignKey, func
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session
-from datetime import datetime
+from datetime import datetime, timedelta
 import uuid
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
 
 from config import settings
 
@@ -16,6 +16,9 @@ SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 # Create base class for models
 Base = declarative_base()
 
+# Tenant of the built-in knowledge base, and of requests that name none
+DEFAULT_TENANT = "default"
+
 
 class Conversation(Base):
     """Database model for conversations."""
@@ -39,6 +42,16 @@ class Message(Base):
     timestamp = Column(DateTime, default=datetime.utcnow)
 
 
+class ConversationSummary(Base):
+    """Running summary of the turns of a conversation that left the memory window."""
+    __tablename__ = "conversation_summaries"
+    
+    conversation_id = Column(String, primary_key=True)
+    summary = Column(Text, nullable=False, default="")
+    summarized_until = Column(DateTime, nullable=True)  # Timestamp of the last message folded into the summary
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
 class KnowledgeBase(Base):
     """Database model for knowledge base items."""
     __tablename__ = "knowledge_base"
@@ -47,11 +60,56 @@ class KnowledgeBase(Base):
     title = Column(String, nullable=False)
     content = Column(Text, nullable=False)
     category = Column(String, nullable=False)
-    tags = Column(Text, nullable=True)  # JSON string of tags
+    tags = Column(Text, nullable=True)  # Comma-separated tags, denormalized copy of knowledge_tags
+    tenant_id = Column(String, nullable=False, default=DEFAULT_TENANT, server_default=DEFAULT_TENANT, index=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 
+class KnowledgeTag(Base):
+    """Database model for knowledge base item tags."""
+    __tablename__ = "knowledge_tags"
+    
+    knowledge_id = Column(String, ForeignKey("knowledge_base.id", ondelete="CASCADE"), primary_key=True)
+    tag = Column(String, primary_key=True, index=True)
+
+
+class KnowledgeChange(Base):
+    """Change feed of the knowledge base: one row per added item, ids only ever increase."""
+    __tablename__ = "knowledge_changes"
+    __table_args__ = {"sqlite_autoincrement": True}  # Never reuse the ids of deleted rows
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    knowledge_id = Column(String, ForeignKey("knowledge_base.id", ondelete="CASCADE"), nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class ArchivedConversation(Base):
+    """Lookup index for conversations moved into archive segments."""
+    __tablename__ = "archived_conversations"
+    
+    conversation_id = Column(String, primary_key=True)
+    session_id = Column(String, nullable=False, index=True)
+    user_id = Column(String, nullable=True)
+    segment = Column(String, nullable=False)  # Segment file name
+    offset = Column(Integer, nullable=False)  # Byte offset of the gzip member
+    length = Column(Integer, nullable=False)  # Byte length of the gzip member
+    message_count = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, nullable=True)
+    archived_at = Column(DateTime, default=datetime.utcnow)
+
+
+def normalize_tags(tags: Optional[List[str]]) -> List[str]:
+    """Lowercase, strip and deduplicate tags while keeping their order."""
+    normalized = []
+    for tag in tags or []:
+        tag = tag.strip().lower()
+        if tag and tag not in normalized:
+            normalized.append(tag)
+    return normalized
+
+
 def get_db() -> Session:
     """Get database session."""
     db = SessionLocal()
@@ -64,6 +122,60 @@ def get_db() -> Session:
 def init_db():
     """Initialize database tables."""
     Base.metadata.create_all(bind=engine)
+    add_knowledge_tenants()
+    backfill_knowledge_tags()
+    backfill_knowledge_changes()
+
+
+def add_knowledge_tenants():
+    """Add the tenant column to a knowledge_base table created before tenants existed."""
+    columns = {column["name"] for column in inspect(engine).get_columns("knowledge_base")}
+    if "tenant_id" in columns:
+        return
+    with engine.begin() as connection:
+        connection.execute(text(
+            f"ALTER TABLE knowledge_base ADD COLUMN tenant_id VARCHAR NOT NULL DEFAULT '{DEFAULT_TENANT}'"
+        ))
+    for index in KnowledgeBase.__table__.indexes:
+        if "tenant_id" in index.columns:
+            index.create(bind=engine, checkfirst=True)
+
+
+def backfill_knowledge_tags():
+    """Populate knowledge_tags for items stored before tags were normalized."""
+    db = SessionLocal()
+    try:
+        tagged = db.query(KnowledgeTag.knowledge_id).distinct()
+        items = (
+            db.query(KnowledgeBase)
+            .filter(KnowledgeBase.tags.isnot(None), KnowledgeBase.tags != "")
+            .filter(KnowledgeBase.id.notin_(tagged))
+            .all()
+        )
+        for item in items:
+            for tag in normalize_tags(item.tags.split(",")):
+                db.add(KnowledgeTag(knowledge_id=item.id, tag=tag))
+        db.commit()
+    finally:
+        db.close()
+
+
+def backfill_knowledge_changes():
+    """Add items stored before the change feed existed to it, oldest first."""
+    db = SessionLocal()
+    try:
+        logged = db.query(KnowledgeChange.knowledge_id)
+        items = (
+            db.query(KnowledgeBase.id)
+            .filter(KnowledgeBase.id.notin_(logged))
+            .order_by(KnowledgeBase.created_at)
+            .all()
+        )
+        for (item_id,) in items:
+            db.add(KnowledgeChange(knowledge_id=item_id))
+        db.commit()
+    finally:
+        db.close()
 
 
 class DatabaseManager:
@@ -84,30 +196,197 @@ class DatabaseManager:
         """Get conversation by session ID."""
         return self.db.query(Conversation).filter(Conversation.session_id == session_id).first()
     
-    def add_message(self, conversation_id: str, role: str, content: str) -> Message:
+    def add_message(self, conversation_id: str, role: str, content: str,
+                    timestamp: Optional[datetime] = None) -> Message:
         """Add a message to a conversation."""
-        message = Message(conversation_id=conversation_id, role=role, content=content)
+        message = Message(conversation_id=conversation_id, role=role, content=content,
+                          timestamp=timestamp or datetime.utcnow())
         self.db.add(message)
+        # Touch the conversation so updated_at-based exports pick it up
+        self.db.query(Conversation).filter(Conversation.id == conversation_id).update(
+            {Conversation.updated_at: datetime.utcnow()}, synchronize_session=False
+        )
         self.db.commit()
         self.db.refresh(message)
         return message
     
+    def save_exchanges(self, exchanges: List[Tuple[str, Optional[str], str, Optional[str]]]) -> Dict[str, str]:
+        """Persist many chat turns in a single transaction.
+        
+        Each exchange is (session_id, user_id, user_message, assistant_message);
+        the assistant message may be None for turns that failed. Returns a
+        mapping of session ID to conversation ID.
+        """
+        session_ids = list({exchange[0] for exchange in exchanges})
+        conversations = {
+            conversation.session_id: conversation
+            for conversation in self.db.query(Conversation).filter(Conversation.session_id.in_(session_ids))
+        }
+        
+        now = datetime.utcnow()
+        offset = 0
+        try:
+            for session_id, user_id, user_message, assistant_message in exchanges:
+                conversation = conversations.get(session_id)
+                if not conversation:
+                    conversation = Conversation(id=str(uuid.uuid4()), session_id=session_id, user_id=user_id)
+                    self.db.add(conversation)
+                    conversations[session_id] = conversation
+                conversation.updated_at = now
+                
+                # Spread timestamps so history keeps the batch order within a session
+                self.db.add(Message(conversation_id=conversation.id, role="user", content=user_message, timestamp=now + timedelta(microseconds=offset)))
+                offset += 1
+                if assistant_message is not None:
+                    self.db.add(Message(conversation_id=conversation.id, role="assistant", content=assistant_message, timestamp=now + timedelta(microseconds=offset)))
+                    offset += 1
+            
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+        
+        return {session_id: conversation.id for session_id, conversation in conversations.items()}
+    
+    def get_archived_conversations(self, session_id: str) -> List[ArchivedConversation]:
+        """Get every archived conversation of a session ID, oldest first."""
+        return (
+            self.db.query(ArchivedConversation)
+            .filter(ArchivedConversation.session_id == session_id)
+            .order_by(ArchivedConversation.updated_at)
+            .all()
+        )
+    
     def get_conversation_messages(self, conversation_id: str) -> List[Message]:
         """Get all messages for a conversation."""
         return self.db.query(Message).filter(Message.conversation_id == conversation_id).order_by(Message.timestamp).all()
     
-    def add_knowledge_item(self, title: str, content: str, category: str, tags: List[str] = None) -> KnowledgeBase:
+    def get_messages_since(self, conversation_id: str, since: Optional[datetime] = None,
+                           limit: Optional[int] = None) -> List[Message]:
+        """Get the messages of a conversation newer than `since`, oldest first.
+        
+        With `limit`, only the most recent `limit` of them are returned.
+        """
+        query = self.db.query(Message).filter(Message.conversation_id == conversation_id)
+        if since is not None:
+            query = query.filter(Message.timestamp > since)
+        if limit is None:
+            return query.order_by(Message.timestamp).all()
+        return list(reversed(query.order_by(Message.timestamp.desc()).limit(limit).all()))
+    
+    def get_conversation_summary(self, conversation_id: str) -> Optional[ConversationSummary]:
+        """Get the running summary of a conversation."""
+        return self.db.query(ConversationSummary).filter(ConversationSummary.conversation_id == conversation_id).first()
+    
+    def save_conversation_summary(self, conversation_id: str, summary: str, summarized_until: Optional[datetime]) -> bool:
+        """Store a conversation summary covering the messages up to `summarized_until`.
+        
+        A summary never moves the watermark backwards, so a slow summarization
+        cannot undo a newer one or a cleared memory; returns whether it was stored.
+        """
+        row = self.get_conversation_summary(conversation_id)
+        if row is None:
+            row = ConversationSummary(conversation_id=conversation_id)
+            self.db.add(row)
+        elif row.summarized_until and summarized_until and row.summarized_until >= summarized_until:
+            return False
+        row.summary = summary
+        row.summarized_until = summarized_until
+        self.db.commit()
+        return True
+    
+    def add_knowledge_item(self, title: str, content: str, category: str, tags: List[str] = None,
+                           tenant_id: str = DEFAULT_TENANT) -> KnowledgeBase:
         """Add a knowledge base item."""
-        tags_json = ",".join(tags) if tags else ""
-        item = KnowledgeBase(title=title, content=content, category=category, tags=tags_json)
+        tags = normalize_tags(tags)
+        item = KnowledgeBase(title=title, content=content, category=category, tags=",".join(tags), tenant_id=tenant_id)
         self.db.add(item)
+        self.db.flush()
+        for tag in tags:
+            self.db.add(KnowledgeTag(knowledge_id=item.id, tag=tag))
+        self.db.add(KnowledgeChange(knowledge_id=item.id))
         self.db.commit()
         self.db.refresh(item)
         return item
     
-    def get_knowledge_items(self, category: Optional[str] = None) -> List[KnowledgeBase]:
-        """Get knowledge base items, optionally filtered by category."""
-        query = self.db.query(KnowledgeBase)
+    def get_knowledge_changes(self, after: int = 0, limit: int = 500, tenant_id: Optional[str] = None) -> List[Tuple]:
+        """Get the changes logged after change id `after`, oldest first, with their items.
+        
+        Rows are (change id, changed at, item id, title, content, category, tags, tenant).
+        """
+        query = (
+            self.db.query(
+                KnowledgeChange.id, KnowledgeChange.created_at, KnowledgeBase.id, KnowledgeBase.title,
+                KnowledgeBase.content, KnowledgeBase.category, KnowledgeBase.tags, KnowledgeBase.tenant_id
+            )
+            .join(KnowledgeBase, KnowledgeBase.id == KnowledgeChange.knowledge_id)
+            .filter(KnowledgeChange.id > after)
+        )
+        if tenant_id is not None:
+            query = query.filter(KnowledgeBase.tenant_id == tenant_id)
+        return query.order_by(KnowledgeChange.id).limit(limit).all()
+    
+    def get_knowledge_items(self, category: Optional[str] = None, tags: Optional[List[str]] = None,
+                            tenant_id: str = DEFAULT_TENANT) -> List[KnowledgeBase]:
+        """Get a tenant's knowledge base items, optionally filtered by category and tags.
+        
+        When several tags are given, only items carrying all of them are returned.
+        """
+        return self._filter_knowledge(self.db.query(KnowledgeBase), category, tags, tenant_id).all()
+    
+    def get_knowledge_rows(self, category: Optional[str] = None, tags: Optional[List[str]] = None,
+                           tenant_id: str = DEFAULT_TENANT) -> List[Tuple]:
+        """Get a tenant's knowledge base items as plain column tuples.
+        
+        Skips ORM object construction for listings that are encoded straight to JSON.
+        """
+        query = self.db.query(
+            KnowledgeBase.id, KnowledgeBase.title, KnowledgeBase.content, KnowledgeBase.category,
+            KnowledgeBase.tags, KnowledgeBase.created_at, KnowledgeBase.updated_at
+        )
+        return self._filter_knowledge(query, category, tags, tenant_id).all()
+    
+    def _filter_knowledge(self, query, category: Optional[str], tags: Optional[List[str]], tenant_id: str):
+        """Apply tenant, category and tag filters to a knowledge base query."""
+        query = query.filter(KnowledgeBase.tenant_id == tenant_id)
         if category:
             query = query.filter(KnowledgeBase.category == category)
-        return query.all() 
\ No newline at end of file
+        tags = normalize_tags(tags)
+        if tags:
+            matching_ids = (
+                self.db.query(KnowledgeTag.knowledge_id)
+                .filter(KnowledgeTag.tag.in_(tags))
+                .group_by(KnowledgeTag.knowledge_id)
+                .having(func.count(KnowledgeTag.tag) == len(tags))
+            )
+            query = query.filter(KnowledgeBase.id.in_(matching_ids))
+        return query
+    
+    def get_tag_counts(self, category: Optional[str] = None, tenant_id: str = DEFAULT_TENANT) -> Dict[str, int]:
+        """Get the number of a tenant's knowledge base items per tag."""
+        query = (
+            self.db.query(KnowledgeTag.tag, func.count(KnowledgeTag.knowledge_id))
+            .join(KnowledgeBase, KnowledgeBase.id == KnowledgeTag.knowledge_id)
+            .filter(KnowledgeBase.tenant_id == tenant_id)
+        )
+        if category:
+            query = query.filter(KnowledgeBase.category == category)
+        return dict(query.group_by(KnowledgeTag.tag).all())
+    
+    def get_top_questions(self, limit: int = 20, by_conversation: bool = False) -> List[Tuple[str, int]]:
+        """Get the most frequently asked user messages with their counts.
+        
+        Messages differing only in case or surrounding whitespace count as
+        the same question. With `by_conversation`, the count is the number of
+        conversations the question was asked in, so one customer repeating
+        a message does not make it frequent.
+        """
+        count = func.count(func.distinct(Message.conversation_id)) if by_conversation else func.count(Message.id)
+        return (
+            self.db.query(func.min(Message.content), count)
+            .filter(Message.role == "user")
+            .group_by(func.lower(func.trim(Message.content)))
+            .order_by(count.desc())
+            .limit(limit)
+            .all()
+        )
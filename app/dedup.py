@@ -0,0 +1,127 @@
+import zlib
+from typing import Dict, List, Set, Union
+
+import numpy as np
+
+# Hash functions per MinHash signature. Signatures only pick candidates,
+# which are then compared exactly, so a short one is enough
+MINHASH_PERMUTATIONS = 32
+
+# Articles are compared as sets of overlapping word sequences of this length
+SHINGLE_WORDS = 3
+
+# Smallest chance that a pair at the threshold shares a band, which decides the band layout
+LSH_MIN_RECALL = 0.85
+
+# Fixed seed, so signatures agree between workers and with snapshots
+_rng = np.random.default_rng(20240521)
+_MULTIPLIERS = _rng.integers(1, 2 ** 63, MINHASH_PERMUTATIONS, dtype=np.uint64) | np.uint64(1)
+_OFFSETS = _rng.integers(0, 2 ** 63, MINHASH_PERMUTATIONS, dtype=np.uint64)
+_MIX = np.uint64(0x9E3779B97F4A7C15)
+
+# Band keys are folded to below this Mersenne prime to keep them small ints
+_KEY_MODULUS = (1 << 61) - 1
+
+
+def shingle_hashes(terms: List[str]) -> np.ndarray:
+    """Sorted unique hashes of the word shingles of a text's terms."""
+    if not terms:
+        return np.empty(0, dtype=np.uint64)
+    # crc32 is stable across processes, unlike hash(); terms never contain spaces,
+    # so encoding them joined and splitting the bytes is one call instead of many
+    encoded = " ".join(terms).encode("utf-8").split(b" ")
+    term_hashes = np.fromiter(map(zlib.crc32, encoded), dtype=np.uint64, count=len(terms))
+    count = max(len(terms) - SHINGLE_WORDS + 1, 1)
+    shingles = term_hashes[:count].copy()
+    for offset in range(1, min(SHINGLE_WORDS, len(terms))):
+        shingles = shingles * _MIX + term_hashes[offset:offset + count]
+    return np.unique(shingles)
+
+
+def jaccard(first: np.ndarray, second: np.ndarray) -> float:
+    """Jaccard similarity of two shingle hash sets from `shingle_hashes`."""
+    if not len(first) or not len(second):
+        return 0.0
+    shared = len(np.intersect1d(first, second, assume_unique=True))
+    return shared / (len(first) + len(second) - shared)
+
+
+def minhash_signature(shingles: np.ndarray) -> np.ndarray:
+    """MinHash signature of a non-empty shingle hash set.
+
+    Each hash is a multiply-shift hash of the shingle hashes, so a whole
+    signature is one vectorized pass.
+    """
+    hashes = _MULTIPLIERS[:, None] * shingles[None, :] + _OFFSETS[:, None]
+    # The top bits are the well mixed ones; the shift keeps the minimum
+    return (hashes.min(axis=1) >> np.uint64(32)).astype(np.uint32)
+
+
+def band_rows(threshold: float) -> int:
+    """Signature rows per LSH band for a similarity threshold.
+
+    More rows per band mean fewer, more similar candidates; this picks the
+    most rows for which a pair right at the threshold still shares at least
+    one band with probability LSH_MIN_RECALL.
+    """
+    best = 1
+    for rows in range(1, MINHASH_PERMUTATIONS + 1):
+        if MINHASH_PERMUTATIONS % rows:
+            continue
+        bands = MINHASH_PERMUTATIONS // rows
+        if 1 - (1 - threshold ** rows) ** bands >= LSH_MIN_RECALL:
+            best = rows
+    return best
+
+
+class NearDuplicateIndex:
+    """LSH banding over MinHash signatures.
+
+    Each signature is cut into bands, and items whose signatures agree on a
+    whole band land in the same bucket. Looking up an item's bands gives the
+    few items likely to be near-duplicates, without comparing against every
+    stored item; candidates still have to be checked with `jaccard`. Band
+    keys are derived from the signature alone, so the buckets can be saved
+    in snapshots and restored by another process.
+    """
+
+    def __init__(self, threshold: float):
+        self.threshold = threshold
+        self.rows = band_rows(threshold)
+        self.bands = MINHASH_PERMUTATIONS // self.rows
+        # Most buckets hold one item, which is stored as a bare position
+        self.buckets: List[Dict[int, Union[int, List[int]]]] = [{} for _ in range(self.bands)]
+
+    def band_keys(self, signature: np.ndarray) -> List[int]:
+        """Bucket key of each band of a signature."""
+        data = signature.tobytes()
+        width = len(data) // self.bands
+        return [int.from_bytes(data[start:start + width], "little") % _KEY_MODULUS
+                for start in range(0, len(data), width)]
+
+    def candidates(self, keys: List[int]) -> Set[int]:
+        """Positions of the items sharing at least one band with the signature these keys came from."""
+        found: Set[int] = set()
+        for buckets, key in zip(self.buckets, keys):
+            bucket = buckets.get(key)
+            if bucket is None:
+                continue
+            if isinstance(bucket, int):
+                found.add(bucket)
+            else:
+                found.update(bucket)
+        return found
+
+    def add(self, position: int, keys: List[int]):
+        for buckets, key in zip(self.buckets, keys):
+            bucket = buckets.get(key)
+            if bucket is None:
+                buckets[key] = position
+            elif isinstance(bucket, int):
+                buckets[key] = [bucket, position]
+            else:
+                bucket.append(position)
+
+    def item_bytes(self) -> int:
+        """Rough memory of one item's bucket entries."""
+        return 80 * self.bands
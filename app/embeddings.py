@@ -0,0 +1,207 @@
+import hashlib
+import math
+import os
+import re
+import sqlite3
+import threading
+import zlib
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.embeddings import Embeddings
+
+from config import settings
+from app.metrics import cache_lookups
+
+
+def content_hash(text: str) -> str:
+    """Stable hash of a text used as the embedding cache key."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """Two-tier embedding cache keyed by (model id, content hash).
+
+    The first tier is an in-memory LRU, the second a SQLite file that survives
+    restarts. Lookups and inserts are batched so a whole corpus can be checked
+    with a single query against the on-disk tier.
+    """
+
+    def __init__(self, path: Optional[str] = None, max_entries: Optional[int] = None):
+        self.path = path if path is not None else settings.embedding_cache_path
+        self.max_entries = max_entries or settings.embedding_cache_size
+        self._memory: "OrderedDict[Tuple[str, str], List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._connection = None
+        self.hits = 0
+        self.misses = 0
+
+        if self.path:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            self.reconnect()
+
+    def reconnect(self):
+        """Open a new connection to the on-disk tier.
+
+        SQLite connections must not be used across fork, so forked workers
+        call this instead of using the connection inherited from the parent.
+        """
+        if not self.path:
+            return
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT NOT NULL, hash TEXT NOT NULL, vector BLOB NOT NULL, "
+            "PRIMARY KEY (model, hash))"
+        )
+        self._connection.commit()
+
+    def _remember(self, key: Tuple[str, str], vector: List[float]):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def get_many(self, model: str, hashes: Sequence[str]) -> Dict[str, List[float]]:
+        """Look up several hashes, returning the ones that are cached."""
+        found: Dict[str, List[float]] = {}
+        with self._lock:
+            missing = []
+            for hash_ in hashes:
+                vector = self._memory.get((model, hash_))
+                if vector is not None:
+                    self._memory.move_to_end((model, hash_))
+                    found[hash_] = vector
+                else:
+                    missing.append(hash_)
+
+            if missing and self._connection is not None:
+                # Stay well below SQLite's bound parameter limit
+                for start in range(0, len(missing), 500):
+                    chunk = missing[start:start + 500]
+                    placeholders = ",".join("?" * len(chunk))
+                    rows = self._connection.execute(
+                        f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({placeholders})",
+                        [model, *chunk]
+                    ).fetchall()
+                    for hash_, blob in rows:
+                        vector = array("f", blob).tolist()
+                        self._remember((model, hash_), vector)
+                        found[hash_] = vector
+
+            self.hits += len(found)
+            self.misses += len(hashes) - len(found)
+        cache_lookups.inc(len(found), cache="embedding", result="hit")
+        cache_lookups.inc(len(hashes) - len(found), cache="embedding", result="miss")
+        return found
+
+    def put_many(self, model: str, vectors: Dict[str, List[float]]):
+        """Store several vectors in both tiers."""
+        with self._lock:
+            for hash_, vector in vectors.items():
+                self._remember((model, hash_), vector)
+
+            if self._connection is not None and vectors:
+                self._connection.executemany(
+                    "INSERT OR REPLACE INTO embeddings (model, hash, vector) VALUES (?, ?, ?)",
+                    [(model, hash_, array("f", vector).tobytes()) for hash_, vector in vectors.items()]
+                )
+                self._connection.commit()
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that only computes vectors missing from the cache."""
+
+    def __init__(self, underlying: Embeddings, model_id: str, cache: Optional[EmbeddingCache] = None):
+        self.underlying = underlying
+        self.model_id = model_id
+        self.cache = cache or EmbeddingCache()
+
+    def _embed(self, texts: List[str], kind: str) -> List[List[float]]:
+        # Queries and documents may be embedded differently by some models
+        model = f"{self.model_id}:{kind}"
+        hashes = [content_hash(text) for text in texts]
+        cached = self.cache.get_many(model, hashes)
+
+        missing: Dict[str, str] = {}
+        for hash_, text in zip(hashes, texts):
+            if hash_ not in cached and hash_ not in missing:
+                missing[hash_] = text
+
+        if missing:
+            missing_texts = list(missing.values())
+            if kind == "query":
+                computed = [self.underlying.embed_query(text) for text in missing_texts]
+            else:
+                computed = self.underlying.embed_documents(missing_texts)
+            new_vectors = dict(zip(missing.keys(), computed))
+            self.cache.put_many(model, new_vectors)
+            cached.update(new_vectors)
+
+        return [cached[hash_] for hash_ in hashes]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed(texts, "document")
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed([text], "query")[0]
+
+
+class HashingEmbeddings(Embeddings):
+    """Local bag-of-words embeddings using the hashing trick.
+
+    Needs no model download or API key, which makes it suitable for the demo
+    mode, tests and benchmarks.
+    """
+
+    def __init__(self, dimensions: int = 256):
+        self.dimensions = dimensions
+
+    def _embed(self, text: str) -> List[float]:
+        vector = [0.0] * self.dimensions
+        for token in re.findall(r"\w+", text.lower()):
+            # crc32 is stable across processes, unlike hash()
+            vector[zlib.crc32(token.encode("utf-8")) % self.dimensions] += 1.0
+        norm = math.sqrt(sum(value * value for value in vector))
+        return [value / norm for value in vector] if norm else vector
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+
+_shared_cache: Optional[EmbeddingCache] = None
+
+
+def reconnect_shared_cache():
+    """Give the shared cache its own SQLite connection in a forked worker."""
+    if _shared_cache is not None:
+        _shared_cache.reconnect()
+
+
+def get_embeddings() -> Optional[CachedEmbeddings]:
+    """Create the configured embedding model wrapped in the shared cache.
+
+    Returns None when embeddings are disabled.
+    """
+    global _shared_cache
+
+    backend = settings.embedding_backend.lower()
+    if backend == "none":
+        return None
+    if backend == "hashing":
+        underlying, model_id = HashingEmbeddings(), "hashing-256"
+    elif backend == "openai":
+        from langchain_openai import OpenAIEmbeddings
+        underlying = OpenAIEmbeddings(openai_api_key=settings.openai_api_key, model=settings.embedding_model)
+        model_id = f"openai/{settings.embedding_model}"
+    else:
+        raise ValueError(f"Unknown embedding backend: {settings.embedding_backend}")
+
+    if _shared_cache is None:
+        _shared_cache = EmbeddingCache()
+    return CachedEmbeddings(underlying, model_id, _shared_cache)
@@ -0,0 +1,164 @@
+import gzip
+import zlib
+from datetime import datetime
+from typing import Any, Dict, Iterator, Optional
+
+import orjson
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from config import settings
+from app.database import Conversation, Message, SessionLocal
+
+
+def _conversation_record(conversation: Conversation) -> Dict[str, Any]:
+    """Convert a conversation row into an export record."""
+    return {
+        "type": "conversation",
+        "id": conversation.id,
+        "session_id": conversation.session_id,
+        "user_id": conversation.user_id,
+        "created_at": conversation.created_at.isoformat() if conversation.created_at else None,
+        "updated_at": conversation.updated_at.isoformat() if conversation.updated_at else None
+    }
+
+
+def _message_record(message: Message) -> Dict[str, Any]:
+    """Convert a message row into an export record."""
+    return {
+        "type": "message",
+        "id": message.id,
+        "conversation_id": message.conversation_id,
+        "role": message.role,
+        "content": message.content,
+        "timestamp": message.timestamp.isoformat() if message.timestamp else None
+    }
+
+
+def iter_export_records(
+    db: Session,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    batch_size: Optional[int] = None
+) -> Iterator[Dict[str, Any]]:
+    """Stream conversations and their messages as flat export records.
+
+    Conversations and messages are read with two server-side cursors, both
+    ordered by conversation id, and merged so that every conversation record
+    is immediately followed by its messages. Only one batch of each is held
+    in memory at a time.
+    """
+    batch_size = batch_size or settings.export_batch_size
+
+    conversation_filters = []
+    if since:
+        conversation_filters.append(Conversation.updated_at > since)
+    if until:
+        conversation_filters.append(Conversation.updated_at <= until)
+
+    stream_options = {"stream_results": True, "yield_per": batch_size}
+
+    conversations = db.execute(
+        select(Conversation)
+        .where(*conversation_filters)
+        .order_by(Conversation.id),
+        execution_options=stream_options
+    ).scalars()
+    messages = db.execute(
+        select(Message)
+        .join(Conversation, Conversation.id == Message.conversation_id)
+        .where(*conversation_filters)
+        .order_by(Message.conversation_id, Message.timestamp),
+        execution_options=stream_options
+    ).scalars()
+
+    message_iter = iter(messages)
+    pending = next(message_iter, None)
+
+    for conversation in conversations:
+        yield _conversation_record(conversation)
+
+        # Skip messages of conversations that were not part of the cursor
+        while pending is not None and pending.conversation_id < conversation.id:
+            pending = next(message_iter, None)
+
+        while pending is not None and pending.conversation_id == conversation.id:
+            yield _message_record(pending)
+            pending = next(message_iter, None)
+
+        # Release exported rows from the identity map to keep memory flat
+        db.expunge_all()
+
+
+def iter_ndjson(
+    db: Session,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    batch_size: Optional[int] = None
+) -> Iterator[bytes]:
+    """Stream export records as newline-delimited JSON."""
+    for record in iter_export_records(db, since, until, batch_size):
+        yield orjson.dumps(record) + b"\n"
+
+
+def iter_gzip(chunks: Iterator[bytes], min_chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+    """Incrementally gzip a stream of byte chunks."""
+    compressor = zlib.compressobj(wbits=31)  # 31 selects the gzip container
+    buffer = []
+    buffered = 0
+
+    for chunk in chunks:
+        buffer.append(compressor.compress(chunk))
+        buffered += len(buffer[-1])
+        if buffered >= min_chunk_size:
+            yield b"".join(buffer)
+            buffer = []
+            buffered = 0
+
+    buffer.append(compressor.flush())
+    yield b"".join(buffer)
+
+
+def stream_export(
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    compress: bool = False,
+    batch_size: Optional[int] = None
+) -> Iterator[bytes]:
+    """Stream an export using its own database session.
+
+    The session lives as long as the generator, so it can be handed directly
+    to a streaming HTTP response.
+    """
+    db = SessionLocal()
+    try:
+        chunks = iter_ndjson(db, since, until, batch_size)
+        if compress:
+            chunks = iter_gzip(chunks)
+        for chunk in chunks:
+            yield chunk
+    finally:
+        db.close()
+
+
+def export_to_file(
+    path: str,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    compress: bool = False,
+    batch_size: Optional[int] = None
+) -> int:
+    """Write an export to a file and return the number of records written."""
+    opener = gzip.open if compress else open
+    count = 0
+
+    db = SessionLocal()
+    try:
+        with opener(path, "wb") as output:
+            for line in iter_ndjson(db, since, until, batch_size):
+                output.write(line)
+                count += 1
+    finally:
+        db.close()
+
+    return count
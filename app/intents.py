@@ -0,0 +1,156 @@
+import json
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from pydantic import BaseModel, field_validator
+
+from config import settings
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased word tokens; keywords only ever match whole words."""
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class Intent(BaseModel):
+    """A keyword-triggered intent with canned responses.
+
+    `keywords` maps a word or phrase to its weight (a plain list weighs each
+    keyword 1). An intent matches when the weights of the distinct keywords
+    found add up to `min_score` and every keyword in `required` is present.
+    """
+
+    name: str
+    responses: List[str]
+    keywords: Dict[str, float]
+    required: List[str] = []
+    min_score: float = 1.0
+    confidence: float = 0.8
+    category: Optional[str] = None
+
+    @field_validator("keywords", mode="before")
+    @classmethod
+    def weigh_keywords(cls, value: Any) -> Any:
+        if isinstance(value, list):
+            value = {keyword: 1.0 for keyword in value}
+        return {keyword.lower(): weight for keyword, weight in value.items()}
+
+    @field_validator("required")
+    @classmethod
+    def lower_required(cls, value: List[str]) -> List[str]:
+        return [keyword.lower() for keyword in value]
+
+
+class IntentMatcher:
+    """All intent keywords compiled into one token trie.
+
+    Matching walks the trie from every token of the message, so the cost
+    depends on the message length and the longest keyword phrase, not on the
+    number of intents or keywords in the catalogue.
+    """
+
+    def __init__(self, intents: List[Intent]):
+        self.intents = intents
+        self._root: Dict[str, Any] = {}
+        self._max_phrase = 0
+
+        for index, intent in enumerate(intents):
+            for keyword in set(intent.keywords) | set(intent.required):
+                tokens = tokenize(keyword)
+                if not tokens:
+                    continue
+                node = self._root
+                for token in tokens:
+                    node = node.setdefault(token, {})
+                # Terminal entries live under a key no token can produce
+                node.setdefault("", []).append((index, keyword))
+                self._max_phrase = max(self._max_phrase, len(tokens))
+
+    def _find_keywords(self, tokens: List[str]) -> Dict[int, Set[str]]:
+        found: Dict[int, Set[str]] = {}
+        for start in range(len(tokens)):
+            node = self._root
+            for token in tokens[start:start + self._max_phrase]:
+                node = node.get(token)
+                if node is None:
+                    break
+                for index, keyword in node.get("", ()):
+                    found.setdefault(index, set()).add(keyword)
+        return found
+
+    def match(self, text: str) -> Optional[Dict[str, Any]]:
+        """Best matching intent with its score and the keywords found; ties go to the intent listed first."""
+        best: Optional[Tuple[float, int, List[str]]] = None
+        for index, keywords in self._find_keywords(tokenize(text)).items():
+            intent = self.intents[index]
+            if any(keyword not in keywords for keyword in intent.required):
+                continue
+            score = sum(intent.keywords.get(keyword, 0.0) for keyword in keywords)
+            if score < intent.min_score:
+                continue
+            if best is None or score > best[0] or (score == best[0] and index < best[1]):
+                best = (score, index, sorted(keywords))
+
+        if best is None:
+            return None
+        return {"intent": self.intents[best[1]], "score": best[0], "keywords": best[2]}
+
+
+def load_intents(path: str) -> List[Intent]:
+    """Read an intent catalogue from a JSON file."""
+    with open(path) as source:
+        data = json.load(source)
+    return [Intent.model_validate(entry) for entry in data.get("intents", [])]
+
+
+class IntentEngine:
+    """Serves matches from the catalogue file and recompiles it when the file changes.
+
+    The file's modification time is checked at most every
+    `intents_reload_seconds`; a catalogue that fails to load is reported and
+    the previous one stays in use.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or settings.intents_path
+        self.matcher = IntentMatcher([])
+        self._mtime: Optional[float] = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+        self.reload()
+
+    def reload(self) -> bool:
+        """Recompile the catalogue if the file changed; returns True when it was reloaded."""
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return False
+        if mtime == self._mtime:
+            return False
+
+        try:
+            matcher = IntentMatcher(load_intents(self.path))
+        except (OSError, ValueError) as e:
+            print(f"Could not load intents from {self.path}: {e}")
+            self._mtime = mtime  # Do not retry until the file changes again
+            return False
+
+        self.matcher = matcher
+        self._mtime = mtime
+        print(f"Loaded {len(matcher.intents)} intents from {self.path}")
+        return True
+
+    def match(self, text: str) -> Optional[Dict[str, Any]]:
+        now = time.monotonic()
+        if now >= self._next_check and self._lock.acquire(blocking=False):
+            try:
+                self._next_check = now + settings.intents_reload_seconds
+                self.reload()
+            finally:
+                self._lock.release()
+        return self.matcher.match(text)
@@ -1,19 +1,89 @@
 import os
 import json
-from typing import List, Dict, Any, Optional
+import math
+import pickle
+import re
+import threading
+from array import array
+from collections import Counter
+from contextvars import ContextVar
+from operator import itemgetter
+from typing import List, Dict, Any, Optional, Sequence, Set, Tuple
+import numpy as np
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_openai import OpenAIEmbeddings
 from langchain.schema import Document
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
 
 from config import settings
+from app.database import normalize_tags
+from app.dedup import NearDuplicateIndex, jaccard, minhash_signature, shingle_hashes
+from app.embeddings import get_embeddings
+from app.metrics import metrics, stage_timer
+
+# Category that retrieval is scoped to for the current chat turn
+retrieval_category: ContextVar[Optional[str]] = ContextVar("retrieval_category", default=None)
+
+# Knowledge base of the tenant the current chat turn belongs to, when not the retriever's own
+retrieval_knowledge_base: ContextVar[Optional["SimpleKnowledgeBase"]] = ContextVar(
+    "retrieval_knowledge_base", default=None
+)
+
+# Rough memory of an item besides its text, postings and embedding: the
+# item dict, its list slots and its category and tag index entries
+ITEM_OVERHEAD_BYTES = 600
+
+# Format of knowledge base snapshots; older snapshots are ignored
+SNAPSHOT_FORMAT = 4
+
+# Attributes that make up the stored state of a SimpleKnowledgeBase
+SNAPSHOT_ATTRIBUTES = (
+    "knowledge_items", "category_index", "tag_index", "category_terms",
+    "term_positions", "term_counts", "item_lengths", "total_length", "memory_bytes",
+    "duplicate_count"
+)
+
+TERM_PATTERN = re.compile(r"\w+")
+
+# BM25 parameters of the lexical index
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+knowledge_duplicates = metrics.counter(
+    "chatbot_knowledge_duplicates_total",
+    "Near-duplicate articles linked at ingest instead of indexed, or dropped from retrieval results, by stage",
+    ["stage"]
+)
+
+
+def index_terms(text: str) -> List[str]:
+    """Lowercased word terms as stored in the lexical index."""
+    return TERM_PATTERN.findall(text.lower())
 
 
 class SimpleKnowledgeBase:
     """Simple knowledge base for testing without vector database."""
     
-    def __init__(self):
+    def __init__(self, embeddings: Optional[Embeddings] = None, sample_data: bool = True):
         self.knowledge_items = []
-        self.initialize_sample_data()
+        self.embeddings = embeddings
+        self.category_index: Dict[str, array] = {}  # category -> positions in knowledge_items
+        self.tag_index: Dict[str, Set[int]] = {}  # tag -> positions in knowledge_items
+        self.category_terms: Dict[str, Set[str]] = {}  # category -> words used to infer it
+        # Lexical index: term -> positions of the items containing it and its count in each
+        self.term_positions: Dict[str, array] = {}
+        self.term_counts: Dict[str, array] = {}
+        self.item_lengths = array("I")
+        self.total_length = 0
+        self.memory_bytes = 0  # Estimated size of the items and indexes
+        # MinHash signatures bucketed by LSH band, to spot near-duplicate articles
+        threshold = settings.knowledge_dedup_threshold
+        self.near_duplicates = NearDuplicateIndex(threshold) if threshold > 0 else None
+        self.duplicate_count = 0  # Items linked to a near-duplicate instead of stored
+        if sample_data:
+            self.initialize_sample_data()
     
     def initialize_sample_data(self):
         """Initialize with sample knowledge base data."""
@@ -133,18 +203,174 @@ class SimpleKnowledgeBase:
             }
         ]
         
-        for item in sample_data:
-            self.knowledge_items.append(item)
+        self._add_items(sample_data)
     
-    def search(self, query: str, k: int = 5, category: Optional[str] = None) -> List[Dict[str, Any]]:
-        """Simple keyword-based search."""
-        query_lower = query.lower()
-        results = []
+    def _add_items(self, items: List[Dict[str, Any]]):
+        """Store items, embedding them in one batch when embeddings are enabled."""
+        if self.embeddings:
+            vectors = self.embeddings.embed_documents([f"{item['title']}\n{item['content']}" for item in items])
+            for item, vector in zip(items, vectors):
+                item["embedding"] = np.asarray(vector, dtype=np.float32)
+        
+        for item in items:
+            self._add_item(item)
+    
+    def _add_item(self, item: Dict[str, Any]):
+        """Store an item and add it to the category partition and tag postings.
+        
+        A near-duplicate of an item already stored in the same category is
+        linked to that item instead (see `_link_duplicate`). Items without an
+        id get one from the number of items added so far, linked duplicates
+        included, so ids stay unique.
+        """
+        item.setdefault("id", f"doc_{len(self.knowledge_items) + self.duplicate_count}")
+        item["tags"] = normalize_tags(item.get("tags"))
+        text_terms = index_terms(f"{item['title']} {item['content']}")
+        band_keys = None
+        if self.near_duplicates is not None:
+            shingles = shingle_hashes(text_terms)
+            if len(shingles):
+                band_keys = self.near_duplicates.band_keys(minhash_signature(shingles))
+                match = self._find_duplicate(item["category"], band_keys, shingles)
+                if match is not None:
+                    self._link_duplicate(match[0], item, match[1])
+                    return
+        
+        position = len(self.knowledge_items)
+        self.knowledge_items.append(item)
+        self.category_index.setdefault(item["category"], array("I")).append(position)
+        for tag in item["tags"]:
+            self.tag_index.setdefault(tag, set()).add(position)
         
-        for item in self.knowledge_items:
-            if category and item["category"] != category:
+        terms = self.category_terms.setdefault(item["category"], {item["category"].lower()})
+        for tag in item["tags"]:
+            terms.update(tag.split())
+        
+        if band_keys is not None:
+            self.near_duplicates.add(position, band_keys)
+        self._index_item(position, item, text_terms + index_terms(" ".join(item["tags"])))
+    
+    def _shingles(self, item: Dict[str, Any]) -> np.ndarray:
+        """Shingle hashes of an item's title and content, as compared for near-duplicates."""
+        return shingle_hashes(index_terms(f"{item['title']} {item['content']}"))
+    
+    def _find_duplicate(self, category: str, band_keys: List[int],
+                        shingles: np.ndarray) -> Optional[Tuple[int, float]]:
+        """Position and similarity of the closest stored near-duplicate in a category, if any.
+        
+        LSH candidates are compared exactly, by the Jaccard similarity of
+        their shingles. Items in other categories are never matched, so
+        category-scoped searches still find every article.
+        """
+        best = None
+        for position in self.near_duplicates.candidates(band_keys):
+            item = self.knowledge_items[position]
+            if item["category"] != category:
                 continue
-                
+            similarity = jaccard(shingles, self._shingles(item))
+            if similarity >= self.near_duplicates.threshold and (best is None or similarity > best[1]):
+                best = (position, similarity)
+        return best
+    
+    def _link_duplicate(self, position: int, item: Dict[str, Any], similarity: float):
+        """Record a near-duplicate on the stored item it matches instead of indexing it.
+        
+        The stored item takes over the duplicate's extra tags, so tag filters
+        still reach the content; `duplicate_report` lists what was collapsed.
+        """
+        canonical = self.knowledge_items[position]
+        canonical.setdefault("duplicates", []).append({
+            "id": item["id"],
+            "title": item["title"],
+            "similarity": round(similarity, 3)
+        })
+        item["duplicate_of"] = canonical["id"]
+        terms = self.category_terms[canonical["category"]]
+        for tag in item["tags"]:
+            if tag not in canonical["tags"]:
+                canonical["tags"].append(tag)
+                self.tag_index.setdefault(tag, set()).add(position)
+                terms.update(tag.split())
+        self.memory_bytes += 100 + len(item["title"])
+        self.duplicate_count += 1
+        knowledge_duplicates.inc(stage="ingest")
+    
+    def _index_item(self, position: int, item: Dict[str, Any], terms: List[str]):
+        """Add an item's terms, those of its title, tags and content, to the lexical index."""
+        counts = Counter(terms)
+        for term, count in counts.items():
+            if term not in self.term_positions:
+                self.term_counts[term] = array("I")
+                self.term_positions[term] = array("I")
+            self.term_counts[term].append(count)
+            self.term_positions[term].append(position)
+        self.item_lengths.append(len(terms))
+        self.total_length += len(terms)
+        
+        embedding = item.get("embedding")
+        self.memory_bytes += (
+            ITEM_OVERHEAD_BYTES + len(item["title"]) + len(item["content"]) + 8 * len(counts)
+            + (embedding.nbytes if embedding is not None else 0)
+            + (self.near_duplicates.item_bytes() if self.near_duplicates is not None else 0)
+        )
+    
+    def _candidate_positions(self, category: Optional[str] = None, tags: Optional[List[str]] = None) -> Optional[Sequence[int]]:
+        """Get the positions of the items a search has to visit, or None for all of them.
+        
+        Filters are pushed into the index: a category restricts the scan to
+        that partition and tags to the intersection of their postings.
+        """
+        tags = normalize_tags(tags)
+        if not category and not tags:
+            return None
+        
+        if category:
+            partition = self.category_index.get(category, array("I"))
+            if not tags:
+                return partition
+            postings = [set(partition)]
+        else:
+            postings = []
+        postings.extend(self.tag_index.get(tag, set()) for tag in tags)
+        
+        # Intersect starting from the smallest posting to keep the working set small
+        postings.sort(key=len)
+        positions = set(postings[0])
+        for posting in postings[1:]:
+            positions &= posting
+        return sorted(positions)
+    
+    def _candidates(self, category: Optional[str] = None, tags: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """Get the items a search has to visit."""
+        positions = self._candidate_positions(category, tags)
+        if positions is None:
+            return self.knowledge_items
+        return [self.knowledge_items[position] for position in positions]
+    
+    def infer_category(self, query: str) -> Optional[str]:
+        """Infer the category a query is about, if exactly one category matches best."""
+        query_words = set(query.lower().split())
+        scores = {
+            category: len(query_words & terms)
+            for category, terms in self.category_terms.items()
+        }
+        best = max(scores.values(), default=0)
+        if best == 0:
+            return None
+        
+        best_categories = [category for category, score in scores.items() if score == best]
+        return best_categories[0] if len(best_categories) == 1 else None
+    
+    def get_categories(self) -> Dict[str, int]:
+        """Get the number of documents per category."""
+        return {category: len(positions) for category, positions in self.category_index.items()}
+    
+    def search(self, query: str, k: int = 5, category: Optional[str] = None, tags: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """Simple keyword-based search, optionally restricted to a category and to items carrying all given tags."""
+        query_lower = query.lower()
+        ranked = []
+        
+        for item in self._candidates(category, tags):
             # Simple keyword matching
             content_lower = item["content"].lower()
             title_lower = item["title"].lower()
@@ -160,56 +386,339 @@ class SimpleKnowledgeBase:
             if matches > 0:
                 # Calculate simple relevance score
                 relevance = matches / len(query_words)
-                results.append({
-                    "content": item["content"][:500] + "..." if len(item["content"]) > 500 else item["content"],
-                    "metadata": {
-                        "title": item["title"],
-                        "category": item["category"],
-                        "tags": item["tags"]
-                    },
-                    "score": relevance
-                })
+                ranked.append((item, relevance))
         
         # Sort by relevance and return top k
-        results.sort(key=lambda x: x["score"], reverse=True)
-        return results[:k]
+        ranked.sort(key=lambda x: x[1], reverse=True)
+        return self._top_distinct(ranked, k)
+    
+    def similarity_search(self, query: str, k: int = 5, category: Optional[str] = None, tags: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """Dense search by cosine similarity between the query and document embeddings."""
+        if not self.embeddings:
+            return self.search(query, k, category, tags)
+        
+        query_vector = np.asarray(self.embeddings.embed_query(query), dtype=np.float32)
+        query_norm = float(np.linalg.norm(query_vector)) or 1.0
+        
+        ranked = []
+        for item in self._candidates(category, tags):
+            vector = item.get("embedding")
+            if vector is None:
+                continue
+            norm = float(np.linalg.norm(vector)) or 1.0
+            similarity = float(np.dot(query_vector, vector)) / (query_norm * norm)
+            if similarity > 0:
+                ranked.append((item, similarity))
+        
+        ranked.sort(key=lambda x: x[1], reverse=True)
+        return self._top_distinct(ranked, k)
+    
+    def lexical_search(self, query: str, n: int = 50, category: Optional[str] = None,
+                       tags: Optional[List[str]] = None) -> List[Tuple[int, float]]:
+        """BM25 search over the lexical index; returns the positions and scores of the best `n` items.
+        
+        Only the postings of the query terms are visited, cut down to the
+        category partition and tag postings first, and scores are kept only
+        for the items they contain, so the cost follows how common those terms
+        and the filter are rather than the size of the corpus.
+        """
+        terms = set(index_terms(query)) & self.term_positions.keys()
+        item_count = len(self.item_lengths)
+        if not terms or not item_count:
+            return []
+        
+        allowed = self._candidate_positions(category, tags)
+        if allowed is not None:
+            if not allowed:
+                return []
+            if isinstance(allowed, array):
+                # A category partition, copied like the postings
+                allowed = np.frombuffer(allowed[:], dtype=np.uint32)
+            else:
+                allowed = np.asarray(allowed, dtype=np.uint32)
+        
+        matched_positions, matched_counts, idfs = [], [], []
+        for term in terms:
+            # Slices copy the postings, so items can be added while a search runs;
+            # counts are appended first, so they cover every position taken
+            positions = np.frombuffer(self.term_positions[term][:], dtype=np.uint32)
+            counts = np.frombuffer(self.term_counts[term][:len(positions)], dtype=np.uint32)
+            indexed = positions < item_count
+            positions, counts = positions[indexed], counts[indexed]
+            idf = math.log(1 + (item_count - len(positions) + 0.5) / (len(positions) + 0.5))
+            if allowed is not None:
+                # Filter positions are sorted, so membership is a binary search
+                found = np.searchsorted(allowed, positions)
+                kept = allowed[np.minimum(found, len(allowed) - 1)] == positions
+                positions, counts = positions[kept], counts[kept]
+            if len(positions):
+                matched_positions.append(positions)
+                matched_counts.append(counts)
+                idfs.append(np.full(len(positions), idf, dtype=np.float32))
+        if not matched_positions:
+            return []
+        
+        # Each matching item gets one slot, and its terms' scores are summed into it
+        candidates, slots = np.unique(np.concatenate(matched_positions), return_inverse=True)
+        lengths = np.array(itemgetter(*candidates.tolist())(self.item_lengths), dtype=np.float32, ndmin=1)
+        average_length = self.total_length / item_count
+        counts = np.concatenate(matched_counts).astype(np.float32)
+        norms = BM25_K1 * (1 - BM25_B + BM25_B * lengths[slots] / average_length)
+        term_scores = np.concatenate(idfs) * counts * (BM25_K1 + 1) / (counts + norms)
+        scores = np.bincount(slots, weights=term_scores, minlength=len(candidates))
+        
+        best = np.arange(len(candidates))
+        if len(best) > n:
+            best = np.argpartition(-scores, n - 1)[:n]
+        best = best[np.argsort(-scores[best], kind="stable")]
+        return [(int(candidates[slot]), float(scores[slot])) for slot in best]
+    
+    def _cross_scores(self, query: str, items: List[Dict[str, Any]]) -> List[float]:
+        """Score query/item pairs locally: query term coverage, title matches and matched word pairs."""
+        query_terms = index_terms(query)
+        unique_terms = set(query_terms)
+        pairs = set(zip(query_terms, query_terms[1:]))
+        scores = []
+        for item in items:
+            content_terms = index_terms(item["content"])
+            covered = unique_terms & (set(content_terms) | set(item["tags"]))
+            in_title = unique_terms & set(index_terms(item["title"]))
+            matched_pairs = pairs & set(zip(content_terms, content_terms[1:])) if pairs else set()
+            scores.append(
+                0.6 * len(covered | in_title) / len(unique_terms)
+                + 0.25 * len(in_title) / len(unique_terms)
+                + (0.15 * len(matched_pairs) / len(pairs) if pairs else 0.0)
+            )
+        return scores
+    
+    def two_stage_search(self, query: str, k: int = 5, category: Optional[str] = None,
+                         tags: Optional[List[str]] = None, candidates: int = 50) -> List[Dict[str, Any]]:
+        """Lexical candidate generation, then re-ranking of only those candidates.
+        
+        The best `candidates` items by BM25 are re-scored by cosine similarity
+        of their embeddings when embeddings are enabled, or by a local
+        cross-scoring function otherwise; lexical order breaks ties. Queries
+        without any indexed term fall back to the single-stage searches.
+        """
+        with stage_timer("retrieval_lexical"):
+            matches = self.lexical_search(query, candidates, category, tags)
+        if not matches:
+            if self.embeddings:
+                return self.similarity_search(query, k, category, tags)
+            return self.search(query, k, category, tags)
+        
+        items = [self.knowledge_items[position] for position, _ in matches]
+        with stage_timer("retrieval_rerank"):
+            if self.embeddings and all(item.get("embedding") is not None for item in items):
+                query_vector = np.asarray(self.embeddings.embed_query(query), dtype=np.float32)
+                vectors = np.stack([item["embedding"] for item in items])
+                norms = np.linalg.norm(vectors, axis=1) * (float(np.linalg.norm(query_vector)) or 1.0)
+                scores = (vectors @ query_vector) / np.where(norms > 0, norms, 1.0)
+            else:
+                scores = self._cross_scores(query, items)
+        
+        order = sorted(range(len(items)), key=lambda index: -scores[index])
+        return self._top_distinct([(items[index], float(scores[index])) for index in order], k)
+    
+    def _top_distinct(self, ranked: List[Tuple[Dict[str, Any], float]], k: int) -> List[Dict[str, Any]]:
+        """Build results for the best `k` ranked items, skipping near-duplicates of better ranked ones.
+        
+        Ingest links most near-duplicates already, but LSH banding can miss a
+        pair and items in different categories are never linked, so the top
+        k is compared pairwise once more.
+        """
+        results = []
+        kept_shingles = []
+        for item, score in ranked:
+            if len(results) == k:
+                break
+            if self.near_duplicates is not None:
+                shingles = self._shingles(item)
+                if any(jaccard(shingles, kept) >= self.near_duplicates.threshold for kept in kept_shingles):
+                    knowledge_duplicates.inc(stage="retrieval")
+                    continue
+                kept_shingles.append(shingles)
+            results.append(self._format_result(item, score))
+        return results
+    
+    def _format_result(self, item: Dict[str, Any], score: float) -> Dict[str, Any]:
+        """Build a search result for an item."""
+        return {
+            "content": item["content"][:500] + "..." if len(item["content"]) > 500 else item["content"],
+            "metadata": {
+                "title": item["title"],
+                "category": item["category"],
+                "tags": item["tags"]
+            },
+            "score": score
+        }
     
     def add_document(self, title: str, content: str, category: str, tags: List[str] = None) -> str:
-        """Add a document to the knowledge base."""
-        doc_id = f"doc_{len(self.knowledge_items)}"
-        self.knowledge_items.append({
-            "id": doc_id,
+        """Add a document to the knowledge base; returns its id, or that of the item it duplicates."""
+        item = {
             "title": title,
             "content": content,
             "category": category,
             "tags": tags or []
-        })
-        return doc_id
+        }
+        self._add_items([item])
+        return item.get("duplicate_of", item["id"])
+    
+    def add_documents(self, items: List[Dict[str, Any]]):
+        """Add items with their own ids in one batch; the index is updated incrementally."""
+        self._add_items(items)
     
     def get_all_documents(self) -> List[Dict[str, Any]]:
         """Get all documents from the knowledge base."""
         return self.knowledge_items
+    
+    def get_tag_counts(self) -> Dict[str, int]:
+        """Get the number of documents per tag."""
+        return {tag: len(positions) for tag, positions in self.tag_index.items()}
+    
+    def duplicate_report(self) -> List[Dict[str, Any]]:
+        """Items that near-duplicates were linked to, each with the duplicates collapsed into it."""
+        return [
+            {
+                "id": item["id"],
+                "title": item["title"],
+                "category": item["category"],
+                "duplicates": list(item["duplicates"])
+            }
+            for item in self.knowledge_items
+            if item.get("duplicates")
+        ]
+    
+    def get_state(self) -> Dict[str, Any]:
+        """Items and indexes, for a snapshot."""
+        state = {name: getattr(self, name) for name in SNAPSHOT_ATTRIBUTES}
+        state["near_duplicates"] = self.near_duplicates
+        return state
+    
+    def set_state(self, state: Dict[str, Any]):
+        """Restore items and indexes from a snapshot instead of indexing the items again."""
+        for name in SNAPSHOT_ATTRIBUTES:
+            setattr(self, name, state[name])
+        if self.near_duplicates is None:
+            return
+        # The saved buckets are reused when the band layout still matches the configured threshold
+        restored = state.get("near_duplicates")
+        threshold = self.near_duplicates.threshold
+        self.near_duplicates = NearDuplicateIndex(threshold)
+        if restored is not None and restored.rows == self.near_duplicates.rows:
+            self.near_duplicates.buckets = restored.buckets
+            return
+        for position, item in enumerate(self.knowledge_items):
+            shingles = self._shingles(item)
+            if len(shingles):
+                self.near_duplicates.add(position, self.near_duplicates.band_keys(minhash_signature(shingles)))
 
 
 class KnowledgeBaseManager:
-    """Knowledge base manager that uses simple search for now."""
+    """Knowledge base manager that uses simple search for now.
+    
+    `version` is the id of the last stored knowledge base change applied to
+    the index (see app.knowledge_sync); tenant indexes are saved to and
+    restored from snapshots together with it.
+    """
     
-    def __init__(self):
-        self.simple_kb = SimpleKnowledgeBase()
+    def __init__(self, sample_data: bool = True):
+        self.simple_kb = SimpleKnowledgeBase(embeddings=get_embeddings(), sample_data=sample_data)
         # Create a mock vectorstore for compatibility
         self.vectorstore = MockVectorStore(self.simple_kb)
+        self.version = 0
+        self._changes_lock = threading.Lock()
+    
+    def apply_changes(self, rows: List[Tuple]) -> int:
+        """Index stored items from change feed rows, skipping changes already applied.
+        
+        Rows are those of DatabaseManager.get_knowledge_changes. Returns the
+        number of items added.
+        """
+        with self._changes_lock:
+            rows = [row for row in rows if row[0] > self.version]
+            if rows:
+                self.add_documents([
+                    {
+                        "id": item_id,
+                        "title": title,
+                        "content": content,
+                        "category": category,
+                        "tags": tags.split(",") if tags else []
+                    }
+                    for _, _, item_id, title, content, category, tags, *_ in rows
+                ])
+                self.version = rows[-1][0]
+            return len(rows)
+    
+    def memory_bytes(self) -> int:
+        """Estimated memory held by the index."""
+        return self.simple_kb.memory_bytes
+    
+    def save_snapshot(self, path: str):
+        """Write the index to `path`, replacing any earlier snapshot atomically."""
+        with self._changes_lock:
+            data = pickle.dumps({
+                "format": SNAPSHOT_FORMAT,
+                "embeddings": self._embedding_model(),
+                "version": self.version,
+                "state": self.simple_kb.get_state()
+            }, protocol=pickle.HIGHEST_PROTOCOL)
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        # Workers may snapshot the same tenant at once, so each writes its own file first
+        temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary, "wb") as output:
+            output.write(data)
+        os.replace(temporary, path)
+    
+    def load_snapshot(self, path: str) -> bool:
+        """Restore the index from a snapshot written by this version with the same embedding model.
+        
+        Returns False, leaving the index as it is, when there is no usable snapshot.
+        """
+        try:
+            with open(path, "rb") as source:
+                snapshot = pickle.load(source)
+        except FileNotFoundError:
+            return False
+        except (OSError, pickle.UnpicklingError, EOFError) as e:
+            print(f"Ignoring unreadable knowledge base snapshot {path}: {e}")
+            return False
+        if snapshot.get("format") != SNAPSHOT_FORMAT or snapshot.get("embeddings") != self._embedding_model():
+            return False
+        with self._changes_lock:
+            self.simple_kb.set_state(snapshot["state"])
+            self.version = snapshot["version"]
+        return True
+    
+    def _embedding_model(self) -> Optional[str]:
+        embeddings = self.simple_kb.embeddings
+        return getattr(embeddings, "model_id", type(embeddings).__name__) if embeddings else None
     
     def add_document(self, title: str, content: str, category: str, tags: List[str] = None) -> str:
         """Add a document to the knowledge base."""
         return self.simple_kb.add_document(title, content, category, tags)
     
-    def search(self, query: str, k: int = 5, category: Optional[str] = None) -> List[Dict[str, Any]]:
+    def add_documents(self, items: List[Dict[str, Any]]):
+        """Add stored items (dicts with id, title, content, category and tags) to the index."""
+        self.simple_kb.add_documents(items)
+    
+    def search(self, query: str, k: int = 5, category: Optional[str] = None, tags: Optional[List[str]] = None) -> List[Dict[str, Any]]:
         """Search the knowledge base."""
-        return self.simple_kb.search(query, k, category)
+        return self.simple_kb.search(query, k, category, tags)
     
     def get_all_documents(self) -> List[Dict[str, Any]]:
         """Get all documents from the knowledge base."""
         return self.simple_kb.get_all_documents()
+    
+    def duplicate_report(self) -> List[Dict[str, Any]]:
+        """Near-duplicates collapsed at ingest, grouped by the item they were linked to."""
+        return self.simple_kb.duplicate_report()
+    
+    def infer_category(self, query: str) -> Optional[str]:
+        """Infer the category a query is about."""
+        return self.simple_kb.infer_category(query)
 
 
 class MockVectorStore:
@@ -219,17 +728,33 @@ class MockVectorStore:
         self.knowledge_base = knowledge_base
     
     def as_retriever(self, search_type="similarity", search_kwargs=None):
-        return MockRetriever(self.knowledge_base)
+        search_kwargs = search_kwargs or {}
+        return MockRetriever(knowledge_base=self.knowledge_base, k=search_kwargs.get("k", 3))
 
 
-class MockRetriever:
-    """Mock retriever that uses simple search."""
+class MockRetriever(BaseRetriever):
+    """Mock retriever that uses simple search.
     
-    def __init__(self, knowledge_base):
-        self.knowledge_base = knowledge_base
+    With `retrieval_candidates` set it retrieves in two stages (see
+    SimpleKnowledgeBase.two_stage_search). The category filter comes from the `retrieval_category` context variable,
+    and the tenant's knowledge base from `retrieval_knowledge_base`, so a
+    shared retrieval chain can be scoped per chat turn.
+    """
+    
+    knowledge_base: Any
+    k: int = 3
     
-    def get_relevant_documents(self, query: str):
-        results = self.knowledge_base.search(query, k=3)
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        knowledge_base = retrieval_knowledge_base.get() or self.knowledge_base
+        with stage_timer("retrieval"):
+            if settings.retrieval_candidates:
+                results = knowledge_base.two_stage_search(
+                    query, k=self.k, category=retrieval_category.get(), candidates=settings.retrieval_candidates
+                )
+            elif knowledge_base.embeddings:
+                results = knowledge_base.similarity_search(query, k=self.k, category=retrieval_category.get())
+            else:
+                results = knowledge_base.search(query, k=self.k, category=retrieval_category.get())
         documents = []
         
         for result in results:
@@ -0,0 +1,107 @@
+import asyncio
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from config import settings
+from app.chatbot import chatbot
+from app.database import DatabaseManager, SessionLocal
+from app.metrics import metrics
+from app.tenants import TenantRegistry
+
+index_lag_seconds = metrics.histogram(
+    "chatbot_knowledge_index_lag_seconds",
+    "Time from a knowledge base change being stored to this worker's index applying it",
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+)
+
+
+class KnowledgeSync:
+    """Keeps this worker's in-memory index in step with the knowledge base table.
+
+    Items are stored together with a row in the `knowledge_changes` feed,
+    whose ids only ever increase. Each worker remembers the last change it
+    applied and polls for newer ones every `knowledge_sync_interval_seconds`,
+    adding just those items to its index, so an article stored by any worker
+    is searchable everywhere within about one interval and the index is never
+    rebuilt. The first poll loads everything stored before the worker started.
+
+    Changes go to the index of their tenant when it is loaded; tenants not
+    in memory catch up from the feed when they are next loaded.
+    """
+
+    def __init__(self, tenants: TenantRegistry):
+        self.tenants = tenants
+        self.version = 0  # Id of the last change read from the feed
+        self.synced_at: Optional[float] = None  # Monotonic time of the last successful poll
+        self._lock = threading.Lock()
+
+    def poll(self, db_manager: Optional[DatabaseManager] = None) -> int:
+        """Apply every change stored after the last one applied; returns how many were applied."""
+        db = None
+        if db_manager is None:
+            db = SessionLocal()
+            db_manager = DatabaseManager(db)
+        applied = 0
+        try:
+            with self._lock:
+                while True:
+                    started = time.monotonic()
+                    rows = db_manager.get_knowledge_changes(self.version, settings.knowledge_sync_batch_size)
+                    by_tenant: Dict[str, List[Tuple]] = {}
+                    for row in rows:
+                        by_tenant.setdefault(row[7], []).append(row)
+                    for tenant_id, tenant_rows in by_tenant.items():
+                        manager = self.tenants.loaded(tenant_id)
+                        if manager is None:
+                            continue
+                        applied += manager.apply_changes(tenant_rows)
+                        now = datetime.utcnow()
+                        for _, changed_at, *_ in tenant_rows:
+                            if changed_at:
+                                index_lag_seconds.observe(max((now - changed_at).total_seconds(), 0.0))
+                    if rows:
+                        self.version = rows[-1][0]
+                    if len(rows) < settings.knowledge_sync_batch_size:
+                        self.synced_at = started
+                        return applied
+        finally:
+            if db is not None:
+                db.close()
+
+    def staleness_seconds(self) -> Optional[float]:
+        """Upper bound on how old a change can be without being in the index, None before the first poll."""
+        if self.synced_at is None:
+            return None
+        return time.monotonic() - self.synced_at
+
+
+async def knowledge_sync_loop(sync: KnowledgeSync):
+    """Poll the change feed off the event loop for as long as the worker runs."""
+    while True:
+        try:
+            applied = await asyncio.to_thread(sync.poll)
+            if applied:
+                print(f"Applied {applied} knowledge base changes (version {sync.version})")
+        except Exception as e:
+            print(f"Error syncing knowledge base: {e}")
+        await asyncio.sleep(settings.knowledge_sync_interval_seconds)
+
+
+# Global knowledge sync instance, feeding the chatbot's tenant indexes
+knowledge_sync = KnowledgeSync(chatbot.tenants)
+
+metrics.register_collector(lambda: [
+    ("chatbot_knowledge_index_version", "Id of the last knowledge base change this worker read from the feed",
+     knowledge_sync.version),
+    ("chatbot_knowledge_index_staleness_seconds",
+     "Seconds since this worker last caught up with the knowledge base change feed",
+     knowledge_sync.staleness_seconds() or 0.0)
+])
+metrics.register_collector(lambda: [
+    ("chatbot_tenant_indexes_loaded", "Tenant knowledge base indexes in memory, the default tenant's excluded",
+     knowledge_sync.tenants.loaded_count()),
+    ("chatbot_tenant_index_bytes", "Estimated memory of the tenant knowledge base indexes in memory",
+     knowledge_sync.tenants.memory_bytes())
+])
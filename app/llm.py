@@ -0,0 +1,123 @@
+import random
+import time
+from typing import Any, Iterator, List, Optional
+
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_openai import ChatOpenAI
+
+from config import settings
+from app.resilience import ResilientChatModel, llm_guard
+
+
+class FakeChatModel(BaseChatModel):
+    """Local chat model with injected latency, for load tests and offline runs.
+
+    Answers the condense step with the follow-up question unchanged, the
+    answer step with the start of the retrieved context and summary prompts
+    with the end of the conversation, so the chains behave like they would
+    with a real model, just without the network.
+    """
+
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    error_rate: float = 0.0
+    streaming: bool = False
+    answer_words: int = 60
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _reply(self, messages: List[BaseMessage]) -> str:
+        prompt = messages[-1].content
+        if prompt.rstrip().endswith("New summary:"):
+            # Conversation summary: keep the most recent words of the summary and new lines
+            text = prompt.rsplit("Current summary:", 1)[-1].replace("New lines of conversation:", "")
+            return " ".join(text.rsplit("New summary:", 1)[0].split()[-self.answer_words:])
+        if "Standalone question:" in prompt:
+            for line in reversed(prompt.splitlines()):
+                if line.startswith("Follow Up Input:"):
+                    return line[len("Follow Up Input:"):].strip()
+
+        context = messages[0].content.split("-" * 16, 1)[-1]
+        words = context.split()[:self.answer_words]
+        if not words:
+            return "I don't know the answer to that, let me connect you with our support team."
+        return "Here is what I found: " + " ".join(words)
+
+    def _wait(self):
+        delay = self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000)
+        if self.error_rate and random.random() < self.error_rate:
+            raise RuntimeError("Injected fake LLM error")
+
+    def _usage(self, messages: List[BaseMessage], text: str) -> dict:
+        # Word counts stand in for tokens so the token metrics move
+        prompt_tokens = sum(len(message.content.split()) for message in messages)
+        completion_tokens = len(text.split())
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens
+        }
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any
+    ) -> ChatResult:
+        if self.streaming:
+            text = "".join(chunk.message.content for chunk in self._stream(messages, stop, run_manager))
+        else:
+            self._wait()
+            text = self._reply(messages)
+        return ChatResult(
+            generations=[ChatGeneration(message=AIMessage(content=text))],
+            llm_output={"token_usage": self._usage(messages, text)}
+        )
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any
+    ) -> Iterator[ChatGenerationChunk]:
+        self._wait()
+        for index, word in enumerate(self._reply(messages).split(" ")):
+            token = word if index == 0 else " " + word
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+
+def create_llm() -> BaseChatModel:
+    """Create the configured chat model, with its calls guarded by deadlines and the circuit breaker."""
+    backend = settings.llm_backend.lower()
+    if backend == "openai":
+        model = ChatOpenAI(
+            openai_api_key=settings.openai_api_key,
+            model_name=settings.model_name,
+            temperature=settings.temperature,
+            max_tokens=settings.max_tokens,
+            streaming=settings.llm_streaming,
+            # Calls abandoned at the deadline should not linger in the client
+            request_timeout=settings.llm_timeout_seconds or None
+        )
+    elif backend == "fake":
+        model = FakeChatModel(
+            latency_ms=settings.fake_llm_latency_ms,
+            jitter_ms=settings.fake_llm_jitter_ms,
+            error_rate=settings.fake_llm_error_rate,
+            streaming=settings.llm_streaming
+        )
+    else:
+        raise ValueError(f"Unknown LLM backend: {settings.llm_backend}")
+    return ResilientChatModel(model=model, guard=llm_guard)
@@ -0,0 +1,254 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Tuple
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+
+# Latency buckets in seconds, from sub-millisecond lookups up to slow LLM calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(label_names: Sequence[str], label_values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(label_names, label_values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """Monotonic counter with optional labels."""
+
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels: str):
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        return self._values.get(key, 0.0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for key, value in values:
+            lines.append(f"{self.name}{_format_labels(self.label_names, key)} {value}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels.
+
+    Observing is a bisect and three additions under a lock, so it is cheap
+    enough for every request, and rendering copies the state before
+    formatting so a scrape never holds the lock for long.
+    """
+
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple[str, ...], List[float]] = {}  # bucket counts + [sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str):
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0.0] * (len(self.buckets) + 3)
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def count(self, **labels: str) -> float:
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        with self._lock:
+            series = self._series.get(key)
+            return series[-1] if series else 0.0
+
+    @contextmanager
+    def time(self, **labels: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            snapshot = [(key, list(series)) for key, series in self._series.items()]
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for key, series in snapshot:
+            cumulative = 0.0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                labels = _format_labels(self.label_names, key, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            cumulative += series[len(self.buckets)]
+            labels = _format_labels(self.label_names, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {series[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {series[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    """Holds all metrics and renders them in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics: List[Any] = []
+        self._collectors: List[Callable[[], List[Tuple[str, str, float]]]] = []
+
+    def counter(self, name: str, help_text: str, label_names: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, help_text, label_names)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help_text: str, label_names: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, help_text, label_names, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector: Callable[[], List[Tuple[str, str, float]]]):
+        """Register a callable returning (name, help, value) gauges read at scrape time."""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            try:
+                gauges = collector()
+            except Exception:
+                continue
+            for name, help_text, value in gauges:
+                lines.extend([f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {value}"])
+        return "\n".join(lines) + "\n"
+
+
+# Global metrics registry and chat pipeline metrics
+metrics = MetricsRegistry()
+
+stage_seconds = metrics.histogram(
+    "chatbot_stage_seconds",
+    "Time spent in each stage of the chat pipeline",
+    ["stage"]
+)
+llm_tokens = metrics.counter(
+    "chatbot_llm_tokens_total",
+    "LLM tokens used, by chain step and token type",
+    ["step", "type"]
+)
+cache_lookups = metrics.counter(
+    "chatbot_cache_lookups_total",
+    "Cache lookups, by cache and result (hit or miss)",
+    ["cache", "result"]
+)
+chat_requests = metrics.counter(
+    "chatbot_chat_requests_total",
+    "Chat requests handled, by outcome",
+    ["outcome"]
+)
+cancelled_requests = metrics.counter(
+    "chatbot_cancelled_requests_total",
+    "Chat requests abandoned because the client went away, by channel and the step that noticed it",
+    ["channel", "stage"]
+)
+
+
+@contextmanager
+def stage_timer(stage: str):
+    """Time a chat pipeline stage."""
+    with stage_seconds.time(stage=stage):
+        yield
+
+
+class ChainMetricsHandler(BaseCallbackHandler):
+    """Times the condense and answer steps of the retrieval chain and counts tokens.
+
+    The condense step is the LLMChain run directly under the top-level chain;
+    the answer step is the StuffDocumentsChain. A single instance is shared by
+    all requests, including those answered concurrently by threadpool and
+    batch threads, so per-run state is keyed by run id and guarded by a lock.
+    """
+
+    def __init__(self):
+        self._root_runs: Set[UUID] = set()
+        self._steps: Dict[UUID, Tuple[str, float]] = {}
+        self._llm_parents: Dict[UUID, Optional[UUID]] = {}
+        self._lock = threading.Lock()
+
+    def on_chain_start(self, serialized: Dict[str, Any], inputs: Dict[str, Any], *, run_id: UUID,
+                       parent_run_id: Optional[UUID] = None, **kwargs: Any):
+        name = (serialized or {}).get("id", [None])[-1]
+        with self._lock:
+            if parent_run_id is None:
+                self._root_runs.add(run_id)
+            elif name == "StuffDocumentsChain":
+                self._steps[run_id] = ("answer", time.perf_counter())
+            elif name == "LLMChain" and parent_run_id in self._root_runs:
+                self._steps[run_id] = ("condense", time.perf_counter())
+
+    def _finish_chain(self, run_id: UUID):
+        with self._lock:
+            self._root_runs.discard(run_id)
+            step = self._steps.pop(run_id, None)
+        if step:
+            stage_seconds.observe(time.perf_counter() - step[1], stage=step[0])
+
+    def on_chain_end(self, outputs: Dict[str, Any], *, run_id: UUID, **kwargs: Any):
+        self._finish_chain(run_id)
+
+    def on_chain_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        self._finish_chain(run_id)
+
+    def _step_for(self, parent_run_id: Optional[UUID]) -> str:
+        # The answer LLM runs under an LLMChain nested in StuffDocumentsChain,
+        # so only the condense LLM has a tracked step as its direct parent
+        with self._lock:
+            step = self._steps.get(parent_run_id)
+        return step[0] if step else "answer"
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: List, *, run_id: UUID,
+                            parent_run_id: Optional[UUID] = None, **kwargs: Any):
+        with self._lock:
+            self._llm_parents[run_id] = parent_run_id
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], *, run_id: UUID,
+                     parent_run_id: Optional[UUID] = None, **kwargs: Any):
+        with self._lock:
+            self._llm_parents[run_id] = parent_run_id
+
+    def on_llm_end(self, response: Any, *, run_id: UUID, **kwargs: Any):
+        with self._lock:
+            parent_run_id = self._llm_parents.pop(run_id, None)
+        step = self._step_for(parent_run_id)
+        usage = (getattr(response, "llm_output", None) or {}).get("token_usage") or {}
+        for token_type in ("prompt_tokens", "completion_tokens"):
+            if usage.get(token_type):
+                llm_tokens.inc(usage[token_type], step=step, type=token_type.replace("_tokens", ""))
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        with self._lock:
+            self._llm_parents.pop(run_id, None)
+
+
+# Global chain metrics handler instance
+chain_metrics_handler = ChainMetricsHandler()
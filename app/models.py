@@ -15,6 +15,7 @@ class ChatRequest(BaseModel):
     message: str = Field(..., description="User message")
     session_id: Optional[str] = Field(None, description="Session ID for conversation continuity")
     user_id: Optional[str] = Field(None, description="User identifier")
+    category: Optional[str] = Field(None, description="Knowledge base category to scope retrieval to")
 
 
 class ChatResponse(BaseModel):
@@ -24,6 +25,29 @@ class ChatResponse(BaseModel):
     conversation_id: str = Field(..., description="Conversation ID")
     sources: Optional[List[Dict[str, Any]]] = Field(None, description="Sources used for response")
     confidence: float = Field(..., description="Confidence score of the response")
+    degraded: bool = Field(False, description="Whether the answer comes from the knowledge base alone because the LLM was unavailable")
+
+
+class BatchChatRequest(BaseModel):
+    """Request model for the batch chat endpoint."""
+    items: List[ChatRequest] = Field(..., description="Messages to answer")
+
+
+class BatchChatResult(BaseModel):
+    """Result for a single message of a batch."""
+    index: int = Field(..., description="Position of the message in the request")
+    session_id: str = Field(..., description="Session ID")
+    conversation_id: str = Field(..., description="Conversation ID")
+    response: Optional[str] = Field(None, description="Assistant response")
+    sources: List[Dict[str, Any]] = Field(default_factory=list, description="Sources used for response")
+    confidence: float = Field(0.0, description="Confidence score of the response")
+    degraded: bool = Field(False, description="Whether the answer comes from the knowledge base alone because the LLM was unavailable")
+    error: Optional[str] = Field(None, description="Error message if this message failed")
+
+
+class BatchChatResponse(BaseModel):
+    """Response model for the batch chat endpoint."""
+    results: List[BatchChatResult]
 
 
 class ConversationHistory(BaseModel):
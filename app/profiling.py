@@ -0,0 +1,245 @@
+import cProfile
+import functools
+import io
+import itertools
+import pstats
+import random
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Any, Callable, Deque, Dict, List, Optional, TypeVar
+
+from config import settings
+
+
+# Innermost frames of threads that are blocked rather than doing work
+IDLE_FUNCTIONS = {"select", "poll", "wait", "sleep", "accept", "_worker"}
+
+# Set on the ASGI scope so a mounted app does not profile the same request twice
+PROFILED_SCOPE_KEY = "customer_support.profiled"
+
+T = TypeVar("T")
+
+# Finished thread profiles of the sampled request being handled, merged into its profile
+_thread_profiles: ContextVar[Optional[List[cProfile.Profile]]] = ContextVar("thread_profiles", default=None)
+
+
+def profile_in_thread(func: Callable[..., T]) -> Callable[..., T]:
+    """Wrap `func` to run under its own cProfile session when the current request is sampled.
+
+    cProfile only sees the thread that enabled it, which for a request is
+    the event loop. Work the request hands to another thread has to be
+    wrapped with this where it is handed over, to show up in the request's
+    profile; wrap on the request's side, as the request is looked up here.
+    """
+    profiles = _thread_profiles.get()
+    if profiles is None:
+        return func
+
+    @functools.wraps(func)
+    def profiled(*args: Any, **kwargs: Any) -> T:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profiler.disable()
+            # Only finished sessions are merged; one still running when the request ends is left out
+            profiles.append(profiler)
+
+    return profiled
+
+
+class ProfileStore:
+    """Bounded ring buffer of captured request profiles."""
+
+    def __init__(self, size: int):
+        self._profiles: Deque[Dict[str, Any]] = deque(maxlen=size)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def add(self, profile: Dict[str, Any]) -> int:
+        with self._lock:
+            profile["id"] = next(self._ids)
+            self._profiles.append(profile)
+            return profile["id"]
+
+    def list(self) -> List[Dict[str, Any]]:
+        """Profile metadata, newest first."""
+        with self._lock:
+            profiles = list(self._profiles)
+        return [
+            {key: value for key, value in profile.items() if key not in ("pstats", "collapsed")}
+            for profile in reversed(profiles)
+        ]
+
+    def get(self, profile_id: int) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            for profile in self._profiles:
+                if profile["id"] == profile_id:
+                    return profile
+        return None
+
+    def clear(self):
+        with self._lock:
+            self._profiles.clear()
+
+
+def collapse_stack(frame) -> str:
+    """Render a frame and its callers as a collapsed (flame graph) stack."""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class StackSampler:
+    """Samples the stacks of busy threads while watched requests are in flight.
+
+    Samples are added to every watched request; a request only keeps its
+    samples if it turns out to be slower than the threshold.
+    """
+
+    def __init__(self):
+        self._watched: Dict[int, Counter] = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def watch(self) -> Optional[int]:
+        """Start collecting samples for a request; returns a watch token."""
+        with self._lock:
+            if len(self._watched) >= settings.profiling_max_watched:
+                return None
+            token = next(self._ids)
+            self._watched[token] = Counter()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="profiling-sampler", daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+        return token
+
+    def unwatch(self, token: int) -> Counter:
+        with self._lock:
+            return self._watched.pop(token, Counter())
+
+    def _run(self):
+        own_ident = threading.get_ident()
+        while True:
+            if not self._watched:
+                self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+
+            stacks = []
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident or frame.f_code.co_name in IDLE_FUNCTIONS:
+                    continue
+                stacks.append(collapse_stack(frame))
+
+            with self._lock:
+                for samples in self._watched.values():
+                    samples.update(stacks)
+
+            time.sleep(settings.profiling_sampler_interval_ms / 1000)
+
+
+class ProfilingController:
+    """Runtime-adjustable profiling settings shared by all middleware instances."""
+
+    def __init__(self):
+        self.sample_rate = settings.profiling_sample_rate
+        self.slow_threshold_ms = settings.profiling_slow_threshold_ms
+        self.store = ProfileStore(settings.profiling_buffer_size)
+        self.sampler = StackSampler()
+        self.cprofile_lock = threading.Lock()  # cProfile sessions cannot overlap
+
+    def configure(self, sample_rate: Optional[float] = None, slow_threshold_ms: Optional[float] = None):
+        if sample_rate is not None:
+            self.sample_rate = max(0.0, min(sample_rate, 1.0))
+        if slow_threshold_ms is not None:
+            self.slow_threshold_ms = max(0.0, slow_threshold_ms)
+
+    def status(self) -> Dict[str, Any]:
+        return {"sample_rate": self.sample_rate, "slow_threshold_ms": self.slow_threshold_ms}
+
+
+def _pstats_text(profilers: List[cProfile.Profile], limit: int = 50) -> str:
+    output = io.StringIO()
+    stats = pstats.Stats(*profilers, stream=output)
+    stats.sort_stats("cumulative").print_stats(limit)
+    return output.getvalue()
+
+
+class ProfilingMiddleware:
+    """ASGI middleware that profiles sampled and slow requests.
+
+    A sampled request runs under cProfile; only one cProfile session runs at a
+    time and it covers everything on the event loop thread meanwhile. The
+    chat endpoints answer in the threadpool, which cProfile does not see, so
+    they wrap that work with `profile_in_thread` and its sessions are merged
+    into the request's profile. Threads started further down, such as the
+    ones bounding LLM calls with a timeout, are not covered; the stack
+    sampler sees every thread. With a slow threshold set, other requests are
+    watched by the stack sampler and their collapsed stacks are kept if they
+    exceed it.
+    """
+
+    def __init__(self, app, controller: Optional["ProfilingController"] = None):
+        self.app = app
+        self.controller = controller or profiling_controller
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope.get(PROFILED_SCOPE_KEY):
+            await self.app(scope, receive, send)
+            return
+        scope[PROFILED_SCOPE_KEY] = True
+
+        controller = self.controller
+        profiler = None
+        if controller.sample_rate and random.random() < controller.sample_rate:
+            if controller.cprofile_lock.acquire(blocking=False):
+                profiler = cProfile.Profile()
+
+        token = None
+        if profiler is None and controller.slow_threshold_ms:
+            token = controller.sampler.watch()
+
+        # Read before the app runs; mounted apps rewrite the scope path
+        entry = {"method": scope.get("method"), "path": scope.get("path")}
+
+        start = time.perf_counter()
+        thread_profiles = None
+        if profiler:
+            thread_profiles = _thread_profiles.set([])
+            profiler.enable()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            duration_ms = (time.perf_counter() - start) * 1000
+            entry["duration_ms"] = round(duration_ms, 3)
+            entry["captured_at"] = datetime.utcnow().isoformat()
+
+            if profiler:
+                profiler.disable()
+                profilers = [profiler, *_thread_profiles.get()]
+                _thread_profiles.reset(thread_profiles)
+                controller.cprofile_lock.release()
+                controller.store.add({
+                    **entry, "kind": "sampled", "threads": len(profilers), "pstats": _pstats_text(profilers)
+                })
+            elif token is not None:
+                samples = controller.sampler.unwatch(token)
+                if duration_ms >= controller.slow_threshold_ms:
+                    collapsed = "\n".join(f"{stack} {count}" for stack, count in samples.most_common())
+                    controller.store.add({**entry, "kind": "slow", "collapsed": collapsed})
+
+
+# Global profiling controller instance
+profiling_controller = ProfilingController()
@@ -0,0 +1,74 @@
+import asyncio
+from typing import Any, Dict, List, Optional, Set
+from uuid import UUID
+
+from fastapi import WebSocket
+from langchain_core.callbacks import BaseCallbackHandler
+
+
+class ConnectionManager:
+    """Tracks open WebSocket connections per session for server push."""
+
+    def __init__(self):
+        self.connections: Dict[str, Set[WebSocket]] = {}
+
+    def connect(self, session_id: str, websocket: WebSocket):
+        self.connections.setdefault(session_id, set()).add(websocket)
+
+    def disconnect(self, session_id: str, websocket: WebSocket):
+        sockets = self.connections.get(session_id)
+        if sockets:
+            sockets.discard(websocket)
+            if not sockets:
+                del self.connections[session_id]
+
+    async def push(self, session_id: str, event: Dict[str, Any]):
+        """Send an event to every connection of a session."""
+        for websocket in list(self.connections.get(session_id, ())):
+            try:
+                await websocket.send_json(event)
+            except Exception:
+                self.disconnect(session_id, websocket)
+
+
+class AnswerStreamHandler(BaseCallbackHandler):
+    """Forwards answer tokens from a worker thread to an asyncio queue.
+
+    Only tokens of LLM runs nested under the chain that writes the answer are
+    forwarded, so the condensed follow-up question is never streamed to the
+    customer. Tokens only arrive when the LLM is created with streaming on.
+    """
+
+    answer_chain_name = "StuffDocumentsChain"
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, queue: asyncio.Queue):
+        self.loop = loop
+        self.queue = queue
+        self._answer_runs: Set[UUID] = set()
+
+    def _track(self, run_id: UUID, parent_run_id: Optional[UUID]):
+        if parent_run_id in self._answer_runs:
+            self._answer_runs.add(run_id)
+
+    def on_chain_start(self, serialized: Dict[str, Any], inputs: Dict[str, Any], *, run_id: UUID,
+                       parent_run_id: Optional[UUID] = None, **kwargs: Any):
+        if (serialized or {}).get("id", [None])[-1] == self.answer_chain_name:
+            self._answer_runs.add(run_id)
+        else:
+            self._track(run_id, parent_run_id)
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: List, *, run_id: UUID,
+                            parent_run_id: Optional[UUID] = None, **kwargs: Any):
+        self._track(run_id, parent_run_id)
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], *, run_id: UUID,
+                     parent_run_id: Optional[UUID] = None, **kwargs: Any):
+        self._track(run_id, parent_run_id)
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any):
+        if token and run_id in self._answer_runs:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, {"type": "chunk", "content": token})
+
+
+# Global connection manager instance
+connection_manager = ConnectionManager()
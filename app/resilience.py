@@ -0,0 +1,282 @@
+import contextvars
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from typing import Any, Callable, Dict, List, Optional
+
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatResult
+
+from config import settings
+from app.cancellation import RequestCancelled
+from app.metrics import metrics
+
+# Successful call latencies kept for the hedging percentile
+LATENCY_WINDOW = 200
+
+llm_calls = metrics.counter(
+    "chatbot_llm_calls_total",
+    "LLM provider calls, by outcome (ok, error, timeout or rejected while the circuit is open)",
+    ["outcome"]
+)
+llm_hedges = metrics.counter(
+    "chatbot_llm_hedged_calls_total",
+    "Backup LLM calls started after the hedging delay, by whether the backup answered first",
+    ["result"]
+)
+
+
+class LLMUnavailable(Exception):
+    """The LLM provider did not produce an answer; callers fall back to a knowledge base answer."""
+
+
+class LLMTimeout(LLMUnavailable):
+    """An LLM call missed its deadline."""
+
+
+class CircuitOpenError(LLMUnavailable):
+    """The circuit breaker is open, so the provider is not called at all."""
+
+
+class CircuitBreaker:
+    """Stops calling a failing provider for a while.
+
+    After `failure_threshold` consecutive failures the circuit opens and calls
+    are rejected straight away. Once `reset_seconds` have passed one trial
+    call is let through: success closes the circuit, failure opens it again.
+    """
+
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = "half_open"
+            if self.state == "half_open" and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != "closed":
+                print("LLM circuit closed, provider calls resumed")
+            self.state = "closed"
+            self.failures = 0
+            self._trial_running = False
+
+    def release(self):
+        """Let another trial call through after one that ended without a verdict."""
+        with self._lock:
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            if self.state == "half_open" or (self.failure_threshold and self.failures >= self.failure_threshold):
+                if self.state != "open":
+                    print(f"LLM circuit opened after {self.failures} failures")
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+
+class LatencyWindow:
+    """Recent successful call latencies, for the hedging delay."""
+
+    def __init__(self, size: int = LATENCY_WINDOW):
+        self._samples: deque = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def add(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        with self._lock:
+            ordered = sorted(self._samples)
+        if not ordered:
+            return None
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def _start(func: Callable[[], Any]) -> Future:
+    """Run `func` in its own daemon thread, keeping the caller's context variables.
+
+    A call that misses its deadline is abandoned rather than killed, so it
+    must not hold a slot in a bounded pool; the provider client's own
+    request timeout ends it eventually.
+    """
+    future: Future = Future()
+    context = contextvars.copy_context()
+
+    def run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(context.run(func))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, daemon=True).start()
+    return future
+
+
+class LLMGuard:
+    """Deadline, circuit breaker and hedging policy shared by all calls to one provider."""
+
+    def __init__(self):
+        self.breaker = CircuitBreaker(settings.llm_breaker_failure_threshold, settings.llm_breaker_reset_seconds)
+        self.latencies = LatencyWindow()
+
+    def hedge_delay(self) -> Optional[float]:
+        """Seconds to wait before starting a backup call, or None when hedging is off or not calibrated yet."""
+        if not settings.llm_hedge_enabled or len(self.latencies) < settings.llm_hedge_min_samples:
+            return None
+        delay = self.latencies.percentile(settings.llm_hedge_percentile)
+        return max(delay, settings.llm_hedge_min_delay_ms / 1000)
+
+    def call(self, func: Callable[[], Any], hedge: bool = True,
+             on_timeout: Optional[Callable[[], None]] = None) -> Any:
+        """Call the provider within the deadline.
+
+        With hedging on, a backup call starts when the first one has taken
+        longer than the recent latency percentile, or straight away if the
+        first one fails early; whichever answers first wins. Provider errors
+        are raised as LLMUnavailable; RequestCancelled passes through.
+        """
+        if not self.breaker.allow():
+            llm_calls.inc(outcome="rejected")
+            raise CircuitOpenError("LLM circuit is open")
+
+        start = time.monotonic()
+        deadline = start + settings.llm_timeout_seconds if settings.llm_timeout_seconds else None
+        hedge_delay = self.hedge_delay() if hedge else None
+        calls: List[Future] = [_start(func)]
+        pending = set(calls)
+        error: Optional[BaseException] = None
+
+        while pending:
+            now = time.monotonic()
+            waits = []
+            if deadline is not None:
+                waits.append(deadline - now)
+            if hedge_delay is not None and len(calls) == 1:
+                waits.append(start + hedge_delay - now)
+            timeout = max(min(waits), 0) if waits else None
+
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    self._succeeded(time.monotonic() - start)
+                    if len(calls) > 1:
+                        llm_hedges.inc(result="won" if future is calls[1] else "lost")
+                    return future.result()
+                error = future.exception()
+                if isinstance(error, RequestCancelled):
+                    # The client went away; that says nothing about the provider
+                    self.breaker.release()
+                    raise error
+
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            # Hedge once: after the delay, or right away if the first call failed
+            if hedge_delay is not None and len(calls) == 1 and self.breaker.state == "closed":
+                if not pending or time.monotonic() - start >= hedge_delay:
+                    calls.append(_start(func))
+                    pending.add(calls[1])
+
+        self.breaker.record_failure()
+        if pending:
+            if on_timeout:
+                on_timeout()
+            llm_calls.inc(outcome="timeout")
+            raise LLMTimeout(f"LLM call did not finish within {settings.llm_timeout_seconds}s")
+        llm_calls.inc(outcome="error")
+        raise LLMUnavailable(f"LLM call failed: {error}") from error
+
+    def _succeeded(self, seconds: float):
+        self.breaker.record_success()
+        self.latencies.add(seconds)
+        llm_calls.inc(outcome="ok")
+
+
+class _TokenGate:
+    """Forwards streamed tokens to the run manager until the call is abandoned.
+
+    After its deadline a streaming call keeps running in its thread; closing
+    the gate stops it at the next token so it neither reaches the client
+    after the fallback answer nor keeps the provider stream open.
+    """
+
+    def __init__(self, run_manager: CallbackManagerForLLMRun):
+        self.run_manager = run_manager
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+    def on_llm_new_token(self, token: str, **kwargs: Any):
+        if self.closed:
+            raise LLMTimeout("LLM call was abandoned at its deadline")
+        self.run_manager.on_llm_new_token(token, **kwargs)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.run_manager, name)
+
+
+class ResilientChatModel(BaseChatModel):
+    """Chat model that sends every call of the wrapped model through an LLMGuard.
+
+    Callbacks and token usage are those of the wrapped model. Streaming calls
+    are never hedged, since both calls would emit tokens to the same client.
+    """
+
+    model: BaseChatModel
+    guard: LLMGuard
+
+    @property
+    def _llm_type(self) -> str:
+        return self.model._llm_type
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return self.model._identifying_params
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any
+    ) -> ChatResult:
+        gate = _TokenGate(run_manager) if run_manager else None
+        return self.guard.call(
+            lambda: self.model._generate(messages, stop=stop, run_manager=gate, **kwargs),
+            hedge=not getattr(self.model, "streaming", False),
+            on_timeout=gate.close if gate else None
+        )
+
+
+# Global LLM guard instance
+llm_guard = LLMGuard()
+
+metrics.register_collector(lambda: [
+    ("chatbot_llm_circuit_open", "Whether the LLM circuit breaker currently rejects calls",
+     1 if llm_guard.breaker.state == "open" else 0)
+])
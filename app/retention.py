@@ -0,0 +1,257 @@
+import asyncio
+import gzip
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy.orm import Session
+
+from config import settings
+from app.database import ArchivedConversation, Conversation, ConversationSummary, DatabaseManager, Message, SessionLocal
+
+
+class ArchiveStore:
+    """Append-only store of gzip-compressed conversation segments.
+
+    Every archived conversation is written as an independent gzip member, so
+    a segment file is a valid gzip stream and any single conversation can be
+    read back with one seek and one read using the offset and length kept in
+    the `archived_conversations` table.
+    """
+
+    def __init__(self, path: Optional[str] = None, segment_max_bytes: Optional[int] = None):
+        self.path = path or settings.archive_path
+        self.segment_max_bytes = segment_max_bytes or settings.archive_segment_max_bytes
+        self._lock = threading.Lock()
+
+    def _segment_names(self) -> List[str]:
+        if not os.path.isdir(self.path):
+            return []
+        return sorted(
+            name for name in os.listdir(self.path)
+            if name.startswith("segment-") and name.endswith(".gz")
+        )
+
+    def _current_segment(self) -> str:
+        """Return the segment to append to, rolling over when it is full."""
+        segments = self._segment_names()
+        if segments:
+            latest = segments[-1]
+            if os.path.getsize(os.path.join(self.path, latest)) < self.segment_max_bytes:
+                return latest
+            next_number = int(latest[len("segment-"):-len(".gz")]) + 1
+        else:
+            next_number = 1
+        return f"segment-{next_number:06d}.gz"
+
+    def append(self, records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Append records to the current segment and return their locations."""
+        with self._lock:
+            os.makedirs(self.path, exist_ok=True)
+            segment = self._current_segment()
+            locations = []
+
+            with open(os.path.join(self.path, segment), "ab") as output:
+                offset = output.tell()
+                for record in records:
+                    member = gzip.compress(json.dumps(record, ensure_ascii=False).encode("utf-8"))
+                    output.write(member)
+                    locations.append({"segment": segment, "offset": offset, "length": len(member)})
+                    offset += len(member)
+
+                # The segment must be durable before the hot rows are deleted
+                output.flush()
+                os.fsync(output.fileno())
+
+            return locations
+
+    def read(self, segment: str, offset: int, length: int) -> Dict[str, Any]:
+        """Read a single archived record."""
+        with open(os.path.join(self.path, segment), "rb") as source:
+            source.seek(offset)
+            return json.loads(gzip.decompress(source.read(length)))
+
+
+def _archive_record(conversation: Conversation, messages: List[Message]) -> Dict[str, Any]:
+    """Build the archived representation of a conversation."""
+    return {
+        "id": conversation.id,
+        "session_id": conversation.session_id,
+        "user_id": conversation.user_id,
+        "created_at": conversation.created_at.isoformat() if conversation.created_at else None,
+        "updated_at": conversation.updated_at.isoformat() if conversation.updated_at else None,
+        "messages": [
+            {
+                "role": message.role,
+                "content": message.content,
+                "timestamp": message.timestamp.isoformat() if message.timestamp else None
+            }
+            for message in messages
+        ]
+    }
+
+
+class RetentionManager:
+    """Moves idle conversations out of the hot tables into the archive."""
+
+    def __init__(self, store: Optional[ArchiveStore] = None):
+        self.store = store or ArchiveStore()
+
+    def cutoff(self) -> datetime:
+        """Conversations idle since before this time are archived."""
+        return datetime.utcnow() - timedelta(days=settings.retention_idle_days)
+
+    def archive_batch(self, db: Session, cutoff: Optional[datetime] = None, limit: Optional[int] = None) -> int:
+        """Archive one bounded batch of idle conversations.
+
+        Returns the number of conversations archived.
+        """
+        cutoff = cutoff or self.cutoff()
+        limit = limit or settings.retention_batch_size
+
+        conversations = (
+            db.query(Conversation)
+            .filter(Conversation.updated_at < cutoff)
+            .order_by(Conversation.updated_at)
+            .limit(limit)
+            .all()
+        )
+        if not conversations:
+            return 0
+
+        conversation_ids = [conversation.id for conversation in conversations]
+        messages_by_conversation: Dict[str, List[Message]] = {cid: [] for cid in conversation_ids}
+        messages = (
+            db.query(Message)
+            .filter(Message.conversation_id.in_(conversation_ids))
+            .order_by(Message.conversation_id, Message.timestamp)
+            .all()
+        )
+        for message in messages:
+            messages_by_conversation[message.conversation_id].append(message)
+
+        records = [
+            _archive_record(conversation, messages_by_conversation[conversation.id])
+            for conversation in conversations
+        ]
+        locations = self.store.append(records)
+
+        try:
+            # Only conversations still idle now are archived. One that got a chat
+            # turn since the batch was read stays live, and its segment bytes
+            # simply become unreferenced
+            db.query(Conversation).filter(
+                Conversation.id.in_(conversation_ids),
+                Conversation.updated_at < cutoff
+            ).delete(synchronize_session=False)
+            live_ids = {
+                conversation_id for (conversation_id,) in
+                db.query(Conversation.id).filter(Conversation.id.in_(conversation_ids))
+            }
+            archived_ids = [cid for cid in conversation_ids if cid not in live_ids]
+
+            for conversation, location in zip(conversations, locations):
+                if conversation.id in live_ids:
+                    continue
+                db.add(ArchivedConversation(
+                    conversation_id=conversation.id,
+                    session_id=conversation.session_id,
+                    user_id=conversation.user_id,
+                    segment=location["segment"],
+                    offset=location["offset"],
+                    length=location["length"],
+                    message_count=len(messages_by_conversation[conversation.id]),
+                    created_at=conversation.created_at,
+                    updated_at=conversation.updated_at
+                ))
+
+            db.query(Message).filter(
+                Message.conversation_id.in_(archived_ids)
+            ).delete(synchronize_session=False)
+            # Summaries are derived from the messages and are not archived
+            db.query(ConversationSummary).filter(
+                ConversationSummary.conversation_id.in_(archived_ids)
+            ).delete(synchronize_session=False)
+            db.commit()
+        except Exception:
+            # Segment bytes written for this batch simply become unreferenced
+            db.rollback()
+            raise
+
+        return len(archived_ids)
+
+    def run(self, max_batches: Optional[int] = None) -> int:
+        """Archive idle conversations batch by batch until none are left."""
+        cutoff = self.cutoff()
+        total = 0
+        batches = 0
+
+        while max_batches is None or batches < max_batches:
+            db = SessionLocal()
+            try:
+                archived = self.archive_batch(db, cutoff)
+            finally:
+                db.close()
+
+            if not archived:
+                break
+            total += archived
+            batches += 1
+
+        return total
+
+    def load(self, entry: ArchivedConversation) -> Dict[str, Any]:
+        """Read an archived conversation back from its segment."""
+        return self.store.read(entry.segment, entry.offset, entry.length)
+
+    def get_session_history(self, session_id: str, db_manager: DatabaseManager) -> Optional[Dict[str, Any]]:
+        """The history of a session across its archived conversations and its live one.
+
+        A session that comes back after its conversation was archived gets a
+        new conversation, so its earlier turns are only in the archive. The
+        messages of all of them are returned oldest first, under the live
+        conversation's details, or those of the latest archived one. Reads
+        segment files, so call it off the event loop.
+        """
+        records = [self.load(entry) for entry in db_manager.get_archived_conversations(session_id)]
+        conversation = db_manager.get_conversation(session_id)
+        if conversation is None and not records:
+            return None
+
+        live_messages = []
+        if conversation is not None:
+            live_messages = [
+                {
+                    "role": message.role,
+                    "content": message.content,
+                    "timestamp": message.timestamp.isoformat() if message.timestamp else None
+                }
+                for message in db_manager.get_conversation_messages(conversation.id)
+            ]
+            history = _archive_record(conversation, [])
+        else:
+            history = dict(records[-1])
+
+        history["messages"] = [message for record in records for message in record["messages"]] + live_messages
+        return history
+
+
+async def retention_loop(manager: RetentionManager):
+    """Periodically archive idle conversations off the event loop.
+
+    Each batch runs in a worker thread and the loop yields between batches,
+    so archival never blocks request handling for longer than one batch.
+    """
+    while True:
+        try:
+            while await asyncio.to_thread(manager.run, 1):
+                await asyncio.sleep(0)
+        except Exception as e:
+            print(f"Error in retention job: {e}")
+        await asyncio.sleep(settings.retention_interval_seconds)
+
+
+# Global retention manager instance
+retention_manager = RetentionManager()
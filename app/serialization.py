@@ -0,0 +1,69 @@
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import orjson
+from fastapi.responses import ORJSONResponse, Response
+
+from app.database import Conversation, KnowledgeBase, Message
+from app.metrics import stage_timer
+
+
+# Handlers that return one of these responses bypass FastAPI's response_model
+# validation; the payloads below are built from trusted database rows and
+# chatbot results that already have the documented shape.
+
+
+def json_response(content: Any, status_code: int = 200) -> ORJSONResponse:
+    """Encode already-shaped content with orjson."""
+    with stage_timer("serialization"):
+        return ORJSONResponse(content, status_code=status_code)
+
+
+def split_tags(tags: Optional[str]) -> List[str]:
+    """Split the denormalized comma-separated tag column."""
+    return tags.split(",") if tags else []
+
+
+def knowledge_item_dict(item: KnowledgeBase) -> Dict[str, Any]:
+    """Convert a knowledge base row into the KnowledgeBaseItem shape."""
+    return {
+        "id": item.id,
+        "title": item.title,
+        "content": item.content,
+        "category": item.category,
+        "tags": split_tags(item.tags),
+        "created_at": item.created_at,
+        "updated_at": item.updated_at
+    }
+
+
+def knowledge_rows_response(rows: Iterable[Tuple]) -> Response:
+    """Encode knowledge base column tuples straight to a JSON list."""
+    with stage_timer("serialization"):
+        body = orjson.dumps([
+            {
+                "id": id_,
+                "title": title,
+                "content": content,
+                "category": category,
+                "tags": split_tags(tags),
+                "created_at": created_at,
+                "updated_at": updated_at
+            }
+            for id_, title, content, category, tags, created_at, updated_at in rows
+        ])
+    return Response(body, media_type="application/json")
+
+
+def conversation_history_dict(conversation: Conversation, messages: Iterable[Message]) -> Dict[str, Any]:
+    """Convert a conversation and its messages into the ConversationHistory shape."""
+    return {
+        "conversation_id": conversation.id,
+        "session_id": conversation.session_id,
+        "user_id": conversation.user_id,
+        "messages": [
+            {"role": message.role, "content": message.content, "timestamp": message.timestamp}
+            for message in messages
+        ],
+        "created_at": conversation.created_at,
+        "updated_at": conversation.updated_at
+    }
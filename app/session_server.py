@@ -0,0 +1,203 @@
+import asyncio
+import itertools
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+# Commands allowed between MULTI and EXEC
+TRANSACTION_COMMANDS = {"GET", "SET", "DEL"}
+
+# Reply of an aborted transaction
+NULL_ARRAY = object()
+
+# Seconds between sweeps for expired keys that are never read again
+EXPIRE_SWEEP_INTERVAL = 1.0
+
+# Keys checked per event loop turn during a sweep, so commands are not held up
+EXPIRE_SWEEP_BATCH = 1000
+
+
+def encode_reply(value: Any) -> bytes:
+    """Encode a reply in RESP2; strings are status replies, bytes are bulk strings."""
+    if value is None:
+        return b"$-1\r\n"
+    if value is NULL_ARRAY:
+        return b"*-1\r\n"
+    if isinstance(value, Exception):
+        return b"-ERR %s\r\n" % str(value).encode("utf-8")
+    if isinstance(value, str):
+        return b"+%s\r\n" % value.encode("utf-8")
+    if isinstance(value, int):
+        return b":%d\r\n" % value
+    if isinstance(value, bytes):
+        return b"$%d\r\n%s\r\n" % (len(value), value)
+    if isinstance(value, list):
+        return b"*%d\r\n" % len(value) + b"".join(encode_reply(item) for item in value)
+    raise TypeError(f"Cannot encode {type(value).__name__}")
+
+
+class SessionServer:
+    """Local stand-in for Redis with the commands the session state store uses.
+
+    Keys live in memory with optional expiry. GET, SET (with EX or PX), DEL,
+    WATCH, UNWATCH, MULTI, EXEC and DISCARD behave as in Redis, so several
+    workers can share session state on one machine without installing Redis.
+    Everything runs on one event loop, so every command is atomic. Expired
+    keys are dropped when read and by a sweep every EXPIRE_SWEEP_INTERVAL,
+    so abandoned sessions do not stay in memory. Data is lost when the
+    server stops.
+    """
+
+    def __init__(self):
+        self._data: Dict[bytes, Tuple[bytes, Optional[float]]] = {}
+        # Last write to a key, for WATCH; kept only while some connection watches
+        self._written: Dict[bytes, int] = {}
+        self._ticks = itertools.count(1)
+        self._tick = 0
+        self._watching = 0
+
+    def _touch(self, key: bytes):
+        self._tick = next(self._ticks)
+        if self._watching:
+            self._written[key] = self._tick
+
+    def _get(self, key: bytes) -> Optional[bytes]:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._data[key]
+            self._touch(key)
+            return None
+        return value
+
+    async def expire_loop(self):
+        """Drop expired keys in the background, a batch of keys per event loop turn."""
+        while True:
+            await asyncio.sleep(EXPIRE_SWEEP_INTERVAL)
+            keys = list(self._data)
+            for start in range(0, len(keys), EXPIRE_SWEEP_BATCH):
+                for key in keys[start:start + EXPIRE_SWEEP_BATCH]:
+                    self._get(key)
+                await asyncio.sleep(0)
+
+    def _execute(self, name: str, args: List[bytes]) -> Any:
+        try:
+            return self._run(name, args)
+        except (IndexError, ValueError):
+            return ValueError(f"wrong arguments for '{name}' command")
+
+    def _run(self, name: str, args: List[bytes]) -> Any:
+        if name == "PING":
+            return args[0] if args else "PONG"
+        if name in ("SELECT", "AUTH"):
+            return "OK"
+        if name == "GET":
+            return self._get(args[0])
+        if name == "SET":
+            if len(args) not in (2, 4):
+                return ValueError("syntax error")
+            expires_at = None
+            if len(args) == 4:
+                unit = args[2].upper()
+                if unit not in (b"EX", b"PX"):
+                    return ValueError("syntax error")
+                expires_at = time.monotonic() + int(args[3]) / (1 if unit == b"EX" else 1000)
+            self._data[args[0]] = (args[1], expires_at)
+            self._touch(args[0])
+            return "OK"
+        if name == "DEL":
+            deleted = 0
+            for key in args:
+                if self._get(key) is not None:
+                    del self._data[key]
+                    self._touch(key)
+                    deleted += 1
+            return deleted
+        return ValueError(f"unknown command '{name}'")
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        watched: Dict[bytes, int] = {}
+        queued: Optional[List[Tuple[str, List[bytes]]]] = None
+
+        def unwatch():
+            if watched:
+                watched.clear()
+                self._watching -= 1
+                if not self._watching:
+                    self._written.clear()
+
+        try:
+            while True:
+                command = await self._read_command(reader)
+                if command is None:
+                    break
+                name, args = command[0].decode("utf-8", "replace").upper(), command[1:]
+
+                if name == "QUIT":
+                    writer.write(encode_reply("OK"))
+                    break
+                if name == "WATCH":
+                    if not watched:
+                        self._watching += 1
+                    for key in args:
+                        watched.setdefault(key, self._tick)
+                    reply = "OK"
+                elif name == "UNWATCH":
+                    unwatch()
+                    reply = "OK"
+                elif name == "MULTI":
+                    queued = []
+                    reply = "OK"
+                elif name == "DISCARD":
+                    queued = None
+                    unwatch()
+                    reply = "OK"
+                elif name == "EXEC":
+                    if queued is None:
+                        reply = ValueError("EXEC without MULTI")
+                    elif any(self._written.get(key, 0) > since for key, since in watched.items()):
+                        reply = NULL_ARRAY  # A watched key was written since WATCH
+                    else:
+                        reply = [self._execute(queued_name, queued_args) for queued_name, queued_args in queued]
+                    queued = None
+                    unwatch()
+                elif queued is not None and name in TRANSACTION_COMMANDS:
+                    queued.append((name, args))
+                    reply = "QUEUED"
+                else:
+                    reply = self._execute(name, args)
+
+                writer.write(encode_reply(reply))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            unwatch()
+            writer.close()
+
+    async def _read_command(self, reader: asyncio.StreamReader) -> Optional[List[bytes]]:
+        line = await reader.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            # Inline command, as typed into telnet
+            return line.split() or [b"PING"]
+        parts = []
+        for _ in range(int(line[1:-2])):
+            header = await reader.readline()
+            if not header.startswith(b"$"):
+                raise ValueError("Expected a bulk string")
+            data = await reader.readexactly(int(header[1:-2]) + 2)
+            parts.append(data[:-2])
+        return parts
+
+    async def serve(self, host: str, port: int):
+        server = await asyncio.start_server(self.handle, host, port)
+        print(f"Session server listening on {host}:{port}")
+        sweeper = asyncio.create_task(self.expire_loop())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            sweeper.cancel()
@@ -0,0 +1,293 @@
+import os
+import socket
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import orjson
+
+from config import settings
+from app.metrics import metrics
+
+# Saves between sweeps of expired rows from the SQLite store
+SQLITE_SWEEP_EVERY = 1000
+
+session_state_operations = metrics.counter(
+    "chatbot_session_state_operations_total",
+    "Session state store operations, by operation (load or save) and result",
+    ["operation", "result"]
+)
+
+# A turn is (role, content) with role "h" for the customer and "a" for the assistant
+Turn = Tuple[str, str]
+
+
+class SessionStoreError(Exception):
+    """The session state store could not be reached or answered with an error."""
+
+
+def encode_history(turns: List[Turn]) -> bytes:
+    return orjson.dumps(turns)
+
+
+def decode_history(data: bytes) -> List[Turn]:
+    return [(role, content) for role, content in orjson.loads(data)]
+
+
+class SessionStore(ABC):
+    """Versioned chat history per session.
+
+    `load` returns the stored version (0 when the session was never saved)
+    and its turns, or None for the turns when there is no live state, say
+    because it expired. `save` is a compare-and-set: it writes only if the
+    stored version still equals `version`, then bumps it, so concurrent turns
+    of one session served by different workers never overwrite each other.
+    """
+
+    @abstractmethod
+    def load(self, session_id: str) -> Tuple[int, Optional[List[Turn]]]:
+        """The stored version and turns of a session."""
+
+    @abstractmethod
+    def save(self, session_id: str, version: int, turns: List[Turn]) -> bool:
+        """Store turns if the stored version is still `version`; returns whether it was."""
+
+    @abstractmethod
+    def delete(self, session_id: str):
+        """Drop a session's state."""
+
+    def reconnect(self):
+        """Drop connections inherited from the parent process after a fork."""
+
+    def _expires_at(self) -> Optional[float]:
+        ttl = settings.session_state_ttl_seconds
+        return time.time() + ttl if ttl else None
+
+
+class InProcessSessionStore(SessionStore):
+    """State in this process only; fine for one worker, stale behind a load balancer."""
+
+    def __init__(self, max_sessions: Optional[int] = None):
+        self.max_sessions = max_sessions or settings.session_state_max_sessions
+        self._sessions: "OrderedDict[str, Tuple[int, bytes, Optional[float]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, session_id: str) -> Tuple[int, Optional[List[Turn]]]:
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return 0, None
+            self._sessions.move_to_end(session_id)
+        version, data, expires_at = entry
+        if expires_at is not None and expires_at < time.time():
+            return version, None
+        return version, decode_history(data)
+
+    def save(self, session_id: str, version: int, turns: List[Turn]) -> bool:
+        data = encode_history(turns)
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if (entry[0] if entry else 0) != version:
+                return False
+            self._sessions[session_id] = (version + 1, data, self._expires_at())
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        return True
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+
+class SQLiteSessionStore(SessionStore):
+    """State in a SQLite file that every worker on the host opens.
+
+    The file runs in WAL mode, so reads do not wait for writers, and a
+    save is a single conditional UPDATE (or INSERT for a new session).
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or settings.session_store_path
+        self._lock = threading.Lock()
+        self._connection = None
+        self._saves = 0
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.reconnect()
+
+    def reconnect(self):
+        self._connection = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS session_state ("
+            "session_id TEXT PRIMARY KEY, version INTEGER NOT NULL, history BLOB NOT NULL, expires_at REAL)"
+        )
+        self._connection.commit()
+
+    def load(self, session_id: str) -> Tuple[int, Optional[List[Turn]]]:
+        try:
+            with self._lock:
+                row = self._connection.execute(
+                    "SELECT version, history, expires_at FROM session_state WHERE session_id = ?", (session_id,)
+                ).fetchone()
+        except sqlite3.Error as e:
+            raise SessionStoreError(str(e)) from e
+        if row is None:
+            return 0, None
+        version, data, expires_at = row
+        if expires_at is not None and expires_at < time.time():
+            return version, None
+        return version, decode_history(data)
+
+    def save(self, session_id: str, version: int, turns: List[Turn]) -> bool:
+        data = encode_history(turns)
+        try:
+            with self._lock:
+                if version == 0:
+                    cursor = self._connection.execute(
+                        "INSERT OR IGNORE INTO session_state (session_id, version, history, expires_at) "
+                        "VALUES (?, 1, ?, ?)", (session_id, data, self._expires_at())
+                    )
+                else:
+                    cursor = self._connection.execute(
+                        "UPDATE session_state SET version = version + 1, history = ?, expires_at = ? "
+                        "WHERE session_id = ? AND version = ?", (data, self._expires_at(), session_id, version)
+                    )
+                self._saves += 1
+                if self._saves % SQLITE_SWEEP_EVERY == 0:
+                    self._connection.execute("DELETE FROM session_state WHERE expires_at < ?", (time.time(),))
+                self._connection.commit()
+        except sqlite3.Error as e:
+            raise SessionStoreError(str(e)) from e
+        return cursor.rowcount == 1
+
+    def delete(self, session_id: str):
+        try:
+            with self._lock:
+                self._connection.execute("DELETE FROM session_state WHERE session_id = ?", (session_id,))
+                self._connection.commit()
+        except sqlite3.Error as e:
+            raise SessionStoreError(str(e)) from e
+
+
+class RespConnection:
+    """Blocking client connection speaking the Redis protocol (RESP2)."""
+
+    def __init__(self, url: str, timeout: float = 2.0):
+        parsed = urlparse(url)
+        self._socket = socket.create_connection((parsed.hostname or "localhost", parsed.port or 6379), timeout=timeout)
+        self._reader = self._socket.makefile("rb")
+        if parsed.password:
+            self.command("AUTH", parsed.password)
+        database = parsed.path.strip("/")
+        if database and database != "0":
+            self.command("SELECT", database)
+
+    def close(self):
+        self._reader.close()
+        self._socket.close()
+
+    def command(self, *args: Any) -> Any:
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            value = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(value), value))
+        self._socket.sendall(b"".join(parts))
+        return self._read_reply()
+
+    def _read_reply(self) -> Any:
+        line = self._reader.readline()
+        if not line.endswith(b"\r\n"):
+            raise ConnectionError("Connection closed by the session store")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode("utf-8")
+        if kind == b"-":
+            raise SessionStoreError(payload.decode("utf-8"))
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            data = self._reader.read(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            length = int(payload)
+            return None if length < 0 else [self._read_reply() for _ in range(length)]
+        raise SessionStoreError(f"Unexpected reply from the session store: {line!r}")
+
+
+class RespSessionStore(SessionStore):
+    """State in Redis, or anything speaking its protocol such as session_server.py.
+
+    Each session is one key holding "<version>:<history>". A save watches
+    the key, checks the version and writes it in a MULTI/EXEC transaction,
+    which the server aborts if another worker wrote the key in between.
+    Each thread keeps its own connection, since WATCH is per connection.
+    """
+
+    def __init__(self, url: Optional[str] = None):
+        self.url = url or settings.session_store_url
+        self._local = threading.local()
+
+    def reconnect(self):
+        self._local = threading.local()
+
+    def _key(self, session_id: str) -> str:
+        return f"session:{session_id}"
+
+    def _run(self, *commands: Tuple) -> List[Any]:
+        connection = getattr(self._local, "connection", None)
+        try:
+            if connection is None:
+                connection = self._local.connection = RespConnection(self.url)
+            return [connection.command(*command) for command in commands]
+        except (OSError, ConnectionError) as e:
+            if connection is not None:
+                connection.close()
+            self._local.connection = None
+            raise SessionStoreError(f"Session store unavailable: {e}") from e
+
+    def _parse(self, value: Optional[bytes]) -> Tuple[int, Optional[List[Turn]]]:
+        if value is None:
+            return 0, None
+        version, _, data = value.partition(b":")
+        return int(version), decode_history(data)
+
+    def load(self, session_id: str) -> Tuple[int, Optional[List[Turn]]]:
+        return self._parse(self._run(("GET", self._key(session_id)))[0])
+
+    def save(self, session_id: str, version: int, turns: List[Turn]) -> bool:
+        key = self._key(session_id)
+        _, current = self._run(("WATCH", key), ("GET", key))
+        if self._parse(current)[0] != version:
+            self._run(("UNWATCH",))
+            return False
+        value = b"%d:%s" % (version + 1, encode_history(turns))
+        ttl = settings.session_state_ttl_seconds
+        write = ("SET", key, value, "EX", ttl) if ttl else ("SET", key, value)
+        return self._run(("MULTI",), write, ("EXEC",))[-1] is not None
+
+    def delete(self, session_id: str):
+        self._run(("DEL", self._key(session_id)))
+
+
+def create_session_store() -> SessionStore:
+    """Create the configured session state store."""
+    backend = settings.session_store.lower()
+    if backend == "memory":
+        return InProcessSessionStore()
+    if backend == "sqlite":
+        return SQLiteSessionStore()
+    if backend == "redis":
+        return RespSessionStore()
+    raise ValueError(f"Unknown session store: {settings.session_store}")
+
+
+# Global session store instance
+session_store = create_session_store()
@@ -0,0 +1,183 @@
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+from typing import Any, Dict, List, Set, Tuple
+
+import numpy as np
+
+from config import settings
+from app.chatbot import chatbot
+from app.database import DEFAULT_TENANT, DatabaseManager, SessionLocal
+from app.metrics import stage_seconds, stage_timer
+from app.tenants import TenantRegistry
+
+# Prefix ranges up to this many entries are scanned; wider ones use cached results
+SCAN_LIMIT = 256
+
+# Cached results of wide prefixes kept per index before the cache starts over
+MAX_CACHED_PREFIXES = 4096
+
+# Longer messages are unlikely to be reusable questions
+MAX_QUESTION_CHARS = 120
+
+
+def normalize(text: str) -> str:
+    """Lowercase with runs of whitespace collapsed, as suggestions are matched."""
+    return " ".join(text.lower().split())
+
+
+class SuggestionIndex:
+    """Prefix index over suggestion texts for typeahead.
+
+    Every suffix of a normalized text that starts at a word is stored in one
+    sorted list, so typing the start of any word of a title matches it. A
+    prefix is a contiguous range of that list, found by binary search; each
+    entry carries the rank of its suggestion, and the best ranks in the range
+    are the answer. Narrow ranges are scanned, and the best results of wide
+    ones (short prefixes such as "h" or "how to") are cached, so lookups stay
+    well under a millisecond whatever the number of suggestions.
+    """
+
+    def __init__(self, suggestions: List[Dict[str, Any]], max_results: int):
+        self.suggestions = suggestions  # In rank order, best first
+        self.max_results = max_results
+        entries = []
+        for rank, suggestion in enumerate(suggestions):
+            key = normalize(suggestion["text"])
+            entries.append((key, rank))
+            entries.extend((key[position + 1:], rank) for position, char in enumerate(key) if char == " ")
+        entries.sort()
+        self.keys = [key for key, _ in entries]
+        self.ranks = np.fromiter((rank for _, rank in entries), dtype=np.int32, count=len(entries))
+        self._cached: Dict[str, List[int]] = {}
+
+    def lookup(self, prefix: str, k: int) -> List[Dict[str, Any]]:
+        """The best `k` suggestions with a word starting with `prefix`."""
+        key = normalize(prefix)
+        if not key:
+            return []
+        if prefix[-1:].isspace():
+            key += " "  # "how to " should not match "how tough"
+        low = bisect_left(self.keys, key)
+        high = bisect_left(self.keys, key + "\U0010ffff", low)
+        if high - low <= SCAN_LIMIT:
+            ranks = sorted(set(self.ranks[low:high].tolist()))
+        else:
+            ranks = self._cached.get(key)
+            if ranks is None:
+                ranks = self._best(low, high)
+                if len(self._cached) >= MAX_CACHED_PREFIXES:
+                    self._cached.clear()
+                self._cached[key] = ranks
+        return [self.suggestions[rank] for rank in ranks[:k]]
+
+    def _best(self, low: int, high: int) -> List[int]:
+        ranks = self.ranks[low:high]
+        # A suggestion matches once per word starting with the prefix, so take
+        # some extra ranks before dropping repeats
+        take = min(len(ranks), self.max_results * 4)
+        best = np.unique(np.partition(ranks, take - 1)[:take])
+        if len(best) < self.max_results and take < len(ranks):
+            best = np.unique(ranks)
+        return best[:self.max_results].tolist()
+
+
+class SuggestionService:
+    """Typeahead suggestions per tenant, from its article titles and the questions customers ask most.
+
+    Questions asked in at least `suggest_min_question_count` conversations
+    come first, most asked first, then article titles, shortest first; a
+    single customer's messages are never suggested to others. Conversations
+    do not record a tenant, so questions are only suggested for the default
+    tenant and other tenants get their titles alone. Indexes are rebuilt in
+    the background once older than `suggest_refresh_seconds`, while the
+    previous one keeps answering.
+    """
+
+    def __init__(self, tenants: TenantRegistry):
+        self.tenants = tenants
+        self._indexes: "OrderedDict[str, Tuple[SuggestionIndex, float]]" = OrderedDict()
+        self._refreshing: Set[str] = set()
+        self._lock = threading.Lock()
+        # Frequent questions with the time they were read, shared by rebuilds until stale
+        self._top_questions: Tuple[List[Tuple[str, int]], float] = ([], float("-inf"))
+        self._questions_lock = threading.Lock()
+
+    def has_index(self, tenant_id: str) -> bool:
+        return tenant_id in self._indexes
+
+    def suggest(self, prefix: str, k: int, tenant_id: str) -> List[Dict[str, Any]]:
+        """Suggestions for what the customer has typed so far; builds the tenant's index if needed."""
+        with stage_timer("suggest"):
+            return self._index(tenant_id).lookup(prefix, max(0, min(k, settings.suggest_max_results)))
+
+    def build(self, tenant_id: str) -> SuggestionIndex:
+        """Build the tenant's index from its knowledge base and the stored questions."""
+        start = time.perf_counter()
+        suggestions = []
+        seen = set()
+        for question, count in (self._questions() if tenant_id == DEFAULT_TENANT else []):
+            key = normalize(question)
+            if key not in seen and len(key) <= MAX_QUESTION_CHARS and count >= settings.suggest_min_question_count:
+                seen.add(key)
+                suggestions.append({"text": question.strip(), "type": "question"})
+        articles = sorted(
+            self.tenants.get(tenant_id).get_all_documents(),
+            key=lambda item: (len(item["title"]), item["title"])
+        )
+        for item in articles:
+            key = normalize(item["title"])
+            if key and key not in seen:
+                seen.add(key)
+                suggestions.append({"text": item["title"], "type": "article", "category": item["category"]})
+
+        index = SuggestionIndex(suggestions, settings.suggest_max_results)
+        with self._lock:
+            self._indexes[tenant_id] = (index, time.monotonic())
+            self._indexes.move_to_end(tenant_id)
+            # Kept for about as many tenants as there are indexes in memory
+            while settings.tenant_max_loaded and len(self._indexes) > settings.tenant_max_loaded + 1:
+                self._indexes.popitem(last=False)
+        stage_seconds.observe(time.perf_counter() - start, stage="suggest_build")
+        return index
+
+    def _index(self, tenant_id: str) -> SuggestionIndex:
+        with self._lock:
+            entry = self._indexes.get(tenant_id)
+            if entry is not None:
+                self._indexes.move_to_end(tenant_id)
+                if time.monotonic() - entry[1] > settings.suggest_refresh_seconds and tenant_id not in self._refreshing:
+                    self._refreshing.add(tenant_id)
+                    threading.Thread(target=self._refresh, args=(tenant_id,), daemon=True).start()
+        return entry[0] if entry is not None else self.build(tenant_id)
+
+    def _refresh(self, tenant_id: str):
+        try:
+            self.build(tenant_id)
+        except Exception as e:
+            print(f"Could not refresh suggestions for tenant {tenant_id}: {e}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(tenant_id)
+
+    def _questions(self) -> List[Tuple[str, int]]:
+        if not settings.suggest_top_questions:
+            return []
+        # The query groups the whole messages table, so it runs at most once per refresh period
+        with self._questions_lock:
+            questions, read_at = self._top_questions
+            if time.monotonic() - read_at > settings.suggest_refresh_seconds:
+                db = SessionLocal()
+                try:
+                    questions = DatabaseManager(db).get_top_questions(
+                        settings.suggest_top_questions, by_conversation=True
+                    )
+                finally:
+                    db.close()
+                self._top_questions = (questions, time.monotonic())
+            return questions
+
+
+# Global suggestion service instance, over the chatbot's tenant indexes
+suggestion_service = SuggestionService(chatbot.tenants)
@@ -0,0 +1,103 @@
+import queue
+import threading
+from typing import List, Optional, Set
+
+from langchain.chains import LLMChain
+from langchain.memory.prompt import SUMMARY_PROMPT
+from langchain_core.language_models.chat_models import BaseChatModel
+
+from config import settings
+from app.database import DatabaseManager, Message, SessionLocal
+from app.metrics import metrics, stage_timer
+from app.resilience import LLMUnavailable
+
+# Most messages folded into the summary by one LLM call; a conversation that
+# fell further behind is caught up over several calls
+SUMMARY_CHUNK_MESSAGES = 40
+
+summarizations = metrics.counter(
+    "chatbot_summarizations_total",
+    "Background conversation summarizations, by outcome",
+    ["outcome"]
+)
+
+
+def format_lines(messages: List[Message]) -> str:
+    """Render messages as conversation lines for the summary prompt."""
+    return "\n".join(
+        f"{'Human' if message.role == 'user' else 'AI'}: {message.content}"
+        for message in messages
+    )
+
+
+class ConversationSummarizer:
+    """Folds turns that left the memory window into each conversation's running summary.
+
+    Chat requests only schedule a conversation; a background thread does the
+    LLM calls with its own database session, so summarizing never adds to a
+    request's latency. A conversation is queued at most once at a time.
+    """
+
+    def __init__(self, llm: BaseChatModel):
+        self.chain = LLMChain(llm=llm, prompt=SUMMARY_PROMPT)
+        self._queue: queue.Queue = queue.Queue()
+        self._pending: Set[str] = set()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def schedule(self, conversation_id: str):
+        with self._lock:
+            if conversation_id in self._pending:
+                return
+            self._pending.add(conversation_id)
+            # Started on first use, so forked workers each run their own thread
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="conversation-summarizer", daemon=True)
+                self._thread.start()
+        self._queue.put(conversation_id)
+
+    def _run(self):
+        while True:
+            conversation_id = self._queue.get()
+            with self._lock:
+                self._pending.discard(conversation_id)
+            db = SessionLocal()
+            try:
+                self.summarize(conversation_id, DatabaseManager(db))
+            except Exception as e:
+                print(f"Error summarizing conversation {conversation_id}: {e}")
+                summarizations.inc(outcome="error")
+            finally:
+                db.close()
+
+    def summarize(self, conversation_id: str, db_manager: DatabaseManager) -> int:
+        """Fold the messages older than the memory window into the summary.
+
+        Nothing happens until at least `memory_summary_batch_turns` exchanges
+        have left the window, so the summary is not rewritten on every turn.
+        Returns the number of messages folded in.
+        """
+        row = db_manager.get_conversation_summary(conversation_id)
+        summary = row.summary if row else ""
+        messages = db_manager.get_messages_since(conversation_id, row.summarized_until if row else None)
+        keep = settings.memory_window_turns * 2
+        older = messages[:-keep] if keep else messages
+        if len(older) < settings.memory_summary_batch_turns * 2:
+            return 0
+
+        folded = 0
+        for start in range(0, len(older), SUMMARY_CHUNK_MESSAGES):
+            chunk = older[start:start + SUMMARY_CHUNK_MESSAGES]
+            try:
+                with stage_timer("summarize"):
+                    summary = self.chain.predict(summary=summary, new_lines=format_lines(chunk)).strip()
+            except LLMUnavailable as e:
+                # The next turn of this conversation schedules it again
+                print(f"Summarizing conversation {conversation_id} postponed: {e}")
+                summarizations.inc(outcome="postponed")
+                break
+            if not db_manager.save_conversation_summary(conversation_id, summary, chunk[-1].timestamp):
+                break  # Memory was cleared or a newer summary was stored meanwhile
+            folded += len(chunk)
+            summarizations.inc(outcome="ok")
+        return folded
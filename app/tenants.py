@@ -0,0 +1,165 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from config import settings
+from app.database import DEFAULT_TENANT, DatabaseManager, SessionLocal
+from app.knowledge_base import KnowledgeBaseManager
+from app.metrics import metrics, stage_seconds
+
+# Tenant ids name snapshot files, so they are kept to a safe alphabet
+TENANT_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+tenant_index_loads = metrics.counter(
+    "chatbot_tenant_index_loads_total",
+    "Tenant knowledge base indexes loaded into memory, by source (snapshot or database)",
+    ["source"]
+)
+tenant_index_unloads = metrics.counter(
+    "chatbot_tenant_index_unloads_total",
+    "Tenant knowledge base indexes unloaded to make room, by reason (count or memory)",
+    ["reason"]
+)
+
+
+class InvalidTenant(ValueError):
+    """A tenant id outside the allowed alphabet or length."""
+
+
+def validate_tenant(tenant_id: Optional[str]) -> str:
+    """The tenant a request belongs to; requests without one use the default tenant."""
+    if not tenant_id:
+        return DEFAULT_TENANT
+    if not TENANT_ID_PATTERN.match(tenant_id):
+        raise InvalidTenant("Tenant ids are 1 to 64 letters, digits, '-' or '_'")
+    return tenant_id
+
+
+class TenantRegistry:
+    """Knowledge base indexes per tenant, loaded on demand within a memory budget.
+
+    The default tenant is the built-in knowledge base and always stays
+    loaded. Other tenants start with an empty index holding only their own
+    stored items. When more than `tenant_max_loaded` tenant indexes are in
+    memory, or their estimated size exceeds `tenant_memory_budget_mb`, the
+    least recently used ones are written to snapshots under
+    `tenant_snapshot_path` and dropped. Loading a tenant again restores the
+    snapshot and applies only the changes stored since, so one process can
+    serve many tenants while holding just the active ones.
+    """
+
+    def __init__(self, default: KnowledgeBaseManager):
+        self.default = default
+        self._loaded: "OrderedDict[str, KnowledgeBaseManager]" = OrderedDict()
+        self._loading: Dict[str, threading.Lock] = {}
+        self._snapshot_versions: Dict[str, int] = {}  # Version each loaded index was restored at
+        self._lock = threading.Lock()
+
+    def get(self, tenant_id: str) -> KnowledgeBaseManager:
+        """The tenant's knowledge base, loading it if it is not in memory."""
+        if tenant_id == DEFAULT_TENANT:
+            return self.default
+        manager = self._touch(tenant_id)
+        if manager is not None:
+            return manager
+
+        with self._lock:
+            loading = self._loading.setdefault(tenant_id, threading.Lock())
+        with loading:
+            # Another request may have loaded it while this one waited
+            manager = self._touch(tenant_id)
+            if manager is not None:
+                return manager
+            manager, source = self._load(tenant_id)
+            with self._lock:
+                self._loaded[tenant_id] = manager
+                self._loading.pop(tenant_id, None)
+                evicted = self._evict(keep=tenant_id)
+        tenant_index_loads.inc(source=source)
+
+        # Changes stored while loading were skipped by the sync loop, which
+        # only feeds loaded tenants; apply_changes ignores those already in
+        self._catch_up(tenant_id, manager)
+        for evicted_tenant, evicted_manager, reason in evicted:
+            self._unload(evicted_tenant, evicted_manager, reason)
+        return manager
+
+    def loaded(self, tenant_id: str) -> Optional[KnowledgeBaseManager]:
+        """The tenant's knowledge base if it is in memory, without loading it."""
+        if tenant_id == DEFAULT_TENANT:
+            return self.default
+        with self._lock:
+            return self._loaded.get(tenant_id)
+
+    def loaded_count(self) -> int:
+        return len(self._loaded)
+
+    def memory_bytes(self) -> int:
+        """Estimated memory of the loaded tenant indexes, the default tenant's excluded."""
+        with self._lock:
+            managers = list(self._loaded.values())
+        return sum(manager.memory_bytes() for manager in managers)
+
+    def snapshot_path(self, tenant_id: str) -> str:
+        return os.path.join(settings.tenant_snapshot_path, f"{tenant_id}.pickle")
+
+    def _touch(self, tenant_id: str) -> Optional[KnowledgeBaseManager]:
+        with self._lock:
+            manager = self._loaded.get(tenant_id)
+            if manager is not None:
+                self._loaded.move_to_end(tenant_id)
+            return manager
+
+    def _load(self, tenant_id: str) -> Tuple[KnowledgeBaseManager, str]:
+        start = time.perf_counter()
+        manager = KnowledgeBaseManager(sample_data=False)
+        source = "snapshot" if manager.load_snapshot(self.snapshot_path(tenant_id)) else "database"
+        self._snapshot_versions[tenant_id] = manager.version
+        self._catch_up(tenant_id, manager)
+        stage_seconds.observe(time.perf_counter() - start, stage="tenant_load")
+        return manager, source
+
+    def _catch_up(self, tenant_id: str, manager: KnowledgeBaseManager):
+        """Apply the tenant's changes stored after the index's version."""
+        db = SessionLocal()
+        try:
+            db_manager = DatabaseManager(db)
+            while True:
+                rows = db_manager.get_knowledge_changes(
+                    manager.version, settings.knowledge_sync_batch_size, tenant_id=tenant_id
+                )
+                manager.apply_changes(rows)
+                if len(rows) < settings.knowledge_sync_batch_size:
+                    return
+        finally:
+            db.close()
+
+    def _evict(self, keep: str) -> List[Tuple[str, KnowledgeBaseManager, str]]:
+        """Pick least recently used tenants to unload until the limits hold; call with the lock held."""
+        budget = settings.tenant_memory_budget_mb * 1024 * 1024
+        total = sum(manager.memory_bytes() for manager in self._loaded.values())
+        evicted = []
+        for tenant_id in list(self._loaded):
+            over_count = settings.tenant_max_loaded and len(self._loaded) > settings.tenant_max_loaded
+            over_memory = budget and total > budget
+            if not (over_count or over_memory):
+                break
+            if tenant_id == keep:
+                continue  # The tenant just requested stays, even if it alone is over budget
+            manager = self._loaded.pop(tenant_id)
+            total -= manager.memory_bytes()
+            evicted.append((tenant_id, manager, "count" if over_count else "memory"))
+        return evicted
+
+    def _unload(self, tenant_id: str, manager: KnowledgeBaseManager, reason: str):
+        # Requests already holding the manager finish with it; the snapshot
+        # is only rewritten when the index changed since it was restored
+        if manager.version > self._snapshot_versions.pop(tenant_id, 0):
+            try:
+                manager.save_snapshot(self.snapshot_path(tenant_id))
+            except OSError as e:
+                print(f"Could not write knowledge base snapshot for tenant {tenant_id}: {e}")
+        tenant_index_unloads.inc(reason=reason)
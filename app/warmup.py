@@ -0,0 +1,172 @@
+import asyncio
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import text
+
+from config import settings
+from app.chatbot import chatbot
+from app.database import DEFAULT_TENANT, DatabaseManager, SessionLocal, engine, init_db
+from app.knowledge_sync import knowledge_sync, knowledge_sync_loop
+from app.metrics import metrics
+from app.retention import retention_manager, retention_loop
+from app.suggest import suggestion_service
+
+
+class WarmupState:
+    """Tracks application start-up for the readiness probe.
+
+    Status goes from "starting" to "warming" to "ready", or to "failed" if a
+    warm-up step raised. Each step records how long it took.
+    """
+
+    def __init__(self):
+        self.status = "starting"
+        self.steps: Dict[str, Dict[str, Any]] = {}
+        self.error: Optional[str] = None
+        self.started_at: Optional[datetime] = None
+        self.ready_at: Optional[datetime] = None
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self.status == "ready"
+
+    def record(self, step: str, seconds: float, **details: Any):
+        with self._lock:
+            self.steps[step] = {"seconds": round(seconds, 4), **details}
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "status": self.status,
+                "steps": dict(self.steps),
+                "error": self.error,
+                "started_at": self.started_at,
+                "ready_at": self.ready_at
+            }
+
+
+def _warm_knowledge(state: WarmupState):
+    start = time.perf_counter()
+    # Load the items stored since the index was built, by the pre-fork parent if there
+    # is one; the sync loop applies later ones
+    applied = knowledge_sync.poll()
+    state.record("knowledge", time.perf_counter() - start, applied=applied, version=knowledge_sync.version)
+
+
+def _warm_index(state: WarmupState):
+    start = time.perf_counter()
+    knowledge_base = chatbot.kb_manager.simple_kb
+    # The index is built when the chatbot is created; a search touches it end to end
+    chatbot.kb_manager.search("warm up", k=1)
+    state.record("index", time.perf_counter() - start, documents=len(knowledge_base.knowledge_items))
+
+
+def _warm_database(state: WarmupState):
+    start = time.perf_counter()
+    count = settings.warmup_db_connections
+    if hasattr(engine.pool, "size"):
+        count = min(count, engine.pool.size())
+
+    # Hold the connections at the same time so the pool really opens that many
+    connections = []
+    try:
+        for _ in range(count):
+            connection = engine.connect()
+            connections.append(connection)
+            connection.execute(text("SELECT 1"))
+    finally:
+        for connection in connections:
+            connection.close()
+    state.record("database", time.perf_counter() - start, connections=len(connections))
+
+
+def _top_queries() -> List[str]:
+    queries = list(settings.warmup_queries)
+    if settings.warmup_top_queries:
+        db = SessionLocal()
+        try:
+            queries.extend(question for question, _ in DatabaseManager(db).get_top_questions(settings.warmup_top_queries))
+        finally:
+            db.close()
+    return list(dict.fromkeys(query for query in queries if query))
+
+
+def _warm_queries(state: WarmupState):
+    start = time.perf_counter()
+    replayed = chatbot.prime_retrieval(_top_queries())
+    state.record("queries", time.perf_counter() - start, replayed=replayed)
+
+
+def _warm_suggestions(state: WarmupState):
+    start = time.perf_counter()
+    # A pre-fork parent has already built it, and workers share that copy
+    if suggestion_service.has_index(DEFAULT_TENANT):
+        state.record("suggestions", time.perf_counter() - start, preloaded=True)
+        return
+    index = suggestion_service.build(DEFAULT_TENANT)
+    state.record("suggestions", time.perf_counter() - start, suggestions=len(index.suggestions))
+
+
+def warm_up(state: Optional[WarmupState] = None):
+    """Load stored knowledge, prime the index, the database pool, retrieval and suggestions, then mark the app ready."""
+    state = state or warmup_state
+    state.status = "warming"
+    state.started_at = datetime.utcnow()
+    try:
+        _warm_knowledge(state)
+        _warm_index(state)
+        _warm_database(state)
+        _warm_queries(state)
+        _warm_suggestions(state)
+    except Exception as e:
+        print(f"Warm-up failed: {e}")
+        state.error = str(e)
+        state.status = "failed"
+        return
+
+    state.ready_at = datetime.utcnow()
+    state.status = "ready"
+    total = sum(step["seconds"] for step in state.steps.values())
+    print(f"Warm-up finished in {total:.2f}s, ready for traffic")
+
+
+_started = False
+
+
+async def start_application():
+    """Initialize the database, start background jobs and warm up.
+
+    Runs from the startup event of whichever app is served; the API app is
+    also mounted under main.app, where its own startup events do not fire.
+    Warm-up runs in the background so liveness answers while it is going on.
+    """
+    global _started
+    if _started:
+        return
+    _started = True
+
+    print("Initializing application...")
+    init_db()
+    asyncio.create_task(knowledge_sync_loop(knowledge_sync))
+    if settings.retention_enabled:
+        asyncio.create_task(retention_loop(retention_manager))
+
+    if settings.warmup_enabled:
+        asyncio.create_task(run_in_threadpool(warm_up))
+    else:
+        warmup_state.status = "ready"
+        warmup_state.ready_at = datetime.utcnow()
+    print("Application initialized successfully!")
+
+
+# Global warm-up state instance
+warmup_state = WarmupState()
+
+metrics.register_collector(lambda: [
+    ("app_ready", "Whether warm-up has finished and the app takes traffic", 1 if warmup_state.ready else 0)
+])
@@ -0,0 +1,262 @@
+import asyncio
+import gc
+import os
+import random
+import signal
+import socket
+import sys
+import time
+import traceback
+from typing import Any, Dict, List, Optional
+
+import uvicorn
+
+from config import settings
+from app.database import DEFAULT_TENANT, engine, init_db
+from app.embeddings import reconnect_shared_cache
+from app.knowledge_sync import knowledge_sync
+from app.metrics import metrics
+from app.session_state import InProcessSessionStore, session_store
+from app.suggest import suggestion_service
+
+# Seconds between memory checks of the workers
+MEMORY_CHECK_INTERVAL = 5
+
+
+def read_memory(pid: int) -> Dict[str, int]:
+    """Resident, proportional and shared memory of a process in bytes (Linux).
+
+    PSS splits shared pages between the processes mapping them, so the sum of
+    the workers' PSS is what the pool really costs; RSS counts shared pages
+    in every worker.
+    """
+    fields = {"Rss": "rss", "Pss": "pss", "Shared_Clean": "shared", "Shared_Dirty": "shared"}
+    memory = {"rss": 0, "pss": 0, "shared": 0}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as rollup:
+            for line in rollup:
+                key, _, value = line.partition(":")
+                if key in fields:
+                    memory[fields[key]] += int(value.split()[0]) * 1024
+    except (OSError, ValueError):
+        pass
+    return memory
+
+
+class WorkerManager:
+    """Pre-fork process manager for the API.
+
+    The parent imports the app, which builds the knowledge base index and the
+    chatbot once, initializes the database, indexes the stored articles from
+    the change feed and binds the listening socket.
+    Workers are forked from it and share those pages copy-on-write instead of
+    each rebuilding the index. The parent replaces workers that exit, recycles
+    them gracefully after a request budget or above a memory limit, restarts
+    them all one at a time on SIGHUP and stops them on SIGTERM or SIGINT.
+    """
+
+    def __init__(self, app: Any, host: Optional[str] = None, port: Optional[int] = None,
+                 workers: Optional[int] = None):
+        self.app = app
+        self.host = host or settings.host
+        self.port = port or settings.port
+        self.worker_count = workers or settings.workers or os.cpu_count() or 1
+        self.workers: Dict[int, Dict[str, Any]] = {}  # pid -> slot and start time
+        self.retiring: Dict[int, float] = {}  # pid -> deadline before it is killed
+        self.restart_queue: List[int] = []
+        self.socket: Optional[socket.socket] = None
+        self.stopping = False
+        self.next_stats = 0.0
+        self.next_memory_check = 0.0
+
+    def preload(self):
+        """Build the shared state before any worker is forked."""
+        init_db()
+        # Index the stored articles here, so workers start at this feed version
+        # and only apply the changes made after it to their copy
+        applied = knowledge_sync.poll()
+        suggestion_service.build(DEFAULT_TENANT)
+        print(f"Preloaded {applied} knowledge base changes (version {knowledge_sync.version})")
+        # Keep the preloaded objects out of the garbage collector's generations,
+        # so collections in the workers do not touch (and copy) their pages
+        gc.collect()
+        gc.freeze()
+
+    def spawn(self, slot: int):
+        # Unflushed output would otherwise be written again by the worker
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            exit_code = 0
+            try:
+                self._run_worker(slot)
+            except BaseException:
+                traceback.print_exc()
+                exit_code = 1
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(exit_code)
+
+        self.workers[pid] = {"slot": slot, "started": time.monotonic()}
+        print(f"Started worker {slot} (pid {pid})")
+
+    def _run_worker(self, slot: int):
+        for handled in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            signal.signal(handled, signal.SIG_DFL)
+
+        # Background jobs only need to run in one worker
+        if slot != 0:
+            settings.retention_enabled = False
+
+        # Connections must not be shared with the parent or other workers
+        engine.dispose(close=False)
+        reconnect_shared_cache()
+        session_store.reconnect()
+
+        pid = os.getpid()
+        metrics.register_collector(lambda: [
+            ("process_resident_memory_bytes", "Resident memory of this worker", read_memory(pid)["rss"])
+        ])
+
+        max_requests = settings.worker_max_requests
+        if max_requests and settings.worker_max_requests_jitter:
+            # Spread recycling so workers do not all restart at once
+            max_requests += random.randint(0, settings.worker_max_requests_jitter)
+
+        config = uvicorn.Config(
+            self.app,
+            host=self.host,
+            port=self.port,
+            limit_max_requests=max_requests or None,
+            timeout_graceful_shutdown=settings.worker_graceful_timeout,
+            log_level="info"
+        )
+        server = uvicorn.Server(config)
+        asyncio.run(server.serve(sockets=[self.socket]))
+
+    def retire(self, pid: int, replace: bool = True):
+        """Gracefully stop a worker, starting its replacement first."""
+        if pid in self.retiring or pid not in self.workers:
+            return
+        if replace:
+            self.spawn(self.workers[pid]["slot"])
+        self.retiring[pid] = time.monotonic() + settings.worker_graceful_timeout
+        os.kill(pid, signal.SIGTERM)
+
+    def _reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+
+            worker = self.workers.pop(pid, None)
+            if self.retiring.pop(pid, None) is not None or worker is None or self.stopping:
+                continue
+
+            # Exits not requested by the parent: request budget reached or a crash
+            code = os.waitstatus_to_exitcode(status)
+            print(f"Worker {worker['slot']} (pid {pid}) exited with code {code}, replacing it")
+            if time.monotonic() - worker["started"] < 1:
+                time.sleep(1)  # Avoid a tight loop when workers crash on startup
+            self.spawn(worker["slot"])
+
+    def _enforce_deadlines(self):
+        now = time.monotonic()
+        for pid, deadline in list(self.retiring.items()):
+            if now > deadline:
+                print(f"Worker pid {pid} did not stop in time, killing it")
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                self.retiring[pid] = float("inf")
+
+    def _rolling_restart(self):
+        # Replace one worker at a time so capacity never drops
+        if self.restart_queue and not self.retiring:
+            pid = self.restart_queue.pop(0)
+            if pid in self.workers:
+                self.retire(pid)
+
+    def _check_memory(self):
+        now = time.monotonic()
+        if now < self.next_memory_check:
+            return
+        self.next_memory_check = now + MEMORY_CHECK_INTERVAL
+
+        report = now >= self.next_stats
+        if report:
+            self.next_stats = now + settings.worker_stats_interval
+            print(f"{'worker':>6}{'pid':>8}{'rss (MB)':>10}{'pss (MB)':>10}{'shared (MB)':>13}{'uptime (s)':>12}")
+
+        for pid, worker in sorted(self.workers.items(), key=lambda item: item[1]["slot"]):
+            if pid in self.retiring:
+                continue
+            memory = read_memory(pid)
+            if report:
+                print(f"{worker['slot']:>6}{pid:>8}{memory['rss'] / 2 ** 20:>10.1f}{memory['pss'] / 2 ** 20:>10.1f}"
+                      f"{memory['shared'] / 2 ** 20:>13.1f}{now - worker['started']:>12.0f}")
+            if settings.worker_max_rss_mb and memory["rss"] > settings.worker_max_rss_mb * 2 ** 20:
+                print(f"Worker {worker['slot']} (pid {pid}) is above {settings.worker_max_rss_mb} MB, recycling it")
+                self.retire(pid)
+
+    def _handle_stop(self, signum, frame):
+        self.stopping = True
+
+    def _handle_restart(self, signum, frame):
+        self.restart_queue = [pid for pid in self.workers if pid not in self.retiring]
+
+    def stop(self):
+        for pid in list(self.workers):
+            if pid not in self.retiring:
+                self.retire(pid, replace=False)
+        while self.workers:
+            self._enforce_deadlines()
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid:
+                self.workers.pop(pid, None)
+                self.retiring.pop(pid, None)
+            else:
+                time.sleep(0.1)
+
+    def run(self):
+        if not hasattr(os, "fork"):
+            raise RuntimeError("The multi-worker launcher needs os.fork; use main.py on this platform")
+
+        # The parent's status lines should show up promptly in redirected logs
+        sys.stdout.reconfigure(line_buffering=True)
+        self.preload()
+        self.socket = uvicorn.Config(self.app, host=self.host, port=self.port).bind_socket()
+        self.socket.set_inheritable(True)
+
+        signal.signal(signal.SIGTERM, self._handle_stop)
+        signal.signal(signal.SIGINT, self._handle_stop)
+        signal.signal(signal.SIGHUP, self._handle_restart)
+
+        if self.worker_count > 1 and isinstance(session_store, InProcessSessionStore):
+            print("Warning: SESSION_STORE=memory keeps chat history per worker; "
+                  "use sqlite or redis so every worker sees it")
+        print(f"Starting {self.worker_count} workers on http://{self.host}:{self.port} (pid {os.getpid()})")
+        for slot in range(self.worker_count):
+            self.spawn(slot)
+        self.next_stats = time.monotonic() + min(10, settings.worker_stats_interval)
+
+        try:
+            while not self.stopping:
+                self._reap()
+                self._enforce_deadlines()
+                self._rolling_restart()
+                self._check_memory()
+                time.sleep(0.5)
+        finally:
+            print("Stopping workers...")
+            self.stop()
+            self.socket.close()
@@ -0,0 +1,81 @@
+"""
+Seeded synthetic support-article and query generator for benchmarks.
+
+The same seed always produces the same corpus, so results can be compared
+between commits.
+"""
+
+import random
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+CATEGORIES = {
+    "account": ["password", "login", "email", "profile", "username", "verification", "locked", "settings"],
+    "security": ["two-factor", "encryption", "fraud", "phishing", "unauthorized", "device", "session", "alert"],
+    "returns": ["return", "refund", "exchange", "label", "damaged", "defective", "policy", "warranty"],
+    "shipping": ["delivery", "tracking", "courier", "express", "international", "customs", "delay", "address"],
+    "payment": ["card", "paypal", "invoice", "declined", "charge", "billing", "wallet", "installment"],
+    "orders": ["order", "cancel", "modify", "confirmation", "history", "status", "backorder", "bundle"],
+    "products": ["size", "color", "stock", "availability", "specification", "compatibility", "manual", "assembly"],
+    "subscriptions": ["renewal", "plan", "upgrade", "downgrade", "trial", "membership", "pause", "benefits"],
+    "promotions": ["coupon", "discount", "voucher", "sale", "loyalty", "points", "referral", "code"],
+    "technical": ["app", "browser", "error", "crash", "update", "cache", "cookies", "notification"],
+    "privacy": ["data", "consent", "deletion", "export", "gdpr", "tracking", "marketing", "preferences"],
+    "gift-cards": ["balance", "redeem", "expiry", "gift", "transfer", "lost", "activation", "purchase"],
+}
+
+COMMON_WORDS = [
+    "customer", "support", "account", "please", "contact", "team", "within", "business", "days", "steps",
+    "follow", "click", "page", "select", "option", "receive", "email", "check", "information", "help",
+    "available", "required", "update", "details", "process", "request", "service", "online", "store", "time",
+]
+
+TITLE_TEMPLATES = [
+    "How to {verb} your {topic}",
+    "{Topic} {noun}",
+    "Troubleshooting {topic} {noun}",
+    "Understanding {topic} and {other}",
+    "FAQ: {topic} {noun}",
+]
+
+VERBS = ["manage", "change", "reset", "update", "check", "fix", "request", "set up"]
+NOUNS = ["policy", "guide", "issues", "options", "overview", "questions", "requirements", "limits"]
+
+
+def _article(rng: random.Random, index: int) -> Dict[str, Any]:
+    category = rng.choice(list(CATEGORIES))
+    topics = CATEGORIES[category]
+    topic, other = rng.sample(topics, 2)
+
+    title = rng.choice(TITLE_TEMPLATES).format(
+        verb=rng.choice(VERBS), topic=topic, Topic=topic.capitalize(), noun=rng.choice(NOUNS), other=other
+    )
+
+    words = []
+    for _ in range(rng.randint(80, 200)):
+        # Bias article text towards its own category vocabulary
+        pool = topics if rng.random() < 0.35 else COMMON_WORDS
+        words.append(rng.choice(pool))
+    content = f"Article {index}. " + " ".join(words)
+
+    tags = rng.sample(topics, rng.randint(2, 4))
+    return {"title": title, "content": content, "category": category, "tags": tags}
+
+
+def generate_articles(count: int, seed: int = 42) -> Iterator[Dict[str, Any]]:
+    """Generate `count` synthetic support articles."""
+    rng = random.Random(seed)
+    for index in range(count):
+        yield _article(rng, index)
+
+
+def generate_queries(count: int, seed: int = 7, filtered_fraction: float = 0.3) -> List[Tuple[str, Optional[str]]]:
+    """Generate (query, category) pairs; a fraction of them are category-filtered."""
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        category = rng.choice(list(CATEGORIES))
+        words = rng.sample(CATEGORIES[category], rng.randint(1, 3))
+        if rng.random() < 0.5:
+            words.append(rng.choice(COMMON_WORDS))
+        queries.append((" ".join(words), category if rng.random() < filtered_fraction else None))
+    return queries
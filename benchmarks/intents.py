@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Intent matcher benchmark.
+
+Times how long matching one message takes as the intent catalogue grows.
+Catalogues are synthetic: each intent gets a few single-word and two-word
+keywords drawn from a shared vocabulary, so larger catalogues also mean more
+intents sharing each word. Compiling the catalogue is timed separately.
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from typing import Any, Dict, List
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.intents import Intent, IntentMatcher
+
+DEFAULT_SIZES = [10, 100, 1000, 10000]
+
+
+def generate_intents(count: int, vocabulary: List[str], seed: int) -> List[Intent]:
+    rng = random.Random(seed)
+    intents = []
+    for number in range(count):
+        keywords = {word: 1.0 for word in rng.sample(vocabulary, 3)}
+        keywords[" ".join(rng.sample(vocabulary, 2))] = 1.5
+        intents.append(Intent(name=f"intent_{number}", responses=["..."], keywords=keywords, min_score=1.5))
+    return intents
+
+
+def generate_messages(count: int, vocabulary: List[str], seed: int) -> List[str]:
+    rng = random.Random(seed + 1)
+    return [" ".join(rng.choices(vocabulary, k=rng.randint(5, 25))) for _ in range(count)]
+
+
+def run_size(size: int, args) -> Dict[str, Any]:
+    vocabulary = [f"word{number}" for number in range(args.vocabulary)]
+    intents = generate_intents(size, vocabulary, args.seed)
+    messages = generate_messages(args.messages, vocabulary, args.seed)
+
+    start = time.perf_counter()
+    matcher = IntentMatcher(intents)
+    compile_seconds = time.perf_counter() - start
+
+    latencies = []
+    matched = 0
+    for message in messages:
+        start = time.perf_counter()
+        result = matcher.match(message)
+        latencies.append(time.perf_counter() - start)
+        matched += result is not None
+
+    latencies.sort()
+    return {
+        "intents": size,
+        "compile_ms": compile_seconds * 1000,
+        "match_mean_us": statistics.mean(latencies) * 1e6,
+        "match_p50_us": latencies[len(latencies) // 2] * 1e6,
+        "match_p99_us": latencies[min(len(latencies) - 1, int(0.99 * len(latencies)))] * 1e6,
+        "match_rate": matched / len(messages),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark intent matching against catalogue size")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="Catalogue sizes to test")
+    parser.add_argument("--messages", type=int, default=2000, help="Messages matched per size")
+    parser.add_argument("--vocabulary", type=int, default=5000, help="Distinct keyword words")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed for intents and messages")
+    parser.add_argument("--json", dest="json_path", default=None, help="Write results to this JSON file")
+    args = parser.parse_args()
+
+    print(f"{'intents':>8}{'compile (ms)':>14}{'mean (us)':>11}{'p50 (us)':>10}{'p99 (us)':>10}{'matched':>9}")
+    results = []
+    for size in args.sizes:
+        result = run_size(size, args)
+        results.append(result)
+        print(f"{size:>8}{result['compile_ms']:>14.1f}{result['match_mean_us']:>11.1f}{result['match_p50_us']:>10.1f}"
+              f"{result['match_p99_us']:>10.1f}{result['match_rate']:>9.1%}")
+
+    if args.json_path:
+        config = {key: value for key, value in vars(args).items() if key != "json_path"}
+        with open(args.json_path, "w") as output:
+            json.dump({"config": config, "results": results}, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
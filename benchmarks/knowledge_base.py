@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Benchmark knowledge base search at increasing corpus sizes.
+
+For each size a seeded synthetic corpus is generated and, in a fresh
+subprocess so memory readings are not polluted by earlier sizes, the script
+measures:
+
+- ingest rate through KnowledgeBaseManager.add_document
+- memory footprint (RSS growth while ingesting)
+- index build time for a bulk load of the same corpus
+- query latency percentiles for KnowledgeBaseManager.search (a share of the
+  queries carry a category filter) and for MockRetriever
+
+Results can be written as JSON and compared with an earlier run.
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+DEFAULT_SIZES = "1000,10000,100000,1000000"
+
+# Throughput metrics; for every other metric compared a lower value is better
+HIGHER_IS_BETTER_SUFFIX = "per_second"
+
+
+def rss_bytes() -> int:
+    """Current resident set size of this process."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # Not Linux: fall back to the peak, which is still useful for growth
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    """Latency summary in milliseconds."""
+    ordered = sorted(samples)
+
+    def at(fraction: float) -> float:
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000
+
+    return {
+        "count": len(ordered),
+        "mean_ms": sum(ordered) / len(ordered) * 1000,
+        "p50_ms": at(0.50),
+        "p95_ms": at(0.95),
+        "p99_ms": at(0.99),
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+def time_queries(run: Callable[[str, Optional[str]], Any], queries, budget: float, minimum: int = 5) -> List[float]:
+    """Run queries until they are exhausted or the time budget is spent."""
+    samples = []
+    deadline = time.perf_counter() + budget
+    for query, category in queries:
+        start = time.perf_counter()
+        run(query, category)
+        samples.append(time.perf_counter() - start)
+        if len(samples) >= minimum and time.perf_counter() > deadline:
+            break
+    return samples
+
+
+def bench_size(size: int, args) -> Dict[str, Any]:
+    """Measure one corpus size in the current process."""
+    from benchmarks.corpus import generate_articles, generate_queries
+    from app.knowledge_base import KnowledgeBaseManager, SimpleKnowledgeBase
+    from app.embeddings import get_embeddings
+
+    corpus = list(generate_articles(size, seed=args.seed))
+    queries = generate_queries(args.queries, seed=args.seed + 1, filtered_fraction=args.filtered_fraction)
+    gc.collect()
+
+    # Ingest one document at a time through the public API
+    rss_before = rss_bytes()
+    manager = KnowledgeBaseManager()
+    start = time.perf_counter()
+    for article in corpus:
+        manager.add_document(article["title"], article["content"], article["category"], article["tags"])
+    ingest_seconds = time.perf_counter() - start
+    gc.collect()
+    memory_bytes = rss_bytes() - rss_before
+
+    search = time_queries(
+        lambda query, category: manager.search(query, k=args.k, category=category),
+        queries, args.query_budget
+    )
+    retriever = manager.vectorstore.as_retriever(search_kwargs={"k": args.k})
+    retrieval = time_queries(
+        lambda query, category: retriever.get_relevant_documents(query),
+        queries, args.query_budget
+    )
+
+    del manager, retriever
+    gc.collect()
+
+    # Bulk load of the whole corpus in one batch, as done at startup
+    knowledge_base = SimpleKnowledgeBase(embeddings=get_embeddings())
+    items = [dict(article) for article in corpus]
+    start = time.perf_counter()
+    knowledge_base._add_items(items)
+    index_build_seconds = time.perf_counter() - start
+
+    return {
+        "size": size,
+        "ingest_seconds": ingest_seconds,
+        "ingest_docs_per_second": size / ingest_seconds if ingest_seconds else None,
+        "index_build_seconds": index_build_seconds,
+        "memory_bytes": memory_bytes,
+        "memory_bytes_per_doc": memory_bytes / size,
+        "search": percentiles(search),
+        "retriever": percentiles(retrieval),
+    }
+
+
+def run_isolated(size: int, args) -> Dict[str, Any]:
+    """Run one size in a subprocess and return its result."""
+    command = [
+        sys.executable, os.path.abspath(__file__), "--single", str(size),
+        "--seed", str(args.seed), "--queries", str(args.queries), "--k", str(args.k),
+        "--query-budget", str(args.query_budget), "--filtered-fraction", str(args.filtered_fraction),
+        "--embeddings", args.embeddings,
+    ]
+    completed = subprocess.run(command, capture_output=True, text=True, check=True)
+    # The result is the last line; anything before it is incidental output
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def flatten(result: Dict[str, Any], prefix: str = "") -> Dict[str, float]:
+    values = {}
+    for key, value in result.items():
+        if isinstance(value, dict):
+            values.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and key not in ("size", "count"):
+            values[f"{prefix}{key}"] = value
+    return values
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any]):
+    """Print the change of every metric against a baseline run."""
+    previous_by_size = {result["size"]: result for result in baseline["results"]}
+    print(f"\nCompared with {baseline['meta'].get('commit') or 'baseline'}:")
+    for key in ("seed", "queries", "k", "filtered_fraction", "embeddings"):
+        if baseline["meta"].get(key) != current["meta"].get(key):
+            print(f"warning: {key} differs ({baseline['meta'].get(key)} vs {current['meta'].get(key)})")
+    print(f"{'size':>9}  {'metric':<28}{'baseline':>14}{'current':>14}{'change':>10}")
+    for result in current["results"]:
+        previous = previous_by_size.get(result["size"])
+        if previous is None:
+            continue
+        old_values = flatten(previous)
+        for name, value in flatten(result).items():
+            old = old_values.get(name)
+            if not old or value is None:
+                continue
+            change = (value - old) / old * 100
+            better = change > 0 if name.endswith(HIGHER_IS_BETTER_SUFFIX) else change < 0
+            marker = "" if abs(change) < 5 else (" +" if better else " -")
+            print(f"{result['size']:>9}  {name:<28}{old:>14.3f}{value:>14.3f}{change:>9.1f}%{marker}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark knowledge base search at scale")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="Comma-separated corpus sizes")
+    parser.add_argument("--seed", type=int, default=42, help="Corpus generator seed")
+    parser.add_argument("--queries", type=int, default=500, help="Queries generated per size")
+    parser.add_argument("--k", type=int, default=5, help="Results per query")
+    parser.add_argument("--query-budget", type=float, default=30.0,
+                        help="Seconds spent per query phase before stopping early (at least 5 queries run)")
+    parser.add_argument("--filtered-fraction", type=float, default=0.3,
+                        help="Share of queries restricted to a category")
+    parser.add_argument("--embeddings", choices=["none", "hashing"], default="none",
+                        help="Embedding backend used while indexing")
+    parser.add_argument("--json", dest="json_path", default=None, help="Write results to this JSON file")
+    parser.add_argument("--compare", dest="baseline_path", default=None, help="Compare with an earlier JSON result")
+    parser.add_argument("--single", type=int, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # Must be set before the app modules read their settings; the embedding
+    # cache stays in memory so runs do not warm each other up through disk
+    os.environ["EMBEDDING_BACKEND"] = args.embeddings
+    os.environ["EMBEDDING_CACHE_PATH"] = ""
+
+    if args.single is not None:
+        print(json.dumps(bench_size(args.single, args)))
+        return
+
+    sizes = [int(size) for size in args.sizes.split(",") if size.strip()]
+    results = []
+    print(f"{'size':>9}{'ingest/s':>12}{'build (s)':>11}{'MB':>9}"
+          f"{'search p50':>12}{'p95':>9}{'p99':>9}{'retriever p95':>15}")
+    for size in sizes:
+        result = run_isolated(size, args)
+        results.append(result)
+        print(f"{size:>9}{result['ingest_docs_per_second']:>12.0f}{result['index_build_seconds']:>11.2f}"
+              f"{result['memory_bytes'] / 2 ** 20:>9.1f}{result['search']['p50_ms']:>12.2f}"
+              f"{result['search']['p95_ms']:>9.2f}{result['search']['p99_ms']:>9.2f}"
+              f"{result['retriever']['p95_ms']:>15.2f}")
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "created_at": datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "seed": args.seed,
+            "queries": args.queries,
+            "k": args.k,
+            "filtered_fraction": args.filtered_fraction,
+            "embeddings": args.embeddings,
+        },
+        "results": results,
+    }
+
+    if args.json_path:
+        with open(args.json_path, "w") as output:
+            json.dump(report, output, indent=2)
+
+    if args.baseline_path:
+        with open(args.baseline_path) as baseline:
+            compare(json.load(baseline), report)
+
+
+if __name__ == "__main__":
+    main()
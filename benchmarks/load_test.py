@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+Async load test for the /api/chat and /api/search endpoints.
+
+Customers arrive as a Poisson process at --rate sessions per second. Each
+session is new or, with probability --returning, resumes an earlier session,
+and sends a number of turns separated by exponential think times. Each turn
+goes to /api/search with probability --search-ratio and to /api/chat
+otherwise; questions are drawn from a Zipf distribution over a query pool so
+popular questions repeat like they do in real traffic.
+
+By default main:app runs in-process with the fake LLM backend. With --url the
+load goes to a running server over HTTP instead; start it with
+LLM_BACKEND=fake to keep the model out of the measurement.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+
+from benchmarks.corpus import generate_queries
+
+SUPPORT_QUESTIONS = [
+    "How do I reset my password?",
+    "What is your return policy?",
+    "How long does shipping take?",
+    "Which payment methods do you accept?",
+    "How can I keep my account secure?",
+    "Can I get a refund for a damaged item?",
+    "Do you ship internationally?",
+    "How do I track my order?",
+]
+
+ENDPOINTS = ("chat", "search")
+
+
+def query_pool(size: int, seed: int) -> List[str]:
+    """Questions ordered by popularity: real support questions first, then synthetic ones."""
+    synthetic = [query for query, _ in generate_queries(max(size - len(SUPPORT_QUESTIONS), 0), seed=seed)]
+    return (SUPPORT_QUESTIONS + synthetic)[:size]
+
+
+def percentile(ordered: List[float], fraction: float) -> Optional[float]:
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000
+
+
+class LoadTest:
+    """Generates sessions and records the outcome of every request."""
+
+    def __init__(self, client: httpx.AsyncClient, args):
+        self.client = client
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.queries = query_pool(args.query_pool, args.seed)
+        self.query_weights = [1 / (rank + 1) ** args.query_skew for rank in range(len(self.queries))]
+        self.finished_sessions: List[str] = []
+        self.latencies: Dict[str, List[float]] = {endpoint: [] for endpoint in ENDPOINTS}
+        self.errors: Dict[str, Dict[str, int]] = {endpoint: {} for endpoint in ENDPOINTS}
+        self.sessions = {"new": 0, "returning": 0}
+
+    def _error(self, endpoint: str, kind: str):
+        self.errors[endpoint][kind] = self.errors[endpoint].get(kind, 0) + 1
+
+    async def request(self, endpoint: str, session_id: Optional[str], question: str) -> Optional[str]:
+        start = time.perf_counter()
+        try:
+            if endpoint == "chat":
+                response = await self.client.post(
+                    "/api/chat", json={"message": question, "session_id": session_id}, timeout=self.args.timeout
+                )
+            else:
+                response = await self.client.get(
+                    "/api/search", params={"query": question, "k": 5}, timeout=self.args.timeout
+                )
+        except httpx.TimeoutException:
+            self._error(endpoint, "timeout")
+            return session_id
+        except httpx.HTTPError as e:
+            self._error(endpoint, type(e).__name__)
+            return session_id
+        elapsed = time.perf_counter() - start
+
+        if response.status_code >= 400:
+            self._error(endpoint, f"http_{response.status_code}")
+            return session_id
+        if endpoint == "chat":
+            body = response.json()
+            # Failures are answered with an apology or, while the LLM is
+            # unavailable, with a knowledge base excerpt; both are flagged
+            if not body.get("conversation_id") or body.get("degraded"):
+                self._error(endpoint, "degraded")
+                return session_id
+            session_id = body["session_id"]
+        self.latencies[endpoint].append(elapsed)
+        return session_id
+
+    async def session(self):
+        args = self.args
+        session_id = None
+        if self.finished_sessions and self.rng.random() < args.returning:
+            session_id = self.rng.choice(self.finished_sessions)
+            self.sessions["returning"] += 1
+        else:
+            self.sessions["new"] += 1
+
+        for turn in range(self.rng.randint(args.min_turns, args.max_turns)):
+            if turn and args.think_time:
+                await asyncio.sleep(self.rng.expovariate(1 / args.think_time))
+            question = self.rng.choices(self.queries, self.query_weights)[0]
+            endpoint = "search" if self.rng.random() < args.search_ratio else "chat"
+            session_id = await self.request(endpoint, session_id, question)
+
+        if session_id:
+            self.finished_sessions.append(session_id)
+
+    async def run(self) -> float:
+        """Start sessions until the duration is over, then wait for them to finish."""
+        tasks = []
+        start = time.perf_counter()
+        deadline = start + self.args.duration
+        while True:
+            await asyncio.sleep(self.rng.expovariate(self.args.rate))
+            if time.perf_counter() >= deadline:
+                break
+            tasks.append(asyncio.ensure_future(self.session()))
+
+        if tasks:
+            await asyncio.wait(tasks, timeout=self.args.drain_timeout)
+            for task in tasks:
+                task.cancel()
+        return time.perf_counter() - start
+
+    def report(self, elapsed: float) -> Dict[str, Any]:
+        endpoints = {}
+        for endpoint in ENDPOINTS:
+            ordered = sorted(self.latencies[endpoint])
+            errors = sum(self.errors[endpoint].values())
+            total = len(ordered) + errors
+            endpoints[endpoint] = {
+                "requests": total,
+                "ok": len(ordered),
+                "throughput_rps": len(ordered) / elapsed,
+                "error_rate": errors / total if total else 0.0,
+                "errors": self.errors[endpoint],
+                "p50_ms": percentile(ordered, 0.50),
+                "p95_ms": percentile(ordered, 0.95),
+                "p99_ms": percentile(ordered, 0.99),
+                "max_ms": ordered[-1] * 1000 if ordered else None,
+            }
+        return {"elapsed_seconds": elapsed, "sessions": self.sessions, "endpoints": endpoints}
+
+
+async def run_in_process(args) -> Dict[str, Any]:
+    from main import app
+    from app.api import app as api_app
+
+    # ASGITransport does not send lifespan events, and mounted apps would not
+    # get them anyway, so run the API startup by hand
+    await api_app.router.startup()
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://loadtest") as client:
+        load_test = LoadTest(client, args)
+        return load_test.report(await load_test.run())
+
+
+async def run_remote(args) -> Dict[str, Any]:
+    limits = httpx.Limits(max_connections=args.max_connections, max_keepalive_connections=args.max_connections)
+    async with httpx.AsyncClient(base_url=args.url, limits=limits) as client:
+        load_test = LoadTest(client, args)
+        return load_test.report(await load_test.run())
+
+
+def print_report(report: Dict[str, Any]):
+    sessions = report["sessions"]
+    print(f"{report['elapsed_seconds']:.1f}s, {sessions['new']} new and {sessions['returning']} returning sessions")
+    print(f"{'endpoint':<10}{'requests':>10}{'rps':>8}{'errors':>9}{'p50 (ms)':>11}{'p95 (ms)':>11}{'p99 (ms)':>11}")
+
+    def ms(value):
+        return f"{value:>11.1f}" if value is not None else f"{'-':>11}"
+
+    for endpoint, stats in report["endpoints"].items():
+        print(f"{endpoint:<10}{stats['requests']:>10}{stats['throughput_rps']:>8.1f}{stats['error_rate']:>8.1%} "
+              f"{ms(stats['p50_ms'])}{ms(stats['p95_ms'])}{ms(stats['p99_ms'])}")
+        if stats["errors"]:
+            print(f"{'':<10}errors: {stats['errors']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the chat and search endpoints")
+    parser.add_argument("--url", default=None, help="Base URL of a running server; in-process when omitted")
+    parser.add_argument("--rate", type=float, default=2.0, help="New session arrivals per second")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds during which sessions arrive")
+    parser.add_argument("--returning", type=float, default=0.3, help="Probability a session resumes an earlier one")
+    parser.add_argument("--min-turns", type=int, default=1, help="Minimum turns per session")
+    parser.add_argument("--max-turns", type=int, default=4, help="Maximum turns per session")
+    parser.add_argument("--think-time", type=float, default=2.0, help="Mean seconds between turns")
+    parser.add_argument("--search-ratio", type=float, default=0.2, help="Share of turns sent to /api/search")
+    parser.add_argument("--query-pool", type=int, default=200, help="Distinct questions")
+    parser.add_argument("--query-skew", type=float, default=1.1, help="Zipf exponent of question popularity")
+    parser.add_argument("--llm-latency-ms", type=float, default=None,
+                        help="Fake LLM latency for in-process runs (FAKE_LLM_LATENCY_MS otherwise)")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Per-request timeout in seconds")
+    parser.add_argument("--drain-timeout", type=float, default=120.0, help="Seconds to wait for sessions after arrivals stop")
+    parser.add_argument("--max-connections", type=int, default=200, help="Connection pool size for --url")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed for arrivals, sessions and questions")
+    parser.add_argument("--json", dest="json_path", default=None, help="Write results to this JSON file")
+    args = parser.parse_args()
+
+    if args.url:
+        report = asyncio.run(run_remote(args))
+    else:
+        # Configure the in-process app before its modules read the settings
+        os.environ.setdefault("LLM_BACKEND", "fake")
+        os.environ.setdefault("DEBUG", "false")
+        os.environ.setdefault("RETENTION_ENABLED", "false")
+        os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/load_test.db")
+        if args.llm_latency_ms is not None:
+            os.environ["FAKE_LLM_LATENCY_MS"] = str(args.llm_latency_ms)
+        report = asyncio.run(run_in_process(args))
+
+    report["config"] = {key: value for key, value in vars(args).items() if key != "json_path"}
+    print_report(report)
+
+    if args.json_path:
+        with open(args.json_path, "w") as output:
+            json.dump(report, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Benchmark response serialization CPU time per endpoint.
+
+Compares the previous path (build a Pydantic model per row, then let FastAPI
+validate it again through response_model and run jsonable_encoder) with the
+orjson path used by the API handlers.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime
+from types import SimpleNamespace
+from typing import List
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+from app.models import ChatResponse, ConversationHistory, KnowledgeBaseItem
+from app.serialization import (
+    conversation_history_dict, json_response, knowledge_rows_response
+)
+
+
+def cpu_time(func, repeat: int) -> float:
+    """Average CPU seconds per call."""
+    start = time.process_time()
+    for _ in range(repeat):
+        func()
+    return (time.process_time() - start) / repeat
+
+
+def make_knowledge_rows(count: int):
+    now = datetime.utcnow()
+    return [
+        (f"id-{i}", f"Article {i}", "Lorem ipsum dolor sit amet. " * 20, "shipping",
+         "shipping,delivery,tracking", now, now)
+        for i in range(count)
+    ]
+
+
+def make_conversation(count: int):
+    now = datetime.utcnow()
+    conversation = SimpleNamespace(id="conv", session_id="session", user_id=None, created_at=now, updated_at=now)
+    messages = [
+        SimpleNamespace(role="user" if i % 2 else "assistant", content="How long does shipping take? " * 5, timestamp=now)
+        for i in range(count)
+    ]
+    return conversation, messages
+
+
+def bench_knowledge(rows, repeat: int):
+    adapter = TypeAdapter(List[KnowledgeBaseItem])
+
+    def previous():
+        items = [
+            KnowledgeBaseItem(
+                id=id_, title=title, content=content, category=category,
+                tags=tags.split(",") if tags else [], created_at=created_at, updated_at=updated_at
+            )
+            for id_, title, content, category, tags, created_at, updated_at in rows
+        ]
+        validated = adapter.validate_python(items, from_attributes=True)
+        json.dumps(jsonable_encoder(validated)).encode("utf-8")
+
+    def current():
+        knowledge_rows_response(rows)
+
+    return cpu_time(previous, repeat), cpu_time(current, repeat)
+
+
+def bench_conversation(conversation, messages, repeat: int):
+    def previous():
+        history = ConversationHistory(
+            conversation_id=conversation.id,
+            session_id=conversation.session_id,
+            user_id=conversation.user_id,
+            messages=[{"role": m.role, "content": m.content, "timestamp": m.timestamp} for m in messages],
+            created_at=conversation.created_at,
+            updated_at=conversation.updated_at
+        )
+        validated = ConversationHistory.model_validate(history, from_attributes=True)
+        json.dumps(jsonable_encoder(validated)).encode("utf-8")
+
+    def current():
+        json_response(conversation_history_dict(conversation, messages))
+
+    return cpu_time(previous, repeat), cpu_time(current, repeat)
+
+
+def bench_chat(repeat: int):
+    result = {
+        "response": "You can reset your password from the login page. " * 4,
+        "session_id": "session",
+        "conversation_id": "conv",
+        "sources": [{"title": "How to Reset Password", "category": "account", "content": "To reset..." * 20}] * 3,
+        "confidence": 0.85
+    }
+
+    def previous():
+        response = ChatResponse(**result)
+        validated = ChatResponse.model_validate(response, from_attributes=True)
+        json.dumps(jsonable_encoder(validated)).encode("utf-8")
+
+    def current():
+        json_response(result)
+
+    return cpu_time(previous, repeat), cpu_time(current, repeat)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark response serialization")
+    parser.add_argument("--rows", type=int, default=1000, help="Knowledge items in the listing")
+    parser.add_argument("--messages", type=int, default=200, help="Messages in the conversation")
+    parser.add_argument("--repeat", type=int, default=20, help="Repetitions per measurement")
+    parser.add_argument("--json", dest="json_path", default=None, help="Write results to this JSON file")
+    args = parser.parse_args()
+
+    conversation, messages = make_conversation(args.messages)
+    results = {
+        "GET /knowledge": bench_knowledge(make_knowledge_rows(args.rows), args.repeat),
+        "GET /conversation/{session_id}": bench_conversation(conversation, messages, args.repeat),
+        "POST /chat": bench_chat(args.repeat * 50),
+    }
+
+    print(f"{'endpoint':<32}{'previous (ms)':>16}{'orjson (ms)':>14}{'speedup':>10}")
+    for endpoint, (previous, current) in results.items():
+        print(f"{endpoint:<32}{previous * 1000:>16.3f}{current * 1000:>14.3f}{previous / current:>9.1f}x")
+
+    if args.json_path:
+        with open(args.json_path, "w") as output:
+            json.dump({
+                endpoint: {"previous_cpu_seconds": previous, "orjson_cpu_seconds": current}
+                for endpoint, (previous, current) in results.items()
+            }, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
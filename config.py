@@ -1,5 +1,5 @@
 import os
-from typing import Optional
+from typing import List, Optional
 from pydantic_settings import BaseSettings
 
 
@@ -27,6 +27,113 @@ class Settings(BaseSettings):
     model_name: str = "gpt-3.5-turbo"
     temperature: float = 0.7
     max_tokens: int = 1000
+    llm_streaming: bool = False  # Stream answer tokens over the WebSocket channel
+    llm_backend: str = "openai"  # openai or fake (local model with injected latency)
+    fake_llm_latency_ms: float = 500.0
+    fake_llm_jitter_ms: float = 100.0
+    fake_llm_error_rate: float = 0.0
+    
+    # LLM Resilience Configuration
+    llm_timeout_seconds: float = 30.0  # Deadline per LLM call, 0 disables
+    llm_breaker_failure_threshold: int = 5  # Consecutive failures that open the circuit, 0 disables
+    llm_breaker_reset_seconds: float = 30.0  # How long the circuit stays open before a trial call
+    llm_hedge_enabled: bool = False
+    llm_hedge_percentile: float = 0.95  # Start a backup call once a call is slower than this
+    llm_hedge_min_delay_ms: float = 100.0
+    llm_hedge_min_samples: int = 20  # Calls observed before hedging starts
+    
+    # Admission Control Configuration (limits apply per worker process)
+    admission_max_concurrency: int = 0  # Chat requests answered at once, 0 disables the limit
+    admission_max_queue: int = 100  # Requests waiting for a slot beyond which overflow applies
+    admission_queue_timeout_seconds: float = 10.0  # Longer waits overflow too, 0 waits indefinitely
+    admission_overflow: str = "degrade"  # degrade (knowledge base answer without the LLM) or reject (429)
+    admission_session_rate_per_minute: float = 0.0  # Token bucket refill per session, 0 disables
+    admission_session_burst: int = 5
+    admission_priority_users: List[str] = []  # user_id values served first, a JSON list in the environment
+    
+    # WebSocket Configuration
+    handoff_confidence_threshold: float = 0.5
+    
+    # Batch Chat Configuration
+    batch_max_items: int = 1000
+    batch_max_concurrency: int = 8
+    
+    # Memory Configuration
+    memory_mode: str = "window"  # window (recent turns only) or summary (running summary stored per conversation)
+    memory_window_turns: int = 10  # Recent exchanges sent with each question
+    memory_summary_batch_turns: int = 5  # Exchanges past the window collected before they are summarized
+    
+    # Session State Configuration (window-mode history, shared by workers unless in memory)
+    session_store: str = "memory"  # memory (this process only), sqlite (workers on one host) or redis
+    session_store_path: str = "./session_state.db"
+    session_store_url: str = "redis://localhost:6379/0"  # Redis or session_server.py
+    session_state_ttl_seconds: int = 86400  # Idle sessions are rebuilt from the database after this, 0 keeps them
+    session_state_max_sessions: int = 10000  # Sessions kept by the in-memory store
+    
+    # Retrieval Configuration
+    retrieval_infer_category: bool = True
+    retrieval_candidates: int = 50  # Lexical candidates re-ranked per chat retrieval, 0 for single-stage search
+    
+    # Suggestion Configuration (typeahead over article titles and frequent questions)
+    suggest_max_results: int = 10
+    suggest_top_questions: int = 1000  # Most frequent user questions mined from the messages table
+    suggest_min_question_count: int = 3  # Conversations a question must have been asked in to be suggested
+    suggest_refresh_seconds: float = 60.0  # Age after which an index is rebuilt in the background
+    
+    # Knowledge Deduplication Configuration
+    knowledge_dedup_threshold: float = 0.7  # Estimated shingle similarity at which articles are near-duplicates, 0 disables
+    
+    # Knowledge Sync Configuration (each worker applies stored knowledge base changes to its index)
+    knowledge_sync_interval_seconds: float = 2.0  # Bounds how stale a worker's index can be
+    knowledge_sync_batch_size: int = 500  # Changes read per query while catching up
+    
+    # Tenant Configuration (knowledge base per X-Tenant-ID; limits apply per worker process)
+    tenant_max_loaded: int = 100  # Tenant indexes kept in memory, 0 disables the limit
+    tenant_memory_budget_mb: float = 512.0  # Estimated memory of tenant indexes, 0 disables the limit
+    tenant_snapshot_path: str = "./tenant_snapshots"  # Indexes of unloaded tenants, reloaded from here
+    
+    # Embedding Configuration
+    embedding_backend: str = "none"  # none, hashing or openai
+    embedding_model: str = "text-embedding-ada-002"
+    embedding_cache_path: str = "./embedding_cache.db"
+    embedding_cache_size: int = 10000
+    
+    # Export Configuration
+    export_batch_size: int = 500
+    
+    # Profiling Configuration (adjustable at runtime via /admin/profiling)
+    profiling_sample_rate: float = 0.0
+    profiling_slow_threshold_ms: float = 0.0
+    profiling_buffer_size: int = 50
+    profiling_sampler_interval_ms: float = 5.0
+    profiling_max_watched: int = 16
+    admin_token: Optional[str] = None
+    
+    # Retention Configuration
+    retention_enabled: bool = True
+    retention_idle_days: int = 90
+    retention_batch_size: int = 100
+    retention_interval_seconds: int = 3600
+    archive_path: str = "./archive"
+    archive_segment_max_bytes: int = 64 * 1024 * 1024
+    
+    # Warm-up Configuration (readiness flips once warm-up is done)
+    warmup_enabled: bool = True
+    warmup_top_queries: int = 20  # Most frequent user questions replayed from the messages table
+    warmup_queries: List[str] = []  # Extra queries to replay, a JSON list in the environment
+    warmup_db_connections: int = 5
+    
+    # Demo Intent Configuration
+    intents_path: str = "./intents.json"
+    intents_reload_seconds: float = 1.0  # How often the file is checked for changes
+    
+    # Worker Configuration (production launcher, serve.py)
+    workers: int = 0  # 0 means one worker per CPU
+    worker_max_requests: int = 0  # Recycle a worker after this many requests, 0 disables
+    worker_max_requests_jitter: int = 0
+    worker_max_rss_mb: int = 0  # Recycle a worker above this resident memory, 0 disables
+    worker_graceful_timeout: int = 30
+    worker_stats_interval: int = 60
     
     class Config:
         env_file = ".env"
@@ -1,9 +1,10 @@
 #!/usr/bin/env python3
 """
 Demo version of the customer support chatbot that works without OpenAI API key.
-This version uses simple pattern matching for responses.
+This version answers from keyword intents loaded from intents.json.
 """
 
+import random
 import uuid
 from typing import List, Dict, Any, Optional
 from fastapi import FastAPI, HTTPException, status
@@ -15,6 +16,7 @@ import uvicorn
 from app.models import ChatRequest, ChatResponse, HealthCheck
 from app.database import get_db, DatabaseManager, init_db
 from fastapi import Depends
+from app.intents import IntentEngine
 from app.knowledge_base import KnowledgeBaseManager
 from config import settings
 
@@ -44,36 +46,11 @@ class DemoChatbot:
     def __init__(self):
         self.kb_manager = KnowledgeBaseManager()
         
-        # Simple response patterns
-        self.patterns = {
-            "password": [
-                "To reset your password, go to the login page and click 'Forgot Password'. Enter your email and check for a reset link.",
-                "You can reset your password by visiting our login page and clicking the 'Forgot Password' link."
-            ],
-            "return": [
-                "Our return policy allows returns within 30 days. Items must be in original condition with packaging.",
-                "You can return items within 30 days of purchase. Please ensure items are in original condition."
-            ],
-            "shipping": [
-                "Standard shipping takes 3-5 business days and is free for orders over $50.",
-                "We offer standard shipping (3-5 days), express shipping (1-2 days), and overnight options."
-            ],
-            "payment": [
-                "We accept Visa, Mastercard, American Express, PayPal, Apple Pay, and Google Pay.",
-                "You can pay with major credit cards, digital wallets like PayPal and Apple Pay, or bank transfers for business accounts."
-            ],
-            "hello": [
-                "Hello! How can I help you today? I can assist with password resets, returns, shipping, and payment questions.",
-                "Hi there! I'm here to help with your customer service needs. What can I assist you with?"
-            ],
-            "help": [
-                "I can help you with password resets, return policies, shipping information, payment methods, and account security.",
-                "I'm here to assist with various customer service topics. Just ask me about passwords, returns, shipping, or payments!"
-            ]
-        }
+        # Keyword intents, compiled from intents.json and reloaded when it changes
+        self.intents = IntentEngine()
     
     def get_response(self, user_message: str, session_id: str, db_manager: DatabaseManager) -> Dict[str, Any]:
-        """Get response using pattern matching."""
+        """Get response from the matching intent, or from the knowledge base."""
         try:
             # Get or create conversation
             conversation = db_manager.get_conversation(session_id)
@@ -83,20 +60,19 @@ class DemoChatbot:
             # Add user message to database
             db_manager.add_message(conversation.id, "user", user_message)
             
-            # Search knowledge base
-            kb_results = self.kb_manager.search(user_message, k=2)
-            
-            # Find matching pattern
-            user_lower = user_message.lower()
+            # Match the message against the intent catalogue
+            match = self.intents.match(user_message)
             response = None
             confidence = 0.5
             
-            for pattern, responses in self.patterns.items():
-                if pattern in user_lower:
-                    import random
-                    response = random.choice(responses)
-                    confidence = 0.8
-                    break
+            if match:
+                intent = match["intent"]
+                response = random.choice(intent.responses)
+                confidence = intent.confidence
+                # Sources only need the intent's own category
+                kb_results = self.kb_manager.search(user_message, k=2, category=intent.category) if intent.category else []
+            else:
+                kb_results = self.kb_manager.search(user_message, k=2)
             
             # If no pattern match, use knowledge base
             if not response and kb_results:
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+"""
+Export conversations and messages as NDJSON for analytics.
+"""
+
+import argparse
+from datetime import datetime
+
+from app.export import export_to_file
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Export conversations and messages as NDJSON")
+    parser.add_argument("output", help="Output file path (use a .gz suffix or --gzip to compress)")
+    parser.add_argument("--since", type=datetime.fromisoformat, default=None,
+                        help="Only export conversations updated after this ISO timestamp")
+    parser.add_argument("--until", type=datetime.fromisoformat, default=None,
+                        help="Only export conversations updated up to this ISO timestamp (default: now)")
+    parser.add_argument("--gzip", action="store_true", help="Gzip the output")
+    parser.add_argument("--batch-size", type=int, default=None, help="Rows fetched per database round trip")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    until = args.until or datetime.utcnow()
+    compress = args.gzip or args.output.endswith(".gz")
+
+    print(f"📤 Exporting conversations to {args.output}...")
+    count = export_to_file(args.output, since=args.since, until=until, compress=compress, batch_size=args.batch_size)
+    print(f"✅ Exported {count} records")
+    print(f"⏭️  Next incremental export: --since {until.isoformat()}")
@@ -1,10 +1,14 @@
 import uvicorn
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, PlainTextResponse
 import os
 
 from app.api import app as api_app
+from app.metrics import metrics
+from app.profiling import ProfilingMiddleware
+from app.serialization import json_response
+from app.warmup import start_application, warmup_state
 from config import settings
 
 # Create main app
@@ -14,6 +18,9 @@ app = FastAPI(
     version="1.0.0"
 )
 
+# Profile sampled and slow requests, including those served by the mounted API
+app.add_middleware(ProfilingMiddleware)
+
 # Mount the API
 app.mount("/api", api_app)
 
@@ -21,6 +28,12 @@ app.mount("/api", api_app)
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 
+@app.on_event("startup")
+async def startup_event():
+    """Run the API start-up; mounted apps do not receive startup events."""
+    await start_application()
+
+
 @app.get("/")
 async def read_index():
     """Serve the main chat interface."""
@@ -33,6 +46,24 @@ async def health_check():
     return {"status": "healthy", "version": "1.0.0"}
 
 
+@app.get("/health/live")
+async def liveness():
+    """Liveness probe: the process is up and serving requests."""
+    return {"status": "healthy", "version": "1.0.0"}
+
+
+@app.get("/health/ready")
+async def readiness():
+    """Readiness probe: 200 once warm-up has finished, 503 until then."""
+    return json_response(warmup_state.snapshot(), status_code=200 if warmup_state.ready else 503)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Expose pipeline metrics in the Prometheus text format."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 if __name__ == "__main__":
     print("🚀 Starting Customer Support Chatbot...")
     print(f"📱 Web Interface: http://{settings.host}:{settings.port}")
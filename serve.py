@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+"""
+Production launcher: serve the chatbot with several pre-forked workers.
+
+The knowledge base and chatbot are built once in the parent process and
+shared copy-on-write by the workers. Send SIGHUP to restart the workers one
+at a time and SIGTERM to stop them gracefully. Unlike main.py, this never
+runs the auto-reloader, whatever DEBUG is set to.
+"""
+
+import argparse
+
+from config import settings
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Serve the chatbot with multiple workers")
+    parser.add_argument("--host", default=None, help=f"Bind address (default: {settings.host})")
+    parser.add_argument("--port", type=int, default=None, help=f"Bind port (default: {settings.port})")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: WORKERS or one per CPU)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    print("🚀 Loading the knowledge base and chatbot...")
+    from main import app
+    from app.workers import WorkerManager
+
+    WorkerManager(app, host=args.host, port=args.port, workers=args.workers).run()
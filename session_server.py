@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for Redis that serves shared session state to the workers.
+
+Run it next to serve.py and point the workers at it:
+
+    SESSION_STORE=redis SESSION_STORE_URL=redis://127.0.0.1:6380/0 python serve.py
+
+State is kept in memory only; use a real Redis server where it has to
+survive restarts.
+"""
+
+import argparse
+import asyncio
+
+from app.session_server import SessionServer
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Serve session state over the Redis protocol")
+    parser.add_argument("--host", default="127.0.0.1", help="Bind address (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=6380, help="Bind port (default: 6380)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    try:
+        asyncio.run(SessionServer().serve(args.host, args.port))
+    except KeyboardInterrupt:
+        print("Session server stopped")